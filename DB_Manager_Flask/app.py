@@ -3,23 +3,183 @@
 from flask import Flask, request, jsonify
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
 from dotenv import load_dotenv
+from geohash import with_geohash
+from offer_cache import OfferCache
+import base64
+import datetime
+import json
 import os
 
 load_dotenv()
 app = Flask(__name__)
 
-# Initialize Firebase
-cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'serviceAccountKey.json')
-cred = credentials.Certificate(cred_path)
+# Firestore client, created on first use so the app can be imported without credentials
+# (benchmarks assign an in-memory fake here before sending requests)
+db = None
 
-firebase_admin.initialize_app(cred)
+def get_db():
+    global db
+    if db is None:
+        # Initialize Firebase
+        cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'serviceAccountKey.json')
+        cred = credentials.Certificate(cred_path)
 
-db = firestore.client()
+        firebase_admin.initialize_app(cred)
+
+        db = firestore.client()
+    return db
 
 # Collection name - OFFERS
 COLLECTION_NAME = 'offers'
 
+# Offers read by GET /documents/<id>, invalidated by this service's own writes; the TTL bounds
+# how long an offer changed by another instance can be served (can be replaced by a shared cache)
+cache = OfferCache(
+    max_entries=int(os.getenv('OFFER_CACHE_SIZE', '1024')),
+    ttl_seconds=float(os.getenv('OFFER_CACHE_TTL', '60'))
+)
+
+MAX_BATCH_WRITES = 500     # Firestore limit per batched write
+MAX_BULK_DOCUMENTS = 2000  # Per bulk request (split into several batches)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+DOCUMENT_ID = '__name__'   # Field path of the document id, the last ordering field of every page
+# Longest first, so 'discount>=10' is not read as 'discount>' '=10'
+FILTER_OPERATORS = ('>=', '<=', '!=', '==', '>', '<')
+RANGE_OPERATORS = ('>=', '<=', '!=', '>', '<')
+
+def _apply(batch, write):
+    kind, doc_ref, data = write
+    if kind == 'create':
+        batch.create(doc_ref, data)
+    elif kind == 'set':
+        batch.set(doc_ref, data)
+    elif kind == 'update':
+        batch.update(doc_ref, data)
+    else:
+        # Fails instead of silently succeeding when the document does not exist
+        batch.delete(doc_ref, option=get_db().write_option(exists=True))
+
+def _commit_writes(writes):
+    """
+    Commits (kind, doc_ref, data) writes in batches of MAX_BATCH_WRITES and returns the ids
+    whose precondition failed (update/delete of a missing document, create of an existing one).
+    """
+    failed = []
+    try:
+        for start in range(0, len(writes), MAX_BATCH_WRITES):
+            _commit_batch(writes[start:start + MAX_BATCH_WRITES], failed)
+    finally:
+        for _, doc_ref, _ in writes:
+            cache.invalidate(doc_ref.id)
+    return failed
+
+def _commit_batch(writes, failed):
+    # A batch is atomic, so when one of its writes fails nothing is written: commit each half
+    # again until the failing writes are isolated (a few extra commits, not one per write)
+    batch = get_db().batch()
+    for write in writes:
+        _apply(batch, write)
+    try:
+        batch.commit()
+    except (NotFound, AlreadyExists):
+        if len(writes) == 1:
+            failed.append(writes[0][1].id)
+        else:
+            middle = len(writes) // 2
+            _commit_batch(writes[:middle], failed)
+            _commit_batch(writes[middle:], failed)
+
+def _bulk_documents(payload, require_id):
+    """Validates {"documents": [{"id": ..., "data": {...}}]}; returns (documents, error)."""
+    documents = payload.get('documents') if isinstance(payload, dict) else None
+    if not isinstance(documents, list) or not documents:
+        return None, 'Expected a non-empty "documents" list'
+    if len(documents) > MAX_BULK_DOCUMENTS:
+        return None, f'At most {MAX_BULK_DOCUMENTS} documents per request'
+    ids = set()
+    for document in documents:
+        if not isinstance(document, dict) or not isinstance(document.get('data'), dict) or not document['data']:
+            return None, 'Every document needs a non-empty "data" object'
+        doc_id = document.get('id')
+        if doc_id is None and not require_id:
+            continue
+        if not isinstance(doc_id, str) or not doc_id or '/' in doc_id:
+            return None, 'Every document needs a valid "id"'
+        if doc_id in ids:
+            return None, f'Duplicated id: {doc_id}'
+        ids.add(doc_id)
+    return documents, None
+
+def _bulk_ids(payload):
+    """Validates {"ids": [...]}; returns (ids, error)."""
+    ids = payload.get('ids') if isinstance(payload, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return None, 'Expected a non-empty "ids" list'
+    if len(ids) > MAX_BULK_DOCUMENTS:
+        return None, f'At most {MAX_BULK_DOCUMENTS} ids per request'
+    if any(not isinstance(doc_id, str) or not doc_id or '/' in doc_id for doc_id in ids):
+        return None, 'Every id must be a non-empty string'
+    if len(set(ids)) != len(ids):
+        return None, 'Duplicated ids'
+    return ids, None
+
+def _parse_filter(expression):
+    """'discount>=10' -> ('discount', '>=', 10); values are JSON when they parse, strings otherwise."""
+    for operator in FILTER_OPERATORS:
+        field, found, raw = expression.partition(operator)
+        if found:
+            break
+    else:
+        raise ValueError(f'Invalid filter: {expression}')
+    field = field.strip()
+    if not field or field == DOCUMENT_ID:
+        raise ValueError(f'Invalid filter: {expression}')
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw
+    return field, operator, value
+
+def _cursor_value(value):
+    """JSON form of an ordering value: scalars as they are, timestamps and geopoints tagged."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, firestore.GeoPoint):
+        return {'geopoint': [value.latitude, value.longitude]}
+    raise TypeError(f'Cannot page on values of type {type(value).__name__}')
+
+def _from_cursor_value(value):
+    if isinstance(value, dict):
+        if 'datetime' in value:
+            return datetime.datetime.fromisoformat(value['datetime'])
+        if 'geopoint' in value:
+            latitude, longitude = value['geopoint']
+            return firestore.GeoPoint(latitude, longitude)
+        raise ValueError('Invalid cursor')
+    return value
+
+def _encode_cursor(values):
+    """Raises TypeError when an ordering value is neither a scalar, a timestamp nor a geopoint."""
+    payload = json.dumps([_cursor_value(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor')
+    try:
+        return [_from_cursor_value(value) for value in values]
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
 @app.route('/documents', methods=['POST'])
 def create_document():
     try:
@@ -27,22 +187,161 @@ def create_document():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
+        # Store the location cell alongside the coordinates
+        data = with_geohash(data)
+
         # Add a new document with auto-generated ID
-        doc_ref = db.collection(COLLECTION_NAME).add(data)
+        doc_ref = get_db().collection(COLLECTION_NAME).add(data)
         return jsonify({'id': doc_ref[1].id, 'data': data}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
     
+@app.route('/documents/bulk', methods=['POST'])
+def create_documents():
+    try:
+        documents, error = _bulk_documents(request.get_json(silent=True), require_id=False)
+        if error:
+            return jsonify({'error': error}), 400
+
+        collection = get_db().collection(COLLECTION_NAME)
+        writes = []
+        for document in documents:
+            data = with_geohash(document['data'])
+            if document.get('id') is None:
+                # Auto-generated ids cannot collide, no precondition needed
+                writes.append(('set', collection.document(), data))
+            else:
+                writes.append(('create', collection.document(document['id']), data))
+        conflicts = set(_commit_writes(writes))
+
+        created = [{'id': doc_ref.id, 'data': data} for _, doc_ref, data in writes if doc_ref.id not in conflicts]
+        return jsonify({'created': created, 'conflicts': sorted(conflicts)}), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/documents/bulk', methods=['PUT'])
+def update_documents():
+    try:
+        documents, error = _bulk_documents(request.get_json(silent=True), require_id=True)
+        if error:
+            return jsonify({'error': error}), 400
+
+        collection = get_db().collection(COLLECTION_NAME)
+        writes = [('update', collection.document(document['id']), with_geohash(document['data'])) for document in documents]
+        not_found = set(_commit_writes(writes))
+
+        updated = [{'id': doc_ref.id, 'data': data} for _, doc_ref, data in writes if doc_ref.id not in not_found]
+        return jsonify({'updated': updated, 'not_found': sorted(not_found)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/documents/bulk', methods=['DELETE'])
+def delete_documents():
+    try:
+        ids, error = _bulk_ids(request.get_json(silent=True))
+        if error:
+            return jsonify({'error': error}), 400
+
+        collection = get_db().collection(COLLECTION_NAME)
+        not_found = set(_commit_writes([('delete', collection.document(doc_id), None) for doc_id in ids]))
+
+        deleted = [doc_id for doc_id in ids if doc_id not in not_found]
+        return jsonify({'deleted': deleted, 'not_found': sorted(not_found)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/documents', methods=['GET'])
+def list_documents():
+    """
+    Cursor-paginated listing. Query parameters:
+      limit           page size (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE)
+      cursor          next_cursor of the previous page
+      fields          comma-separated fields to return (all when omitted)
+      filter          repeatable, field<op>value with op in ==, !=, <, <=, >, >=
+      geohash_prefix  offers inside a geohash cell
+      order_by        field to sort by, '-field' for descending (default: the range-filtered field)
+    """
+    try:
+        try:
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+            filters = [_parse_filter(expression) for expression in request.args.getlist('filter')]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        prefix = request.args.get('geohash_prefix')
+        if prefix:
+            filters += [('geohash', '>=', prefix), ('geohash', '<', prefix + '~')]
+
+        # Firestore needs the first ordering on the field with a range filter
+        order_by = request.args.get('order_by')
+        if order_by:
+            descending = order_by.startswith('-')
+            order_field = order_by.lstrip('-')
+        else:
+            descending = False
+            order_field = next((field for field, operator, _ in filters if operator in RANGE_OPERATORS), None)
+        orders = [(order_field, descending)] if order_field and order_field != DOCUMENT_ID else []
+        orders.append((DOCUMENT_ID, descending if order_field == DOCUMENT_ID else False))
+
+        query = get_db().collection(COLLECTION_NAME)
+        for field, operator, value in filters:
+            query = query.where(field, operator, value)
+        for field, field_descending in orders:
+            query = query.order_by(field, direction='DESCENDING' if field_descending else 'ASCENDING')
+
+        fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+        if fields:
+            # The ordering fields are read too, they are needed to build the next cursor
+            query = query.select(list(dict.fromkeys(fields + [field for field, _ in orders[:-1]])))
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                query = query.start_after(_decode_cursor(cursor, len(orders)))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        snapshots = list(query.limit(limit).stream())
+        documents = []
+        for doc in snapshots:
+            data = doc.to_dict()
+            if fields:
+                data = {field: data[field] for field in fields if field in data}
+            documents.append({'id': doc.id, 'data': data})
+
+        next_cursor = None
+        if len(snapshots) == limit:
+            last = snapshots[-1]
+            try:
+                next_cursor = _encode_cursor([last.get(field) for field, _ in orders[:-1]] + [last.id])
+            except TypeError as e:
+                # Maps, arrays, references... as the ordering field
+                return jsonify({'error': f'order_by {order_field}: {e}'}), 400
+        return jsonify({'documents': documents, 'next_cursor': next_cursor}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/documents/<doc_id>', methods=['GET'])
 def get_document(doc_id):
     try:
-        doc_ref = db.collection(COLLECTION_NAME).document(doc_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            return jsonify({'id': doc.id, 'data': doc.to_dict()}), 200
-        else:
-            return jsonify({'error': 'Document not found'}), 404
+        offer = cache.get(doc_id)
+        if offer is None:
+            token = cache.begin(doc_id)
+            doc_ref = get_db().collection(COLLECTION_NAME).document(doc_id)
+            doc = doc_ref.get()
+            if not doc.exists:
+                return jsonify({'error': 'Document not found'}), 404
+            offer = cache.put(doc_id, doc.to_dict(), getattr(doc, 'update_time', None), token)
+
+        response = jsonify({'id': doc_id, 'data': offer.data})
+        response.set_etag(offer.etag)
+        response.last_modified = offer.last_modified
+        # Clients may keep the offer but must revalidate it, which costs a 304 when it did not change
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -53,26 +352,30 @@ def update_document(doc_id):
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        doc_ref = db.collection(COLLECTION_NAME).document(doc_id)
-        doc = doc_ref.get()
-        if doc.exists:
+        data = with_geohash(data)
+        doc_ref = get_db().collection(COLLECTION_NAME).document(doc_id)
+        # update() already fails when the document does not exist, no need to read it first
+        try:
             doc_ref.update(data)
-            return jsonify({'id': doc.id, 'data': data}), 200
-        else:
+        except NotFound:
             return jsonify({'error': 'Document not found'}), 404
+        finally:
+            cache.invalidate(doc_id)
+        return jsonify({'id': doc_id, 'data': data}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/documents/<doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
     try:
-        doc_ref = db.collection(COLLECTION_NAME).document(doc_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_ref.delete()
-            return jsonify({'message': 'Document deleted successfully'}), 200
-        else:
+        doc_ref = get_db().collection(COLLECTION_NAME).document(doc_id)
+        try:
+            doc_ref.delete(option=get_db().write_option(exists=True))
+        except NotFound:
             return jsonify({'error': 'Document not found'}), 404
+        finally:
+            cache.invalidate(doc_id)
+        return jsonify({'message': 'Document deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,38 @@
+# geohash.py
+
+GEOHASH_PRECISION = 7  # ~153 m x 153 m; each prefix is the cell at a coarser resolution
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a location (same algorithm as SmartFeature/services/geohash.py)."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    cell, bits, value, even = [], 0, 0, True
+    while len(cell) < precision:
+        # Even bits split the longitude and odd bits the latitude
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(cell)
+
+def with_geohash(data):
+    """
+    Adds 'geohash' to a document with location.latitude/longitude, so that area queries are
+    prefix comparisons instead of distance computations.
+    """
+    location = data.get('location')
+    if isinstance(location, dict):
+        latitude, longitude = location.get('latitude'), location.get('longitude')
+        if isinstance(latitude, (int, float)) and isinstance(longitude, (int, float)):
+            return {**data, 'geohash': encode(latitude, longitude)}
+    return data
@@ -0,0 +1,108 @@
+# offer_cache.py
+
+from collections import OrderedDict
+from threading import Lock
+import datetime
+import hashlib
+import json
+import time
+
+class CachedOffer:
+    __slots__ = ("data", "etag", "last_modified", "cached_at")
+
+    def __init__(self, data, etag, last_modified, cached_at):
+        self.data = data
+        self.etag = etag                    # Content hash: changes if and only if the offer changes
+        self.last_modified = last_modified  # Document update_time (or when it was read)
+        self.cached_at = cached_at
+
+def offer_etag(doc_id, data):
+    """Strong ETag of an offer, from its canonical JSON."""
+    payload = json.dumps({'id': doc_id, 'data': data}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+class OfferCache:
+    def __init__(self, max_entries=1024, ttl_seconds=60.0):
+        """
+        Bounded in-process LRU/TTL cache of offers by id. The app's write handlers invalidate it;
+        the TTL bounds how long an offer changed by another instance can be served. Any object
+        with begin/get/put/invalidate/stats can replace it (e.g. a cache shared between instances).
+
+        Args:
+            max_entries (int): Offers kept in memory before evicting the least recently used.
+            ttl_seconds (float): Seconds a cached offer is considered valid.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = Lock()  # Flask serves each request in its own thread
+        # Logical clock of invalidations, so that what a request read before a write started is
+        # not stored (see begin/put)
+        self._clock = 0
+        self._invalidated = OrderedDict()  # doc_id -> clock of its last invalidation
+        self._forgotten = 0  # Clock of the latest invalidation no longer remembered
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_reads = 0
+
+    def get(self, doc_id):
+        """Returns the cached offer, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None or time.monotonic() - entry.cached_at > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(doc_id)
+            self.hits += 1
+            return entry
+
+    def begin(self, doc_id):
+        """Token taken before reading the offer from Firestore; passed to put afterwards."""
+        with self._lock:
+            return self._clock
+
+    def put(self, doc_id, data, update_time=None, token=None):
+        """
+        Stores an offer read from Firestore and returns it as a CachedOffer. If the offer was
+        invalidated after token (written while it was being read) it is not stored: what was
+        read may be the previous version.
+        """
+        entry = CachedOffer(data, offer_etag(doc_id, data),
+                            update_time or datetime.datetime.now(datetime.timezone.utc), time.monotonic())
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            if token is not None and (token < self._forgotten or self._invalidated.get(doc_id, -1) > token):
+                self.stale_reads += 1
+                return entry
+            self._entries[doc_id] = entry
+            self._entries.move_to_end(doc_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, doc_id):
+        """Drops the offer; called after each write of the app to it."""
+        with self._lock:
+            self._clock += 1
+            self._invalidated[doc_id] = self._clock
+            self._invalidated.move_to_end(doc_id)
+            while len(self._invalidated) > self.max_entries:
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            if self._entries.pop(doc_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_reads": self.stale_reads
+            }
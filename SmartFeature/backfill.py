@@ -0,0 +1,149 @@
+"""
+Recalcula los flags locationAnomaly/amountAnomaly de todas las transacciones de todos los
+usuarios (por ejemplo después de cambiar MAX_NORMAL_DISTANCE o los parámetros de LOF).
+
+Los usuarios se reparten entre procesos; cada proceso carga el historial de un usuario,
+analiza cada transacción contra las anteriores a ella y escribe los flags en WriteBatches.
+Los usuarios con todos sus flags escritos se anotan en un checkpoint para poder reanudar
+(con --dry-run no se anota ninguno: no se escribió nada).
+
+Uso (desde SmartFeature/):
+    python backfill.py --workers 8 --checkpoint backfill.checkpoint
+    python backfill.py --users user-1 user-2 --dry-run
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Set
+from config import FirebaseConfig
+from services.firestore_service import FirestoreService
+from services.history_cache import TransactionHistoryCache
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.batch_analysis_service import BatchAnalysisService
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("backfill")
+
+# Estado de cada proceso worker (se inicializa una vez por proceso)
+_worker = {}
+
+def _init_worker(dry_run: bool):
+    FirebaseConfig()
+    # Cada usuario se lee una sola vez: no tiene sentido guardar historiales en caché
+    _worker['firestore_service'] = FirestoreService(cache=TransactionHistoryCache(max_users=0))
+    _worker['batch_analysis_service'] = BatchAnalysisService(AnomalyDetectionService(), AmountAnomalyService())
+    _worker['dry_run'] = dry_run
+    # El cliente asíncrono queda ligado a un event loop: se reutiliza el mismo en todo el proceso
+    _worker['loop'] = asyncio.new_event_loop()
+
+def _rescore_user(user_id: str) -> dict:
+    return _worker['loop'].run_until_complete(_rescore_user_async(user_id))
+
+async def _rescore_user_async(user_id: str) -> dict:
+    started = time.perf_counter()
+    firestore_service = _worker['firestore_service']
+    batch_analysis_service = _worker['batch_analysis_service']
+
+    history = await firestore_service.get_user_history(user_id, refresh=True)
+    transactions, _, _ = batch_analysis_service.select(history)
+    scores = batch_analysis_service.score(history, transactions)
+
+    written = 0
+    if not _worker['dry_run']:
+        written = await firestore_service.update_anomalies_batch(
+            user_id, history, {score.transaction.transaction_id: score.flags() for score in scores}
+        )
+
+    return {
+        'user_id': user_id,
+        'scored': len(scores),
+        'written': written,
+        'location_anomalies': sum(1 for score in scores if score.location[0]),
+        'amount_anomalies': sum(1 for score in scores if score.amount[0]),
+        'seconds': time.perf_counter() - started
+    }
+
+async def _list_user_ids() -> List[str]:
+    FirebaseConfig()
+    return await FirestoreService().list_user_ids()
+
+def _read_checkpoint(path: str) -> Set[str]:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as checkpoint:
+        return {line.strip() for line in checkpoint if line.strip()}
+
+def run(user_ids: List[str], workers: int, checkpoint_path: str = None, dry_run: bool = False) -> dict:
+    """
+    Re-analiza los usuarios indicados con un pool de procesos, saltando los que ya están
+    en el checkpoint, y devuelve los totales. Un usuario con flags sin escribir cuenta como
+    fallido y no se anota en el checkpoint.
+    """
+    done = _read_checkpoint(checkpoint_path)
+    pending = [user_id for user_id in user_ids if user_id not in done]
+    logger.info(f"{len(user_ids)} users, {len(user_ids) - len(pending)} already done, {len(pending)} pending")
+
+    totals = {'users': 0, 'failed': 0, 'scored': 0, 'written': 0, 'location_anomalies': 0, 'amount_anomalies': 0}
+    started = time.perf_counter()
+    checkpoint = open(checkpoint_path, 'a') if checkpoint_path else None
+
+    try:
+        # spawn: los clientes gRPC de Firestore no sobreviven a un fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(dry_run,)) as pool:
+            futures = {pool.submit(_rescore_user, user_id): user_id for user_id in pending}
+            for future in as_completed(futures):
+                user_id = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    totals['failed'] += 1
+                    logger.error(f"Error re-scoring user {user_id}: {str(e)}")
+                    continue
+
+                for key in ('scored', 'written', 'location_anomalies', 'amount_anomalies'):
+                    totals[key] += result[key]
+                if not dry_run and result['written'] < result['scored']:
+                    # Algunos flags no se escribieron: el usuario queda fuera del checkpoint para reintentarlo
+                    totals['failed'] += 1
+                    logger.error(f"User {user_id}: only {result['written']} of {result['scored']} flags written")
+                else:
+                    totals['users'] += 1
+                    if checkpoint and not dry_run:
+                        checkpoint.write(user_id + '\n')
+                        checkpoint.flush()
+
+                finished = totals['users'] + totals['failed']
+                elapsed = time.perf_counter() - started
+                rate = totals['scored'] / elapsed if elapsed else 0.0
+                eta = elapsed / finished * (len(pending) - finished)
+                logger.info(
+                    f"[{finished}/{len(pending)}] {user_id}: {result['scored']} transactions "
+                    f"in {result['seconds']:.1f}s | {rate:.0f} tx/s | ETA {eta:.0f}s"
+                )
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    totals['seconds'] = round(time.perf_counter() - started, 1)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', nargs='*', help='Usuarios a re-analizar (por defecto, todos)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Procesos en paralelo')
+    parser.add_argument('--checkpoint', help='Archivo donde se anotan los usuarios terminados para reanudar')
+    parser.add_argument('--dry-run', action='store_true', help='Analizar sin escribir los flags')
+    args = parser.parse_args()
+
+    user_ids = args.users or asyncio.run(_list_user_ids())
+    totals = run(user_ids, args.workers, args.checkpoint, args.dry_run)
+    logger.info(f"Backfill finished: {totals}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Equivalencia y rendimiento del LOF 1-D de montos frente a scikit-learn.
+
+--check compara, para muchos historiales aleatorios, las etiquetas y puntuaciones de
+LocalOutlierFactor1D.fit_predict, LocalOutlierFactor1D.is_outlier y AmountModel con
+sklearn.neighbors.LocalOutlierFactor(n_neighbors=5, contamination=0.1), y termina con
+código 1 si alguna difiere.
+
+Con montos redondeados o muy repetidos hay empates de distancia entre vecinos, y ahí
+scikit-learn elige según el recorrido del árbol o del heap de su búsqueda (kd_tree y brute
+no eligen lo mismo: se reporta en cuántos casos difieren sus etiquetas). Esos casos se
+comparan con una búsqueda exhaustiva que desempata por índice, con las fórmulas de LOF de
+scikit-learn, y también deben coincidir; la diferencia con scikit-learn se reporta aparte.
+
+Sin --check mide el tiempo por análisis para tamaños de historial de 10 a 1M.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_amount_lof --check
+    python -m benchmarks.bench_amount_lof --sizes 10 100 1000 10000 100000 1000000
+"""
+from sklearn.neighbors import LocalOutlierFactor
+from services.amount_anomaly_service import AmountModel, LocalOutlierFactor1D
+import argparse
+import json
+import sys
+import time
+import warnings
+import numpy as np
+
+N_NEIGHBORS = 5
+CONTAMINATION = 0.1
+
+def _histories(rng: np.random.Generator, cases: int, kind: str):
+    distributions = [
+        lambda n: rng.lognormal(3, 1, n),
+        lambda n: rng.uniform(1, 500, n),
+        lambda n: np.concatenate((rng.normal(50, 5, n - n // 10), rng.lognormal(6, 1, n // 10))),
+        lambda n: rng.pareto(1.5, n) * 20,
+    ]
+    for case in range(cases):
+        n = int(rng.integers(N_NEIGHBORS, 2000))
+        amounts = np.abs(distributions[case % len(distributions)](n)) + 1
+        amount = float(rng.choice([rng.choice(amounts) * rng.uniform(0.9, 1.1), rng.lognormal(4, 2)]))
+        if kind == 'rounded':
+            amounts, amount = np.round(amounts), float(np.round(amount))
+        elif kind == 'duplicates':
+            # Pocos precios distintos (suscripciones, recargas...): grupos grandes de montos iguales
+            prices = np.round(rng.lognormal(3, 1, int(rng.integers(2, 12))), 2)
+            amounts = rng.choice(prices, n)
+            amount = float(rng.choice([rng.choice(prices), np.round(rng.lognormal(3, 1.5), 2)]))
+        yield amounts, amount
+
+def _index_ordered_lof(values: np.ndarray):
+    """
+    LOF con las fórmulas de scikit-learn y búsqueda exhaustiva de los k+1 vecinos (el punto
+    incluido) ordenados por distancia y luego por índice; devuelve (negative_outlier_factor_, etiquetas).
+    """
+    n = len(values)
+    samples = np.arange(n)
+    distances = np.abs(values[:, None] - values[None, :])
+    nearest = np.argsort(distances, axis=1, kind='stable')[:, :N_NEIGHBORS + 1]
+    # Como KNeighborsMixin.kneighbors(X=None): se quita el propio punto (o el primero si no está)
+    keep = nearest != samples[:, None]
+    keep[keep.all(axis=1), 0] = False
+    neighbors = nearest[keep].reshape(n, N_NEIGHBORS)
+
+    neighbor_distances = distances[samples[:, None], neighbors]
+    k_distances = neighbor_distances[:, -1]
+    reach_distances = np.maximum(neighbor_distances, k_distances[neighbors])
+    lrd = 1.0 / (np.mean(reach_distances, axis=1) + 1e-10)
+    factors = -np.mean(lrd[neighbors] / lrd[:, None], axis=1)
+    return factors, np.where(factors < np.percentile(factors, 100.0 * CONTAMINATION), -1, 1)
+
+def check(cases: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    warnings.filterwarnings('ignore')  # sklearn avisa de duplicados en los casos redondeados
+    report = {}
+    for kind in ('continuous', 'rounded', 'duplicates'):
+        mismatches = {'fit_predict': 0, 'negative_outlier_factor': 0, 'is_outlier': 0, 'incremental_model': 0}
+        sklearn_mismatches = {'fit_predict': 0, 'is_outlier': 0, 'brute_vs_kd_tree': 0}
+        for amounts, amount in _histories(rng, cases, kind):
+            values = np.append(amounts, amount)
+            sklearn = LocalOutlierFactor(n_neighbors=N_NEIGHBORS, contamination=CONTAMINATION)
+            sklearn_labels = sklearn.fit_predict(values.reshape(-1, 1))
+            if kind == 'continuous':
+                expected_factors, expected = sklearn.negative_outlier_factor_, sklearn_labels
+            else:
+                expected_factors, expected = _index_ordered_lof(values)
+                brute = LocalOutlierFactor(n_neighbors=N_NEIGHBORS, contamination=CONTAMINATION, algorithm='brute')
+                sklearn_mismatches['brute_vs_kd_tree'] += int(not np.array_equal(
+                    brute.fit_predict(values.reshape(-1, 1)), sklearn_labels
+                ))
+
+            engine = LocalOutlierFactor1D(N_NEIGHBORS, CONTAMINATION)
+            labels = engine.fit_predict(values)
+            mismatches['fit_predict'] += int(not np.array_equal(labels, expected))
+            mismatches['negative_outlier_factor'] += int(not np.allclose(engine.negative_outlier_factor_, expected_factors))
+            mismatches['is_outlier'] += int(engine.is_outlier(amounts, amount) != (expected[-1] == -1))
+            sklearn_mismatches['fit_predict'] += int(not np.array_equal(labels, sklearn_labels))
+            sklearn_mismatches['is_outlier'] += int(labels[-1] != sklearn_labels[-1])
+
+            # El modelo incremental, construido monto a monto, debe dar el mismo veredicto
+            model = AmountModel(amounts[:N_NEIGHBORS + 1], N_NEIGHBORS, CONTAMINATION)
+            for value in amounts[N_NEIGHBORS + 1:]:
+                model.add(value)
+            mismatches['incremental_model'] += int(model.score(amount)[0] != (expected[-1] == -1))
+        report[f'{kind}_amounts'] = {'cases': cases, 'mismatches': mismatches}
+        if kind != 'continuous':
+            report[f'{kind}_amounts']['versus_sklearn'] = sklearn_mismatches
+    return report
+
+def _timed(fn, min_seconds: float = 0.2) -> float:
+    runs, started = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / runs * 1000
+
+def benchmark(sizes, max_sklearn_size: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        amounts = rng.lognormal(3, 1, size)
+        amount = float(rng.lognormal(3, 1))
+        values = np.append(amounts, amount).reshape(-1, 1)
+        engine = LocalOutlierFactor1D(N_NEIGHBORS, CONTAMINATION)
+        model = AmountModel(amounts, N_NEIGHBORS, CONTAMINATION)
+
+        row = {'history_size': size}
+        if size <= max_sklearn_size:
+            row['sklearn_fit_predict_ms'] = round(_timed(
+                lambda: LocalOutlierFactor(n_neighbors=N_NEIGHBORS, contamination=CONTAMINATION).fit_predict(values)
+            ), 4)
+        row['lof1d_fit_predict_ms'] = round(_timed(lambda: engine.fit_predict(values)), 4)
+        row['lof1d_is_outlier_ms'] = round(_timed(lambda: engine.is_outlier(amounts, amount)), 4)
+        row['incremental_model_score_ms'] = round(_timed(lambda: model.score(amount)), 4)
+        if 'sklearn_fit_predict_ms' in row:
+            row['speedup_is_outlier'] = round(row['sklearn_fit_predict_ms'] / row['lof1d_is_outlier_ms'], 1)
+            row['speedup_incremental'] = round(row['sklearn_fit_predict_ms'] / row['incremental_model_score_ms'], 1)
+        results.append(row)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='Verificar equivalencia con scikit-learn')
+    parser.add_argument('--cases', type=int, default=200)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--max-sklearn-size', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        report = check(args.cases, args.seed)
+        print(json.dumps({'benchmark': 'amount_lof_equivalence', 'results': report}, indent=2))
+        if any(any(result['mismatches'].values()) for result in report.values()):
+            sys.exit(1)
+        return
+
+    results = benchmark(args.sizes, args.max_sklearn_size, args.seed)
+    print(json.dumps({'benchmark': 'amount_lof', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Analizar todas las transacciones de un historial, cada una contra su prefijo (lo que hacen el
+análisis por lotes y el backfill), copiando las anteriores en una lista nueva por transacción
+(previous_transactions = [t for t in ... if t.dateTime < ...]) frente a pedir al historial el
+prefijo como vista (TransactionHistory.before), que los detectores leen sin copiarlo.
+
+Con listas cada análisis recorre y copia todo el prefijo, así que el lote completo crece como
+n²; con vistas cada análisis hace búsquedas binarias y solo lee lo que los modelos no han visto.
+
+--check verifica que los dos caminos den los mismos veredictos. Termina con código 1 si no.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_batch_prefixes --check
+    python -m benchmarks.bench_batch_prefixes --sizes 500 2000 4000
+    python -m benchmarks.bench_batch_prefixes --views-only --sizes 10000 50000
+"""
+from datetime import datetime, timedelta, timezone
+from models import Transaction, Location
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.batch_analysis_service import BatchAnalysisService
+from services.transaction_history import TransactionHistory
+import argparse
+import json
+import sys
+import time
+import warnings
+import numpy as np
+
+def synthetic_transactions(size: int, rng: np.random.Generator):
+    """Montos log-normales de dos tipos, cada 30 h, alrededor de 1-3 zonas (10% sin ubicación)."""
+    zones = rng.uniform([-40, -80], [50, 40], size=(rng.integers(1, 4), 2))
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    transactions = []
+    for i in range(size):
+        location = None
+        if rng.random() >= 0.1:
+            latitude, longitude = zones[rng.integers(len(zones))] + rng.normal(0, 0.05, 2)
+            location = Location(latitude=float(latitude), longitude=float(longitude))
+        transactions.append(Transaction(
+            transaction_id=f"tx-{i}", amount=float(np.round(rng.lognormal(3.5, 1.0), 2)),
+            transactionType="Expense" if rng.random() < 0.8 else "Income", transactionName="bench",
+            dateTime=started + timedelta(hours=30 * i), location=location
+        ))
+    return transactions
+
+def score_with_lists(batch: BatchAnalysisService, transactions):
+    """El camino anterior: una lista con las transacciones previas por cada transacción analizada."""
+    location_model = batch.anomaly_service.new_location_model()
+    amount_models = {}
+    verdicts = []
+    for transaction in transactions:
+        previous_transactions = [t for t in transactions if t.dateTime < transaction.dateTime]
+        amount_model = amount_models.setdefault(
+            transaction.transactionType, batch.amount_anomaly_service.new_amount_model()
+        )
+        verdicts.append((
+            batch.anomaly_service.detect_anomaly(transaction, previous_transactions, model=location_model)[0],
+            batch.amount_anomaly_service.detect_amount_anomaly(transaction, previous_transactions, model=amount_model)[0]
+        ))
+    return verdicts
+
+def score_with_views(batch: BatchAnalysisService, transactions):
+    history = TransactionHistory(transactions)
+    return [(score.location[0], score.amount[0]) for score in batch.score(history, transactions)]
+
+def new_batch() -> BatchAnalysisService:
+    return BatchAnalysisService(AnomalyDetectionService(), AmountAnomalyService())
+
+def run(size: int, seed: int, compare_lists: bool) -> dict:
+    transactions = synthetic_transactions(size, np.random.default_rng(seed))
+    result = {'size': size}
+
+    began = time.perf_counter()
+    views = score_with_views(new_batch(), transactions)
+    result['views_s'] = round(time.perf_counter() - began, 3)
+
+    if compare_lists:
+        began = time.perf_counter()
+        lists = score_with_lists(new_batch(), transactions)
+        result['lists_s'] = round(time.perf_counter() - began, 3)
+        result['speedup'] = round(result['lists_s'] / max(result['views_s'], 1e-9), 1)
+        result['disagreements'] = sum(a != b for a, b in zip(views, lists))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='Verificar que listas y vistas den los mismos veredictos')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 4000])
+    parser.add_argument('--views-only', action='store_true', help='Medir solo las vistas (historiales grandes)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")  # Avisos de KMeans con pocos puntos distintos
+
+    if args.check:
+        results = [run(size, args.seed, compare_lists=True) for size in (50, 300)]
+        passed = all(result['disagreements'] == 0 for result in results)
+        print(json.dumps({'benchmark': 'batch_prefixes_check', 'passed': passed, 'results': results}, indent=2))
+        if not passed:
+            sys.exit(1)
+        return
+
+    results = [run(size, args.seed, compare_lists=not args.views_only) for size in args.sizes]
+    print(json.dumps({'benchmark': 'batch_prefixes', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Micro-benchmarks de cada detector sobre usuarios sintéticos (benchmarks/synthetic.py), por
+tamaño de historial, tal como los llaman los endpoints (la última transacción contra las
+anteriores, con el modelo en memoria del usuario):
+
+- location_kmeans / location_density: detect_anomaly con cada backend de zonas habituales.
+- amount: detect_amount_anomaly (LOF por tipo de transacción).
+- statistics: get_transaction_statistics.
+
+cold: el usuario no tiene modelo en memoria (se ajusta sobre todo el historial); warm: el
+modelo ya está al día y se reutiliza. De cada usuario se toma el mejor de --repeat análisis
+(como timeit, para que una interrupción del proceso no cuente) y se reporta la media y los
+percentiles entre usuarios en microsegundos.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_detectors --sizes 50 500 5000 --users 20
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.synthetic import SyntheticUsers
+from services.firestore_service import FirestoreService
+from services.history_cache import TransactionHistoryCache
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+import argparse
+import asyncio
+import json
+import time
+import warnings
+import numpy as np
+
+def location_service(backend: str) -> AnomalyDetectionService:
+    service = AnomalyDetectionService()
+    service.LOCATION_BACKEND = backend
+    return service
+
+def detectors():
+    """nombre -> (crea el servicio, analiza (servicio, user_id, historial, transacción, warm))."""
+    def location(service, user_id, history, transaction, warm):
+        model = service.location_model(user_id) if warm else service.new_location_model()
+        service.detect_anomaly(transaction, history.before(transaction.dateTime), model=model)
+
+    def amount(service, user_id, history, transaction, warm):
+        model = service.amount_model(user_id, transaction.transactionType) if warm else service.new_amount_model()
+        service.detect_amount_anomaly(transaction, history.before(transaction.dateTime), model=model)
+
+    def statistics(service, user_id, history, transaction, warm):
+        service.get_transaction_statistics(history, aggregate=service.statistics_aggregate(user_id) if warm else None)
+
+    return {
+        'location_kmeans': (lambda: location_service('kmeans'), location),
+        'location_density': (lambda: location_service('density'), location),
+        'amount': (AmountAnomalyService, amount),
+        'statistics': (AmountAnomalyService, statistics)
+    }
+
+async def load_histories(size: int, users: int, seed: int):
+    db = FakeFirestore()
+    synthetic = SyntheticUsers(users=users, history=(size, size), seed=seed).populate(db)
+    service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    histories = []
+    for user in synthetic:
+        history = await service.get_user_history(user.user_id)
+        histories.append((user.user_id, history, history.get(user.last_transaction_id)))
+    return histories
+
+def measure(create, analyze, histories, warm: bool, repeat: int) -> dict:
+    warmup = create()  # Imports perezosos y pools de hilos de scikit-learn fuera de la medición
+    for user_id, history, transaction in histories:
+        analyze(warmup, user_id, history, transaction, False)
+
+    service = create()
+    samples = []
+    for user_id, history, transaction in histories:
+        if warm:
+            analyze(service, user_id, history, transaction, True)  # Deja el modelo al día
+        best = float('inf')
+        for _ in range(repeat):
+            began = time.perf_counter()
+            analyze(service, user_id, history, transaction, warm)
+            best = min(best, time.perf_counter() - began)
+        samples.append(best)
+    samples_us = np.array(samples) * 1e6
+    return {
+        "users": len(samples),
+        "mean_us": round(float(samples_us.mean()), 1),
+        "p50_us": round(float(np.percentile(samples_us, 50)), 1),
+        "p99_us": round(float(np.percentile(samples_us, 99)), 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000], help='Transacciones por usuario')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3, help='Análisis por usuario y modo')
+    parser.add_argument('--detectors', nargs='+', default=list(detectors()), choices=list(detectors()))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    results = {}
+    for size in args.sizes:
+        histories = asyncio.run(load_histories(size, args.users, args.seed))
+        for name in args.detectors:
+            create, analyze = detectors()[name]
+            results.setdefault(name, {})[size] = {
+                mode: measure(create, analyze, histories, mode == 'warm', args.repeat)
+                for mode in ('cold', 'warm')
+            }
+    print(json.dumps({'benchmark': 'detectors', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
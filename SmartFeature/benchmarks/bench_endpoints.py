@@ -0,0 +1,117 @@
+"""
+Carga concurrente de punta a punta sobre los tres endpoints de análisis
+(/analyze-transaction-location, -amount y -complete) con usuarios sintéticos
+(benchmarks/synthetic.py) en el Firestore falso con latencia por llamada.
+
+Cada petición elige un usuario al azar (los de historial largo igual que los cortos) y
+analiza una de sus últimas --recent transacciones con uno de los tres endpoints; a lo sumo
+--concurrency peticiones en curso. La caché de historiales arranca fría. Se reporta por
+endpoint la latencia (p50/p95/p99) y, en total, el throughput, los documentos leídos y
+escritos en Firestore y el tiempo acumulado por etapa (services/metrics.py).
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_endpoints --users 100 --requests 2000 --concurrency 50 --latency 0.01
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.synthetic import SyntheticUsers
+from dependencies import ServiceContainer
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.history_cache import TransactionHistoryCache
+from services.metrics import metrics
+import argparse
+import asyncio
+import json
+import logging
+import time
+import warnings
+import httpx
+import numpy as np
+import main
+
+ENDPOINTS = ('location', 'amount', 'complete')
+
+async def run(args) -> dict:
+    db = FakeFirestore(latency=args.latency)
+    users = SyntheticUsers(users=args.users, history=(args.min_history, args.max_history), seed=args.seed).populate(db)
+    firestore_service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    main.app.state.services = ServiceContainer(
+        firestore_service=firestore_service,
+        anomaly_service=AnomalyDetectionService(),
+        amount_anomaly_service=AmountAnomalyService()
+    )
+
+    rng = np.random.default_rng(args.seed)
+    plan = []
+    for _ in range(args.requests):
+        user = users[rng.integers(len(users))]
+        transaction_id = user.transaction_ids[-1 - rng.integers(min(args.recent, len(user.transaction_ids)))]
+        plan.append((ENDPOINTS[rng.integers(len(ENDPOINTS))], user.user_id, transaction_id))
+
+    stages_before = metrics.stage_seconds.totals()
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def one(endpoint: str, user_id: str, transaction_id: str):
+                nonlocal failures
+                async with semaphore:
+                    began = time.perf_counter()
+                    response = await client.post(f"/api/analyze-transaction-{endpoint}/{user_id}/{transaction_id}")
+                    latencies[endpoint].append(time.perf_counter() - began)
+                    failures += response.status_code != 200
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(*request) for request in plan))
+            elapsed = time.perf_counter() - started
+        # Al salir del lifespan se escriben los flags que quedaban en el buffer
+
+    per_endpoint = {}
+    for endpoint, samples in latencies.items():
+        if samples:
+            samples_ms = np.array(samples) * 1000
+            per_endpoint[endpoint] = {
+                "requests": len(samples),
+                "p50_ms": round(float(np.percentile(samples_ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(samples_ms, 95)), 2),
+                "p99_ms": round(float(np.percentile(samples_ms, 99)), 2)
+            }
+    stages = {}
+    for (stage,), (count, total) in sorted(metrics.stage_seconds.totals().items()):
+        before_count, before_total = stages_before.get((stage,), (0, 0.0))
+        stages[stage] = {"calls": count - before_count, "total_s": round(total - before_total, 3)}
+
+    return {
+        "requests": args.requests,
+        "failures": failures,
+        "wall_s": round(elapsed, 3),
+        "requests_per_second": round(args.requests / elapsed, 1),
+        "endpoints": per_endpoint,
+        "documents_read": db.reads,
+        "documents_written": db.writes,
+        "batches": db.batches,
+        "stages": stages
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--min-history', type=int, default=20, help='Transacciones del usuario más corto')
+    parser.add_argument('--max-history', type=int, default=2000, help='Transacciones del usuario más largo')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--recent', type=int, default=5, help='Se analiza una de las últimas N transacciones')
+    parser.add_argument('--latency', type=float, default=0.01, help='Segundos por llamada a Firestore')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    print(json.dumps({'benchmark': 'endpoints', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,90 @@
+"""
+Fan-out de la app: para cada usuario se piden a la vez /analyze-transaction-location,
+/analyze-transaction-amount y /analyze-transaction-complete de la misma transacción, con la
+caché de historiales fría. Se compara cada petición leyendo su historial (independent) con
+las lecturas concurrentes del mismo usuario compartidas (single_flight, FirestoreService).
+Se reporta cuántos documentos se leyeron de Firestore, cuántas lecturas de historial se
+hicieron y la latencia de las peticiones.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_fanout --users 50 --latency 0.02
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.bench_firestore_io import seed
+from dependencies import ServiceContainer
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.history_cache import TransactionHistoryCache
+import argparse
+import asyncio
+import json
+import time
+import warnings
+import httpx
+import numpy as np
+import main
+
+class Independent:
+    """Sin compartir: cada llamada hace su propia lectura (como antes)."""
+    def __init__(self):
+        self.calls = 0
+
+    async def do(self, key, operation):
+        self.calls += 1
+        return await operation()
+
+ENDPOINTS = ('location', 'amount', 'complete')
+
+async def run_mode(mode: str, args) -> dict:
+    db = FakeFirestore(latency=args.latency)
+    seed(db, args.users, args.accounts, args.transactions)
+    firestore_service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    if mode == 'independent':
+        firestore_service.history_loads = Independent()
+    main.app.state.services = ServiceContainer(
+        firestore_service=firestore_service,
+        anomaly_service=AnomalyDetectionService(),
+        amount_anomaly_service=AmountAnomalyService()
+    )
+
+    latencies = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(user: int, endpoint: str):
+            began = time.perf_counter()
+            response = await client.post(
+                f"/api/analyze-transaction-{endpoint}/user-{user}/tx-{user}-{args.accounts - 1}-{args.transactions - 1}"
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - began)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(user, endpoint) for user in range(args.users) for endpoint in ENDPOINTS))
+        elapsed = time.perf_counter() - started
+        await firestore_service.flag_writer.flush()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "wall_s": round(elapsed, 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "history_loads": firestore_service.history_loads.calls - getattr(firestore_service.history_loads, 'shared', 0),
+        "documents_read": db.reads
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=100, help='Transacciones por cuenta')
+    parser.add_argument('--latency', type=float, default=0.02, help='Segundos por llamada a Firestore')
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    results = {mode: asyncio.run(run_mode(mode, args)) for mode in ('independent', 'single_flight')}
+    print(json.dumps({'benchmark': 'fanout', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
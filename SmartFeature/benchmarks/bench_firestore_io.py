@@ -0,0 +1,106 @@
+"""
+Compara la latencia p50/p99 de cargar historiales con muchas peticiones concurrentes:
+el camino anterior (cliente síncrono dentro de un endpoint async, cuenta por cuenta)
+frente a FirestoreService con cliente asíncrono y lectura concurrente de cuentas.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_firestore_io --users 50 --accounts 3 --transactions 200 --rate 100 --latency 0.01
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from services.firestore_service import FirestoreService
+from services.history_cache import TransactionHistoryCache
+from models import Transaction
+import argparse
+import asyncio
+import datetime
+import json
+import time
+import numpy as np
+
+def seed(db: FakeFirestore, users: int, accounts: int, transactions: int):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for u in range(users):
+        for a in range(accounts):
+            account_id = f"acc-{u}-{a}"
+            db.documents[('accounts', account_id)] = {'user_id': f"user-{u}", 'name': 'Cuenta', 'amount': 0}
+            for t in range(transactions):
+                db.documents[('accounts', account_id, 'transactions', f"tx-{u}-{a}-{t}")] = {
+                    'amount': 10.0 + t % 50,
+                    'dateTime': start + datetime.timedelta(hours=t * accounts + a),
+                    'location': {'latitude': 4.6, 'longitude': -74.08},
+                    'transactionName': 'Compra',
+                    'transactionType': 'Expense'
+                }
+
+async def legacy_get_user_transactions(db, user_id: str):
+    """Lectura anterior: cliente síncrono, cuentas una tras otra, bloqueando el event loop."""
+    transactions = []
+    for account_doc in db.collection('accounts').where('user_id', '==', user_id).stream():
+        for trans_doc in account_doc.reference.collection('transactions').stream():
+            data = trans_doc.to_dict()
+            transactions.append(Transaction(
+                transaction_id=trans_doc.id,
+                amount=data.get('amount', 0),
+                dateTime=data.get('dateTime'),
+                location=data.get('location'),
+                transactionName=data.get('transactionName', ''),
+                transactionType=data.get('transactionType', '')
+            ))
+    return sorted(transactions, key=lambda x: x.dateTime)
+
+async def run_load(load_fn, users: int, requests: int, rate: float) -> dict:
+    """
+    Lanza las peticiones a ritmo constante (rate por segundo) y mide cada latencia desde el
+    instante en que la petición debía llegar, así el tiempo que espera detrás de un event loop
+    bloqueado también cuenta.
+    """
+    latencies = []
+    started = time.perf_counter()
+
+    async def one(i: int):
+        arrival = started + i / rate
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        await load_fn(f"user-{i % users}")
+        latencies.append(time.perf_counter() - arrival)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "wall_s": round(elapsed, 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--transactions', type=int, default=200, help='Transacciones por cuenta')
+    parser.add_argument('--requests', type=int, default=200, help='Peticiones totales')
+    parser.add_argument('--rate', type=float, default=100.0, help='Peticiones por segundo')
+    parser.add_argument('--latency', type=float, default=0.01, help='Latencia simulada por llamada (s)')
+    args = parser.parse_args()
+
+    sync_db = FakeFirestore(latency=args.latency, asynchronous=False)
+    seed(sync_db, args.users, args.accounts, args.transactions)
+    async_db = FakeFirestore(latency=args.latency, asynchronous=True)
+    async_db.documents = sync_db.documents
+
+    # Sin caché (max_users=0) para medir siempre la lectura completa
+    service = FirestoreService(cache=TransactionHistoryCache(max_users=0), db=async_db)
+
+    results = {
+        "blocking_sequential": asyncio.run(run_load(
+            lambda user_id: legacy_get_user_transactions(sync_db, user_id), args.users, args.requests, args.rate
+        )),
+        # Lo que consumen los endpoints: el historial por columnas, sin un Transaction por documento
+        "async_concurrent": asyncio.run(run_load(
+            service.get_user_history, args.users, args.requests, args.rate
+        )),
+    }
+    print(json.dumps({"benchmark": "firestore_io", "params": vars(args), "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Escritura de flags de anomalía desde muchas peticiones concurrentes sobre el Firestore falso
+con latencia por llamada:
+
+- direct: cada petición escribe su propio WriteBatch de un documento y espera el commit (antes).
+- durable: cada petición deja sus flags en el buffer write-behind y espera su futuro.
+- write_behind: cada petición deja sus flags en el buffer y responde sin esperar (endpoints).
+
+Se reporta la latencia que la escritura agrega a cada petición (p50/p99), el tiempo hasta que
+todo quedó escrito, y cuántos lotes y escrituras se hicieron. Cada petición escribe los dos
+flags de una transacción distinta; con --repeat las peticiones repiten transacciones y el
+buffer junta las escrituras al mismo documento.
+
+Con --check además se escriben los flags de dos transacciones con _write_flags de los endpoints
+(una se borró antes del flush) y termina con código 1 si el fallo no se informa: sin esperar,
+en el log y en failures de las métricas del buffer; esperando (wait=True), devolviendo False.
+También falla si una visita se cuenta más de una vez en location_cells cuando varias peticiones
+(y el análisis por lotes) escriben los flags de la misma transacción mientras hay un flush en curso.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_flag_writes --requests 2000 --concurrency 100 --latency 0.03
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.bench_firestore_io import seed
+from services.firestore_service import FirestoreService
+from services.history_cache import TransactionHistoryCache
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import numpy as np
+
+def targets(requests: int, users: int, accounts: int, transactions: int, repeat: float, rng: np.random.Generator):
+    """(user_id, account_id, transaction_id) por petición; una fracción repeat repite una anterior."""
+    chosen = []
+    for i in range(requests):
+        if chosen and rng.random() < repeat:
+            chosen.append(chosen[rng.integers(len(chosen))])
+            continue
+        u, a, t = i % users, (i // users) % accounts, (i // (users * accounts)) % transactions
+        chosen.append((f"user-{u}", f"acc-{u}-{a}", f"tx-{u}-{a}-{t}"))
+    return chosen
+
+async def run_mode(mode: str, args) -> dict:
+    db = FakeFirestore(latency=args.latency)
+    seed(db, args.users, args.accounts, args.transactions)
+    service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    chosen = targets(args.requests, args.users, args.accounts, args.transactions, args.repeat,
+                     np.random.default_rng(args.seed))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i: int):
+        user_id, account_id, transaction_id = chosen[i]
+        flags = {'locationAnomaly': bool(i % 2), 'amountAnomaly': False}
+        async with semaphore:
+            began = time.perf_counter()
+            if mode == 'direct':
+                batch = db.batch()
+                batch.update(service._transaction_ref(account_id, transaction_id), flags)
+                await batch.commit()
+            elif mode == 'durable':
+                await service.flag_writer.write(user_id, account_id, transaction_id, flags)
+            else:
+                service.flag_writer.write(user_id, account_id, transaction_id, flags)
+            latencies.append(time.perf_counter() - began)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    await service.flag_writer.flush()  # write_behind: hasta que todo quedó escrito
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": args.requests,
+        "write_p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "write_p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "durable_after_s": round(elapsed, 3),
+        "batches": db.batches,
+        "writes": db.writes
+    }
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+async def failed_flush() -> dict:
+    """Flags de una transacción borrada antes del flush, sin esperar y esperando la escritura."""
+    import main as app_main  # Importa FastAPI y los servicios; solo con --check
+
+    db = FakeFirestore()
+    seed(db, 1, 1, 3)
+    service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    history = await service.get_user_history('user-0')
+    kept, deleted = history.get('tx-0-0-0'), history.get('tx-0-0-1')
+    del db.documents[('accounts', 'acc-0-0', 'transactions', 'tx-0-0-1')]
+
+    records = Records()
+    logging.getLogger('services.flag_write_buffer').addHandler(records)
+    try:
+        queued = await asyncio.gather(*(
+            app_main._write_flags(service, 'user-0', history, transaction, location_anomaly=True)
+            for transaction in (kept, deleted)
+        ))
+        await service.flag_writer.flush()
+        failures = service.flag_writer.stats()["failures"]
+        logged = sum('tx-0-0-1' in message for message in records.messages)
+        waited = await app_main._write_flags(service, 'user-0', history, deleted, amount_anomaly=True, wait=True)
+    finally:
+        logging.getLogger('services.flag_write_buffer').removeHandler(records)
+    written = db.documents[('accounts', 'acc-0-0', 'transactions', 'tx-0-0-0')].get('locationAnomaly')
+    return {
+        "queued_results": queued,
+        "kept_written": written is True,
+        "failures": failures,
+        "logged_errors": logged,
+        "waited_result": waited,
+        "passed": queued == [True, True] and written is True and failures == 1 and logged == 1 and waited is False
+    }
+
+async def repeated_visits() -> dict:
+    """Flags de la misma transacción nueva desde varias peticiones, con y sin flush en curso."""
+    import main as app_main
+
+    db = FakeFirestore(latency=0.01)
+    seed(db, 1, 1, 3)
+    service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    history = await service.get_user_history('user-0')  # Leído antes de guardar ningún geohash
+    transaction = history.get('tx-0-0-2')
+
+    first = asyncio.ensure_future(
+        app_main._write_flags(service, 'user-0', history, transaction, location_anomaly=False)
+    )
+    await asyncio.sleep(0.005)  # Su flush está en curso
+    await asyncio.gather(
+        app_main._write_flags(service, 'user-0', history, transaction, amount_anomaly=False),
+        app_main._write_flags(service, 'user-0', history, transaction, location_anomaly=False,
+                              amount_anomaly=False, wait=True),
+        service.update_anomalies_batch('user-0', history, {'tx-0-0-2': {'amountAnomaly': False}}),
+        first
+    )
+    await service.flag_writer.flush()
+    cells = await service.get_location_cells('user-0')
+    visits = {resolution: sum(cells.get(resolution, {}).values()) for resolution in ('p4', 'p5', 'p6')}
+    stored = db.documents[('accounts', 'acc-0-0', 'transactions', 'tx-0-0-2')].get('geohash')
+    return {
+        "visits": visits,
+        "geohash_stored": stored is not None,
+        "passed": stored is not None and all(count == 1 for count in visits.values())
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.03, help='Segundos por llamada a Firestore')
+    parser.add_argument('--repeat', type=float, default=0.2, help='Fracción de peticiones a una transacción ya escrita')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=100, help='Transacciones por cuenta')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help='Fallar si una escritura fallida no se informa')
+    args = parser.parse_args()
+
+    results = {mode: asyncio.run(run_mode(mode, args)) for mode in ('direct', 'durable', 'write_behind')}
+    if args.check:
+        results['failed_flush'] = asyncio.run(failed_flush())
+        results['repeated_visits'] = asyncio.run(repeated_visits())
+    print(json.dumps({'benchmark': 'flag_writes', 'params': vars(args), 'results': results}, indent=2))
+
+    if args.check and not (results['failed_flush']['passed'] and results['repeated_visits']['passed']):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
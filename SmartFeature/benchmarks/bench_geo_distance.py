@@ -0,0 +1,94 @@
+"""
+Precisión y rendimiento de las distancias vectorizadas (services/geo_distance.py) frente a
+geopy.distance.geodesic.
+
+--check mide el error máximo contra geodesic en pares aleatorios a distintas escalas y
+cuenta cuántas decisiones cambian respecto al umbral de 50 km de AnomalyDetectionService;
+termina con código 1 si la corrección elipsoidal se aleja más de --tolerance-km.
+
+Sin --check mide el tiempo de un punto contra n centroides/ubicaciones.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_geo_distance --check
+    python -m benchmarks.bench_geo_distance --sizes 1 3 100 10000
+"""
+from geopy.distance import geodesic
+from services.geo_distance import distances_km, ellipsoidal_km, haversine_km
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+THRESHOLD_KM = 50.0
+
+def check(pairs: int, seed: int, tolerance_km: float) -> dict:
+    rng = np.random.default_rng(seed)
+    report = {}
+    # Escalas en grados: vecindario, alrededor del umbral de 50 km, regional y continental
+    for name, scale in (('local', 0.05), ('near_threshold', 0.45), ('regional', 5.0), ('continental', 40.0)):
+        lat1 = rng.uniform(-80, 80, pairs)
+        lon1 = rng.uniform(-180, 180, pairs)
+        lat2 = np.clip(lat1 + rng.normal(0, scale, pairs), -89.9, 89.9)
+        lon2 = lon1 + rng.normal(0, scale, pairs)
+
+        reference = np.array([geodesic((a, b), (c, d)).kilometers for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+        row = {'pairs': pairs}
+        for method, fn in (('ellipsoidal', ellipsoidal_km), ('haversine', haversine_km)):
+            error = np.abs(fn(lat1, lon1, lat2, lon2) - reference)
+            flips = np.sum((fn(lat1, lon1, lat2, lon2) > THRESHOLD_KM) != (reference > THRESHOLD_KM))
+            row[method] = {'max_error_km': round(float(error.max()), 6), 'threshold_flips': int(flips)}
+        report[name] = row
+
+    report['passed'] = all(
+        report[name]['ellipsoidal']['max_error_km'] <= tolerance_km for name in ('local', 'near_threshold')
+    )
+    return report
+
+def _timed(fn, min_seconds: float = 0.2) -> float:
+    runs, started = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / runs * 1e6
+
+def benchmark(sizes, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        points = np.column_stack((rng.uniform(4, 5, size), rng.uniform(-75, -74, size)))
+        latitude, longitude = 4.6, -74.08
+
+        row = {'points': size}
+        row['geodesic_loop_us'] = round(_timed(
+            lambda: [geodesic((latitude, longitude), (p[0], p[1])).kilometers for p in points]
+        ), 2)
+        row['ellipsoidal_us'] = round(_timed(lambda: distances_km(latitude, longitude, points)), 2)
+        row['haversine_us'] = round(_timed(lambda: distances_km(latitude, longitude, points, ellipsoidal=False)), 2)
+        row['speedup_ellipsoidal'] = round(row['geodesic_loop_us'] / row['ellipsoidal_us'], 1)
+        results.append(row)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='Verificar precisión frente a geodesic')
+    parser.add_argument('--pairs', type=int, default=5000)
+    parser.add_argument('--tolerance-km', type=float, default=0.01)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 3, 100, 10000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        report = check(args.pairs, args.seed, args.tolerance_km)
+        print(json.dumps({'benchmark': 'geo_distance_accuracy', 'results': report}, indent=2))
+        if not report['passed']:
+            sys.exit(1)
+        return
+
+    results = benchmark(args.sizes, args.seed)
+    print(json.dumps({'benchmark': 'geo_distance', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Pipeline de ingesta (IngestPipeline) sobre el Firestore falso: se escriben transacciones
+nuevas para varios usuarios y se entregan con MemoryChangeSource, como lo haría el listener de
+Firestore. Se reporta el tiempo hasta que todas tienen sus flags escritos, la espera media y
+máxima de una transacción hasta su flag, la profundidad máxima de la cola, cuántas entregas
+esperaron por la cola llena (backpressure) y las escrituras/lotes usados frente a un lote por
+transacción (lo que cuesta llamar al endpoint de análisis por cada una).
+
+--check termina con código 1 si alguna transacción nueva quedó sin sus dos flags.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_ingest_pipeline --check
+    python -m benchmarks.bench_ingest_pipeline --new 2000 --rate 500 --latency 0.01
+    python -m benchmarks.bench_ingest_pipeline --new 2000 --max-queue 16 --workers 1
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.bench_firestore_io import seed
+from models import Transaction, Location
+from services.change_sources import MemoryChangeSource
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.history_cache import TransactionHistoryCache
+from services.ingest_pipeline import IngestPipeline
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+import time
+import warnings
+import numpy as np
+
+def new_transaction(user: int, account: int, i: int, rng: np.random.Generator) -> Transaction:
+    """Transacción posterior a todo el historial sembrado, a veces con un monto o lugar inusual."""
+    unusual = rng.random() < 0.05
+    return Transaction(
+        transaction_id=f"new-{user}-{i}",
+        amount=float(5000.0 if unusual else 10.0 + rng.integers(50)),
+        dateTime=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=i),
+        location=Location(latitude=40.4 if unusual else 4.6, longitude=-3.7 if unusual else -74.08),
+        transactionName='Compra',
+        transactionType='Expense'
+    )
+
+async def run(args) -> dict:
+    db = FakeFirestore(latency=args.latency)
+    seed(db, args.users, args.accounts, args.transactions)
+    firestore_service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    source = MemoryChangeSource()
+    pipeline = IngestPipeline(firestore_service, AnomalyDetectionService(), AmountAnomalyService(), source)
+    pipeline.WORKERS = args.workers
+    pipeline.MAX_QUEUE = args.max_queue
+    pipeline.FLUSH_SIZE = args.flush_size
+    pipeline.FLUSH_SECONDS = args.flush_seconds
+    pipeline.start()
+
+    rng = np.random.default_rng(args.seed)
+    reads, writes = db.reads, db.writes
+    started = time.perf_counter()
+    new_ids = []
+    for i in range(args.new):
+        user, account = i % args.users, (i // args.users) % args.accounts
+        transaction = new_transaction(user, account, i, rng)
+        # La app escribe el documento; el origen de cambios lo entrega al pipeline
+        db.documents[('accounts', f"acc-{user}-{account}", 'transactions', transaction.transaction_id)] = {
+            'amount': transaction.amount,
+            'dateTime': transaction.dateTime,
+            'location': transaction.location.model_dump(),
+            'transactionName': transaction.transactionName,
+            'transactionType': transaction.transactionType
+        }
+        new_ids.append((f"acc-{user}-{account}", transaction.transaction_id))
+        await source.publish(f"acc-{user}-{account}", transaction)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    await pipeline.stop()
+    elapsed = time.perf_counter() - started
+
+    documents = [db.documents[('accounts', account_id, 'transactions', t_id)] for account_id, t_id in new_ids]
+    return {
+        "wall_s": round(elapsed, 3),
+        "flagged": sum(1 for d in documents if 'locationAnomaly' in d and 'amountAnomaly' in d),
+        "anomalies": sum(1 for d in documents if d.get('locationAnomaly') or d.get('amountAnomaly')),
+        "reads": db.reads - reads,
+        "writes": db.writes - writes,
+        "batches": db.batches,
+        "batches_one_per_transaction": args.new,
+        "pipeline": pipeline.stats()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='Verificar que todas las transacciones nuevas queden marcadas')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=100, help='Transacciones sembradas por cuenta')
+    parser.add_argument('--new', type=int, default=1000, help='Transacciones nuevas a ingerir')
+    parser.add_argument('--rate', type=float, default=0.0, help='Transacciones nuevas por segundo (0: sin pausa)')
+    parser.add_argument('--latency', type=float, default=0.005, help='Segundos por llamada a Firestore')
+    parser.add_argument('--workers', type=int, default=IngestPipeline.WORKERS)
+    parser.add_argument('--max-queue', type=int, default=IngestPipeline.MAX_QUEUE)
+    parser.add_argument('--flush-size', type=int, default=IngestPipeline.FLUSH_SIZE)
+    parser.add_argument('--flush-seconds', type=float, default=IngestPipeline.FLUSH_SECONDS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")  # Avisos de KMeans con pocos puntos distintos
+
+    result = asyncio.run(run(args))
+    print(json.dumps({'benchmark': 'ingest_pipeline', 'params': vars(args), 'results': result}, indent=2))
+    if args.check and result['flagged'] != args.new:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Costo y concordancia del modelo incremental de zonas habituales (LocationModel) frente a
+ajustar KMeans sobre todo el historial en cada análisis.
+
+Para cada tamaño se genera un usuario con 1-4 zonas habituales y algunos viajes lejanos,
+y se analiza cada transacción contra las anteriores de las dos formas. Se reporta el tiempo
+medio por análisis, cuántos reajustes completos hizo el modelo y en cuántos veredictos
+("fuera de zonas habituales") difieren.
+
+--backend elige el modelo del servicio (kmeans o density); --query-only mide solo la consulta
+"distancia a la zona habitual más cercana" sobre un modelo ya ajustado, para historiales grandes.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_location_model --sizes 50 500 2000
+    python -m benchmarks.bench_location_model --backend density --sizes 50 500 2000
+    python -m benchmarks.bench_location_model --backend density --query-only --sizes 1000 10000 50000
+"""
+from datetime import datetime, timedelta, timezone
+from models import Transaction, Location
+from services.location_anomaly_service import AnomalyDetectionService
+import argparse
+import json
+import time
+import warnings
+import numpy as np
+
+def synthetic_history(size: int, rng: np.random.Generator):
+    """Transacciones espaciadas 30 h (sin el chequeo de viaje rápido) alrededor de 1-4 zonas."""
+    zones = rng.uniform([-40, -80], [50, 40], size=(rng.integers(1, 5), 2))
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    transactions = []
+    for i in range(size):
+        if rng.random() < 0.03:
+            latitude, longitude = rng.uniform(-60, 60), rng.uniform(-180, 180)  # Viaje
+        else:
+            latitude, longitude = zones[rng.integers(len(zones))] + rng.normal(0, 0.05, 2)
+        transactions.append(Transaction(
+            transaction_id=f"tx-{i}", amount=10.0, transactionType="Expense", transactionName="bench",
+            dateTime=started + timedelta(hours=30 * i),
+            location=Location(latitude=float(latitude), longitude=float(longitude))
+        ))
+    return transactions
+
+def new_service(backend: str) -> AnomalyDetectionService:
+    service = AnomalyDetectionService()
+    service.LOCATION_BACKEND = backend
+    return service
+
+def run(size: int, seed: int, backend: str) -> dict:
+    transactions = synthetic_history(size, np.random.default_rng(seed))
+    service = new_service(backend)
+    model = service.new_location_model()
+    start = service.MIN_TRANSACTIONS_FOR_CLUSTERING
+
+    refit_seconds, model_seconds, disagreements = 0.0, 0.0, 0
+    for i in range(start, size):
+        previous = transactions[:i]
+
+        began = time.perf_counter()
+        refit = service.detect_anomaly(transactions[i], previous)
+        refit_seconds += time.perf_counter() - began
+
+        began = time.perf_counter()
+        incremental = service.detect_anomaly(transactions[i], previous, model=model)
+        model_seconds += time.perf_counter() - began
+
+        disagreements += refit[0] != incremental[0]
+
+    analyses = size - start
+    return {
+        'transactions': size,
+        'refit_ms_per_analysis': round(refit_seconds / analyses * 1e3, 3),
+        'model_ms_per_analysis': round(model_seconds / analyses * 1e3, 3),
+        'speedup': round(refit_seconds / model_seconds, 1),
+        'full_refits': model.version,
+        'verdict_disagreements': disagreements,
+        'analyses': analyses
+    }
+
+def run_queries(size: int, seed: int, backend: str, queries: int = 2000) -> dict:
+    rng = np.random.default_rng(seed)
+    locations = [(t.location.latitude, t.location.longitude) for t in synthetic_history(size, rng)]
+    model = new_service(backend).new_location_model()
+
+    began = time.perf_counter()
+    model.fit(locations)
+    fit_seconds = time.perf_counter() - began
+
+    points = np.column_stack((rng.uniform(-60, 60, queries), rng.uniform(-180, 180, queries)))
+    began = time.perf_counter()
+    for latitude, longitude in points:
+        model.nearest(latitude, longitude)
+    query_seconds = time.perf_counter() - began
+    return {
+        'transactions': size,
+        'fit_ms': round(fit_seconds * 1e3, 2),
+        'query_us': round(query_seconds / queries * 1e6, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 2000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['kmeans', 'density'], default='kmeans')
+    parser.add_argument('--query-only', action='store_true', help='Medir solo ajuste y consulta de un modelo')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')  # ConvergenceWarning de KMeans con puntos repetidos
+    if args.query_only:
+        results = [run_queries(size, args.seed, args.backend) for size in args.sizes]
+    else:
+        results = [run(size, args.seed, args.backend) for size in args.sizes]
+    print(json.dumps({'benchmark': 'location_model', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
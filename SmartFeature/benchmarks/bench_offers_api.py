@@ -0,0 +1,259 @@
+"""
+Carga concurrente sobre la API de ofertas de DB_Manager_Flask (/documents) con el Firestore
+falso síncrono (el cliente de Flask bloquea el hilo durante cada llamada) y latencia por
+llamada, sin credenciales. Se siembran --offers ofertas con ubicaciones sintéticas y luego
+--threads hilos hacen --requests peticiones con la mezcla de --mix (GET, PUT, POST, DELETE).
+
+Se reporta por operación la latencia (p50/p99) y, en total, el throughput, los documentos
+leídos y escritos y los contadores de la caché de ofertas (--cache-size 0 la desactiva). Los
+GET eligen la oferta con una distribución de Zipf (--skew), como ofertas populares.
+
+Después, en "sync", se sincronizan --sync ofertas (actualizar y luego borrar, con algunos ids
+que no existen) de a una petición por oferta y con los endpoints /documents/bulk, y se recorre
+la colección completa con GET /documents paginado (--page ofertas por página, solo dos campos);
+de cada variante se reportan peticiones, segundos, documentos leídos/escritos y lotes. En
+"revalidate" se piden --sync ofertas y se vuelven a pedir con If-None-Match, como un cliente
+móvil que ya las tiene: cuántas respondieron 304 y cuántos bytes de cuerpo se enviaron.
+
+En "paging" se siembran --paged ofertas con expiresAt (timestamp) y position (GeoPoint) con
+valores repetidos y se recorren paginadas ordenando por cada uno (ascendente y descendente):
+cada recorrido debe devolver todas, una sola vez y en orden; ordenar por un mapa debe dar 400.
+Con --check termina con código 1 si alguna de esas comprobaciones falla.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_offers_api --requests 2000 --threads 16 --latency 0.005
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import numpy as np
+
+FLASK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'DB_Manager_Flask')
+OPERATIONS = ('get', 'put', 'post', 'delete')
+
+def load_app():
+    """Importa DB_Manager_Flask/app.py (con sus imports planos, como al correrlo desde su carpeta)."""
+    if FLASK_DIR not in sys.path:
+        sys.path.insert(0, FLASK_DIR)
+    import app as offers_app
+    return offers_app
+
+def offer(rng: np.random.Generator) -> dict:
+    return {
+        'placeName': f"Tienda {rng.integers(10000)}",
+        'offerDescription': 'Descuento',
+        'discount': int(rng.integers(5, 50)),
+        'location': {'latitude': float(4.6 + rng.normal(0, 0.1)), 'longitude': float(-74.08 + rng.normal(0, 0.1))}
+    }
+
+def run(args) -> dict:
+    offers_app = load_app()
+    db = FakeFirestore(latency=args.latency, asynchronous=False)
+    offers_app.db = db
+    offers_app.cache = offers_app.OfferCache(max_entries=args.cache_size)
+    client = offers_app.app.test_client()
+
+    rng = np.random.default_rng(args.seed)
+    offer_ids = [client.post('/documents', json=offer(rng)).get_json()['id'] for _ in range(args.offers)]
+    db.reads = db.writes = 0
+
+    mix = np.array(args.mix, dtype=float)
+    plan = [
+        (OPERATIONS[i], offer(rng), int(rng.zipf(args.skew)) if OPERATIONS[i] == 'get' else int(rng.integers(1 << 30)))
+        for i in rng.choice(4, args.requests, p=mix / mix.sum())
+    ]
+    latencies = {operation: [] for operation in OPERATIONS}
+    failures = 0
+    lock = Lock()
+
+    def one(operation: str, data: dict, pick: int):
+        nonlocal failures
+        with lock:
+            offer_id = offer_ids[pick % len(offer_ids)] if offer_ids else 'missing'
+        began = time.perf_counter()
+        if operation == 'get':
+            response = client.get(f'/documents/{offer_id}')
+        elif operation == 'put':
+            response = client.put(f'/documents/{offer_id}', json=data)
+        elif operation == 'post':
+            response = client.post('/documents', json=data)
+        else:
+            response = client.delete(f'/documents/{offer_id}')
+        elapsed = time.perf_counter() - began
+        with lock:
+            latencies[operation].append(elapsed)
+            if operation == 'post' and response.status_code == 201:
+                offer_ids.append(response.get_json()['id'])
+            # Otro hilo pudo borrar la oferta antes: un 404 no es un fallo de la API
+            failures += response.status_code >= 500
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        list(executor.map(lambda request: one(*request), plan))
+    elapsed = time.perf_counter() - started
+
+    per_operation = {}
+    for operation, samples in latencies.items():
+        if samples:
+            samples_ms = np.array(samples) * 1000
+            per_operation[operation] = {
+                "requests": len(samples),
+                "p50_ms": round(float(np.percentile(samples_ms, 50)), 2),
+                "p99_ms": round(float(np.percentile(samples_ms, 99)), 2)
+            }
+    results = {
+        "requests": args.requests,
+        "failures": failures,
+        "wall_s": round(elapsed, 3),
+        "requests_per_second": round(args.requests / elapsed, 1),
+        "operations": per_operation,
+        "documents_read": db.reads,
+        "documents_written": db.writes,
+        "cache": offers_app.cache.stats()
+    }
+    results["sync"] = sync(client, db, offer_ids, rng, args)
+    results["paging"] = paging(client, db, offers_app, args)
+    return results
+
+def sync(client, db, offer_ids, rng: np.random.Generator, args) -> dict:
+    """Misma sincronización de a una oferta por petición y en bloque, más el listado paginado."""
+    def measure(send) -> dict:
+        db.reads = db.writes = db.batches = 0
+        began = time.perf_counter()
+        requests = send()
+        return {
+            "requests": requests,
+            "wall_s": round(time.perf_counter() - began, 3),
+            "documents_read": db.reads,
+            "documents_written": db.writes,
+            "batches": db.batches
+        }
+
+    def single(ids):
+        def send():
+            for offer_id in ids:
+                client.put(f'/documents/{offer_id}', json=offer(rng))
+            for offer_id in ids:
+                client.delete(f'/documents/{offer_id}')
+            return 2 * len(ids)
+        return send
+
+    def bulk(ids):
+        def send():
+            responses = [client.put('/documents/bulk', json={'documents': [{'id': offer_id, 'data': offer(rng)} for offer_id in ids]}),
+                         client.delete('/documents/bulk', json={'ids': ids})]
+            assert all(response.status_code == 200 for response in responses)
+            return len(responses)
+        return send
+
+    def listing():
+        requests, cursor = 0, None
+        while True:
+            query = {'limit': args.page, 'fields': 'placeName,discount'}
+            if cursor:
+                query['cursor'] = cursor
+            page = client.get('/documents', query_string=query).get_json()
+            requests += 1
+            cursor = page['next_cursor']
+            if not cursor:
+                return requests
+
+    # Los ids inexistentes cuentan como 404 / not_found, no como fallos
+    bulk_ids = [client.post('/documents', json=offer(rng)).get_json()['id'] for _ in range(args.sync)]
+    single_ids = [client.post('/documents', json=offer(rng)).get_json()['id'] for _ in range(args.sync)]
+    return {
+        "single": measure(single(single_ids + ['missing-single'])),
+        "bulk": measure(bulk(bulk_ids + ['missing-bulk'])),
+        "list": measure(listing),
+        "revalidate": revalidate(client, db, offer_ids[:args.sync])
+    }
+
+def revalidate(client, db, ids) -> dict:
+    etags = {offer_id: client.get(f'/documents/{offer_id}').headers.get('ETag') for offer_id in ids}
+    db.reads = 0
+    not_modified = body_bytes = 0
+    for offer_id, etag in etags.items():
+        response = client.get(f'/documents/{offer_id}', headers={'If-None-Match': etag} if etag else {})
+        not_modified += response.status_code == 304
+        body_bytes += len(response.data)
+    return {"requests": len(ids), "not_modified": not_modified, "body_bytes": body_bytes, "documents_read": db.reads}
+
+def paging(client, db, offers_app, args) -> dict:
+    """Recorre paginadas ofertas ordenadas por un timestamp y por un GeoPoint, con empates."""
+    started = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    expected = {}
+    for i in range(args.paged):
+        offer_id = f'paged-{i:04d}'
+        data = {
+            'placeName': f"Tienda {i}",
+            'expiresAt': started + datetime.timedelta(hours=i // 3),  # De a tres con el mismo vencimiento
+            'position': offers_app.firestore.GeoPoint(4.6 + (i % 7) / 100, -74.08),
+            'tags': {'paged': True}
+        }
+        db.collection(offers_app.COLLECTION_NAME).document(offer_id).set(data)
+        expected[offer_id] = data
+
+    def walk(order_by: str):
+        ids, cursor, pages = [], None, 0
+        while True:
+            query = {'limit': 7, 'order_by': order_by, 'fields': 'placeName'}
+            if cursor:
+                query['cursor'] = cursor
+            response = client.get('/documents', query_string=query)
+            if response.status_code != 200:
+                return None, pages
+            page = response.get_json()
+            ids += [document['id'] for document in page['documents']]
+            pages += 1
+            cursor = page['next_cursor']
+            if not cursor:
+                return ids, pages
+
+    result = {}
+    for field in ('expiresAt', 'position'):
+        key = lambda offer_id: (
+            (expected[offer_id][field].latitude, expected[offer_id][field].longitude)
+            if field == 'position' else expected[offer_id][field]
+        )
+        for descending in (False, True):
+            order_by = ('-' if descending else '') + field
+            ids, pages = walk(order_by)
+            # Los empates se ordenan por id, siempre ascendente (el último orden del listado)
+            in_order = sorted(sorted(expected), key=key, reverse=descending)
+            result[order_by] = {"pages": pages, "ok": ids == in_order}
+    response = client.get('/documents', query_string={'filter': 'placeName=="Tienda 0"', 'order_by': 'tags', 'limit': 1})
+    result["map_order_status"] = response.status_code
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--offers', type=int, default=500, help='Ofertas sembradas antes de medir')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--mix', type=float, nargs=4, default=[0.7, 0.15, 0.1, 0.05], metavar=('GET', 'PUT', 'POST', 'DELETE'))
+    parser.add_argument('--latency', type=float, default=0.005, help='Segundos por llamada a Firestore')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Ofertas en caché (0 la desactiva)')
+    parser.add_argument('--skew', type=float, default=1.2, help='Exponente de Zipf de los GET')
+    parser.add_argument('--sync', type=int, default=200, help='Ofertas por sincronización')
+    parser.add_argument('--page', type=int, default=100, help='Ofertas por página del listado')
+    parser.add_argument('--paged', type=int, default=60, help='Ofertas del recorrido paginado por timestamp/GeoPoint')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help='Fallar si la paginación por timestamp/GeoPoint falla')
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps({'benchmark': 'offers_api', 'params': vars(args), 'results': results}, indent=2))
+
+    paged = results["paging"]
+    walks = [walk for walk in paged.values() if isinstance(walk, dict)]
+    if args.check and not (paged["map_order_status"] == 400 and all(walk["ok"] for walk in walks)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Análisis completo (ubicación, monto y estadísticas) con DetectorPipeline sobre usuarios
+sintéticos, por tamaño de historial:
+
+- sequential: todas las etapas en el event loop (DETECTOR_WORKERS=0), como antes.
+- pool: las etapas pesadas en el pool de hilos, a la vez.
+- stages: cada etapa sola, para comparar el análisis completo con la suma de las etapas
+  y con la más lenta (lo que tardaría si corrieran perfectamente en paralelo).
+
+- contention: con el pool, cuánto tarda el análisis en caliente de un usuario mientras otro
+  ajusta sus modelos en frío (other_user_ms, contra cold_ms de ese ajuste), y la mayor pausa
+  del event loop mientras se analiza un usuario cuyo modelo de montos tiene otro hilo por
+  BUSY_SECONDS (max_loop_gap_ms; el análisis debe esperar en el pool, no en el loop).
+- cells: la última transacción de cada usuario con los conteos de celdas de su historial previo
+  (escritos con update_anomalies_batch) contra el mismo análisis solo con el modelo. skipped:
+  análisis resueltos con las celdas; disagreements: de esos, cuántos el modelo marcaba fuera de
+  las zonas habituales (un cluster que promedia zonas lejanas); mismatches: resultados distintos
+  cuando se usó el modelo de todas formas.
+- restart: un proceso analiza la última transacción de cada usuario en frío y guarda sus modelos
+  de ubicación en Firestore; otro (servicios nuevos, mismo Firestore) vuelve a analizarlas.
+  restored: modelos que trajo el segundo; refits: los que tuvo que volver a ajustar (deben ser 0).
+
+cold: servicios nuevos (cada usuario ajusta sus modelos: las etapas son pesadas); warm: los
+modelos ya están al día (las etapas son livianas y corren en el loop). Se reporta la media y
+la mediana entre usuarios en milisegundos. Con --check termina con código 1 si el pool no da
+los mismos resultados que sequential, si un modelo ocupado detiene el loop o cambia el resultado,
+si las celdas no evitan ningún ajuste, ajustan el modelo al evitarlo o cambian otro resultado, o
+si después de reiniciar no se traen los modelos guardados, se reajustan o cambian los resultados.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_pipeline --sizes 500 5000 --users 10
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.synthetic import SyntheticUsers
+from services.detector_pipeline import DetectorPipeline
+from services.firestore_service import FirestoreService
+from services.history_cache import TransactionHistoryCache
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+import argparse
+import asyncio
+import json
+import sys
+import time
+import warnings
+import numpy as np
+
+STAGES = ('location', 'amount', 'statistics')
+BUSY_SECONDS = 0.2
+MAX_LOOP_GAP_MS = 50.0  # Pausa del loop tolerada con --check mientras un modelo está ocupado
+
+async def load_cases(size: int, users: int, seed: int):
+    db = FakeFirestore()
+    synthetic = SyntheticUsers(users=users, history=(size, size), seed=seed).populate(db)
+    service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    cases = []
+    for user in synthetic:
+        history = await service.get_user_history(user.user_id)
+        transaction = history.get(user.last_transaction_id)
+        cases.append((user.user_id, transaction, history.before(transaction.dateTime)))
+    return cases
+
+def new_pipeline(workers: int) -> DetectorPipeline:
+    return DetectorPipeline.default(AnomalyDetectionService(), AmountAnomalyService(), workers=workers)
+
+async def measure(cases, workers: int, stages=None, repeat: int = 3):
+    """Milisegundos por usuario en frío y en caliente (el mejor de repeat), y los resultados."""
+    pipeline = new_pipeline(workers)
+    cold, warm, results = [], [], []
+    try:
+        for user_id, transaction, history in cases:
+            began = time.perf_counter()
+            analysis = await pipeline.analyze(user_id, transaction, history, stages)
+            cold.append(time.perf_counter() - began)
+            results.append(analysis.results)
+            best = float('inf')
+            for _ in range(repeat):
+                began = time.perf_counter()
+                await pipeline.analyze(user_id, transaction, history, stages)
+                best = min(best, time.perf_counter() - began)
+            warm.append(best)
+    finally:
+        pipeline.close()
+    return np.array(cold) * 1000, np.array(warm) * 1000, results
+
+async def loop_gaps(gaps: list):
+    """Anota cuánto tarda el loop en volver a esta tarea entre ticks de 1 ms."""
+    while True:
+        began = time.perf_counter()
+        await asyncio.sleep(0.001)
+        gaps.append(time.perf_counter() - began)
+
+async def contention(cases, workers: int) -> dict:
+    pipeline = new_pipeline(workers)
+    try:
+        (warm_user, warm_transaction, warm_history), cold_case = cases[0], cases[-1]
+        expected = (await pipeline.analyze(warm_user, warm_transaction, warm_history)).results
+
+        # Otro usuario ajusta sus modelos en frío en el pool mientras este pide un análisis en caliente
+        began = time.perf_counter()
+        cold = asyncio.ensure_future(pipeline.analyze(*cold_case))
+        await asyncio.sleep(0)
+        other_began = time.perf_counter()
+        await pipeline.analyze(warm_user, warm_transaction, warm_history)
+        other_user = time.perf_counter() - other_began
+        await cold
+        cold_time = time.perf_counter() - began
+
+        # Otro hilo tiene el modelo de montos del usuario: el análisis lo espera en el pool
+        model = pipeline.stages['amount'].service.amount_model(warm_user, warm_transaction.transactionType)
+        model.lock.acquire()
+        asyncio.get_running_loop().call_later(BUSY_SECONDS, model.lock.release)
+        gaps = []
+        ticker = asyncio.ensure_future(loop_gaps(gaps))
+        busy = await pipeline.analyze(warm_user, warm_transaction, warm_history)
+        ticker.cancel()
+    finally:
+        pipeline.close()
+    return {
+        "other_user_ms": round(other_user * 1000, 3),
+        "cold_ms": round(cold_time * 1000, 3),
+        "max_loop_gap_ms": round(max(gaps) * 1000, 3),
+        "same_results": busy.results == expected
+    }
+
+async def cell_precheck(size: int, args) -> dict:
+    db = FakeFirestore()
+    synthetic = SyntheticUsers(users=args.users, history=(size, size), seed=args.seed).populate(db)
+    service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+    with_cells, model_only = new_pipeline(0), new_pipeline(0)
+    location_service = with_cells.stages['location'].service
+    skipped = fitted = disagreements = mismatches = 0
+    for user in synthetic:
+        history = await service.get_user_history(user.user_id)
+        transaction = history.get(user.last_transaction_id)
+        previous = history.before(transaction.dateTime)
+        # Como el análisis por lotes: guarda el geohash de cada transacción previa y cuenta su visita
+        await service.update_anomalies_batch(
+            user.user_id, history, {transaction_id: {'locationAnomaly': False} for transaction_id in previous.ids}
+        )
+        history = await service.get_user_history(user.user_id)
+        previous = history.before(transaction.dateTime)
+        cells = await service.get_location_cells_for(user.user_id, history, transaction)
+
+        skips = location_service.cell_skips
+        result = (await with_cells.analyze(user.user_id, transaction, previous, ('location',), cells)).results
+        expected = (await model_only.analyze(user.user_id, transaction, previous, ('location',))).results
+        if location_service.cell_skips > skips:
+            skipped += 1
+            fitted += len(location_service.location_model(user.user_id)) > 0
+            disagreements += result != expected
+        else:
+            mismatches += result != expected
+    return {
+        "users": len(synthetic),
+        "skipped": skipped,
+        "fitted_when_skipped": fitted,
+        "disagreements": disagreements,
+        "mismatches": mismatches
+    }
+
+async def restart(size: int, args) -> dict:
+    db = FakeFirestore()
+    synthetic = SyntheticUsers(users=args.users, history=(size, size), seed=args.seed).populate(db)
+
+    async def process():
+        service = FirestoreService(cache=TransactionHistoryCache(), db=db)
+        pipeline = DetectorPipeline.default(AnomalyDetectionService(), AmountAnomalyService(), workers=0,
+                                            model_store=service)
+        results = []
+        for user in synthetic:
+            history = await service.get_user_history(user.user_id)
+            transaction = history.get(user.last_transaction_id)
+            analysis = await pipeline.analyze(user.user_id, transaction, history.before(transaction.dateTime),
+                                              ('location',))
+            results.append(analysis.results)
+        await pipeline.flush()
+        return pipeline, results
+
+    first, expected = await process()
+    second, results = await process()
+    return {
+        "stored": first.stored,
+        "restored": second.restored,
+        "refits": second.stored,
+        "same_results": results == expected
+    }
+
+def summary(samples_ms: np.ndarray) -> dict:
+    return {
+        "mean_ms": round(float(samples_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3)
+    }
+
+async def run(size: int, args) -> dict:
+    cases = await load_cases(size, args.users, args.seed)
+    await measure(cases, 0, repeat=0)  # Imports perezosos y pools de hilos de scikit-learn fuera de la medición
+
+    result, reference = {}, None
+    for mode, workers in (('sequential', 0), ('pool', args.workers)):
+        cold, warm, results = await measure(cases, workers, repeat=args.repeat)
+        result[mode] = {"cold": summary(cold), "warm": summary(warm)}
+        if reference is None:
+            reference = results
+        else:
+            result["same_results"] = results == reference
+    if args.workers > 0 and len(cases) > 1:
+        result["contention"] = await contention(cases, args.workers)
+    result["cells"] = await cell_precheck(size, args)
+    result["restart"] = await restart(size, args)
+
+    per_stage = {stage: await measure(cases, 0, (stage,), args.repeat) for stage in STAGES}
+    for phase, index in (('cold', 0), ('warm', 1)):
+        times = np.array([per_stage[stage][index] for stage in STAGES])  # (etapas, usuarios)
+        result.setdefault("stages", {})[phase] = {
+            **{stage: summary(times[i]) for i, stage in enumerate(STAGES)},
+            "sum": summary(times.sum(axis=0)),
+            "slowest": summary(times.max(axis=0))
+        }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 5000], help='Transacciones por usuario')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4, help='Hilos del pool en el modo pool')
+    parser.add_argument('--repeat', type=int, default=3, help='Análisis en caliente por usuario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help='Fallar si el pool cambia algún resultado')
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    results = {size: asyncio.run(run(size, args)) for size in args.sizes}
+    print(json.dumps({'benchmark': 'pipeline', 'params': vars(args), 'results': results}, indent=2))
+
+    if args.check and not all(passed(result) for result in results.values()):
+        sys.exit(1)
+
+def passed(result: dict) -> bool:
+    cells = result["cells"]
+    if not (cells["skipped"] and not cells["fitted_when_skipped"] and not cells["mismatches"]):
+        return False
+    restarted = result["restart"]
+    if not (restarted["restored"] == restarted["stored"] > 0 and not restarted["refits"] and restarted["same_results"]):
+        return False
+    contention = result.get("contention")
+    if contention is None:
+        return result["same_results"]
+    return (result["same_results"] and contention["same_results"]
+            and contention["max_loop_gap_ms"] <= MAX_LOOP_GAP_MS)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Mide peticiones por segundo de /api/analyze-transaction-complete construyendo los servicios
+en cada petición (como antes) frente a los servicios compartidos creados en el lifespan.
+Usa el Firestore falso en memoria con la caché de historiales caliente, de modo que la
+diferencia que queda es el coste de preparar cada petición; también se reporta ese coste
+aislado (per_request_setup_us).
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_request_rate --requests 500 --concurrency 20
+"""
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.firestore_v1.async_client import AsyncClient
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.bench_firestore_io import seed
+from dependencies import ServiceContainer, get_firestore_service, get_detector_pipeline
+from services.detector_pipeline import DetectorPipeline
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.history_cache import TransactionHistoryCache
+import argparse
+import asyncio
+import json
+import time
+import httpx
+import main
+
+async def run(requests: int, concurrency: int, users: int, accounts: int, transactions: int) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    semaphore = asyncio.Semaphore(concurrency)
+    last = transactions - 1
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i: int):
+            user = i % users
+            async with semaphore:
+                response = await client.post(
+                    f"/api/analyze-transaction-complete/user-{user}/tx-{user}-{accounts - 1}-{last}"
+                )
+                response.raise_for_status()
+
+        # Calienta la caché de historiales para que no se mida la lectura de Firestore
+        await asyncio.gather(*(one(i) for i in range(users)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "wall_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 1),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=100, help='Transacciones por cuenta')
+    args = parser.parse_args()
+
+    db = FakeFirestore()
+    seed(db, args.users, args.accounts, args.transactions)
+    cache = TransactionHistoryCache()
+    main.app.state.services = ServiceContainer(
+        firestore_service=FirestoreService(cache=cache, db=db),
+        anomaly_service=AnomalyDetectionService(),
+        amount_anomaly_service=AmountAnomalyService()
+    )
+
+    def new_firestore_service():
+        # Equivalente a FirestoreService() por petición: un cliente de Firestore nuevo cada vez
+        # (se crea y se descarta: las lecturas van al Firestore falso)
+        AsyncClient(project="bench", credentials=AnonymousCredentials())
+        return FirestoreService(cache=cache, db=db)
+
+    def new_detector_pipeline():
+        # Detectores nuevos por petición, sin pool de hilos (cada petición dejaría el suyo abierto)
+        return DetectorPipeline.default(AnomalyDetectionService(), AmountAnomalyService(), workers=0)
+
+    params = (args.requests, args.concurrency, args.users, args.accounts, args.transactions)
+    results = {"shared_services": asyncio.run(run(*params))}
+
+    main.app.dependency_overrides = {
+        get_firestore_service: new_firestore_service,
+        get_detector_pipeline: new_detector_pipeline,
+    }
+    results["per_request_services"] = asyncio.run(run(*params))
+    main.app.dependency_overrides = {}
+
+    # Coste aislado de construir los servicios de una petición
+    rounds = 200
+    started = time.perf_counter()
+    for _ in range(rounds):
+        new_firestore_service(), new_detector_pipeline()
+    results["per_request_setup_us"] = round((time.perf_counter() - started) / rounds * 1e6, 1)
+
+    print(json.dumps({"benchmark": "request_rate", "params": vars(args), "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,153 @@
+"""
+Tiempo de arranque de la app, cada corrida en un intérprete nuevo (los imports son lo que se mide):
+
+- import_ms: importar main.
+- serving_ms: desde que arranca el lifespan hasta que la app atiende.
+- first_amount_ms: latencia de la primera petición a /api/analyze-transaction-amount, lanzada
+  apenas la app atiende (con warm-up en segundo plano puede llegar en medio de él).
+- ready_ms: desde que arranca el lifespan hasta que /ready responde 200 (warm-up terminado).
+- rss_ready_mb: memoria máxima del proceso hasta ese momento.
+- first_location_ms: latencia del primer análisis de ubicación (/api/analyze-transaction-location),
+  ya con la app lista.
+
+Se comparan los modos de STARTUP_MODE (eager, background y lazy), con los servicios sobre el
+Firestore falso (sin credenciales; el warm-up igual importa el SDK de Firebase y, salvo en
+lazy, scikit-learn). También se reporta, como python -X importtime, el tiempo propio de import
+por paquete al importar main, y qué paquetes pesados quedaron cargados solo por importarlo.
+Con --check termina con código 1 si importar main carga scikit-learn, SciPy o el SDK de Firebase.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODES = ('eager', 'background', 'lazy')
+HEAVY = ('sklearn', 'scipy', 'firebase_admin', 'google.cloud.firestore_v1')
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child():
+    """Una corrida: imprime sus tiempos como JSON (STARTUP_MODE viene del entorno)."""
+    began = time.perf_counter()
+    import main
+    import_ms = (time.perf_counter() - began) * 1000
+    heavy = [name for name in HEAVY if name in sys.modules]
+
+    import asyncio
+    import httpx
+    import logging
+    import resource
+    import warnings
+    from benchmarks.fake_firestore import FakeFirestore
+    from benchmarks.bench_firestore_io import seed
+    from dependencies import ServiceContainer
+    from services.amount_anomaly_service import AmountAnomalyService
+    from services.firestore_service import FirestoreService
+    from services.history_cache import TransactionHistoryCache
+    from services.location_anomaly_service import AnomalyDetectionService
+    warnings.filterwarnings("ignore")
+    logging.disable(logging.INFO)
+
+    db = FakeFirestore()
+    seed(db, 1, 2, 100)
+    main.app.state.services = ServiceContainer(
+        firestore_service=FirestoreService(cache=TransactionHistoryCache(), db=db),
+        anomaly_service=AnomalyDetectionService(),
+        amount_anomaly_service=AmountAnomalyService()
+    )
+
+    async def run() -> dict:
+        started = time.perf_counter()
+        async with main.app.router.lifespan_context(main.app):
+            serving = time.perf_counter()
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+                response = await client.post("/api/analyze-transaction-amount/user-0/tx-0-1-99")
+                response.raise_for_status()
+                first_amount = time.perf_counter() - serving
+                while (await client.get("/ready")).status_code != 200:
+                    await asyncio.sleep(0.005)
+                ready = time.perf_counter()
+                rss_ready_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                steps = (await client.get("/ready")).json()["steps_ms"]
+
+                began_location = time.perf_counter()
+                response = await client.post("/api/analyze-transaction-location/user-0/tx-0-1-99")
+                response.raise_for_status()
+                first_location = time.perf_counter() - began_location
+        return {
+            "import_ms": round(import_ms, 1),
+            "serving_ms": round((serving - started) * 1000, 1),
+            "first_amount_ms": round(first_amount * 1000, 1),
+            "ready_ms": round((ready - started) * 1000, 1),
+            "rss_ready_mb": round(rss_ready_mb, 1),
+            "first_location_ms": round(first_location * 1000, 1),
+            "warmup_steps_ms": steps,
+            "heavy_modules_at_import": heavy
+        }
+
+    print(json.dumps(asyncio.run(run())))
+
+def run_child(mode: str) -> dict:
+    began = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+        capture_output=True, text=True, cwd=HERE, env={**os.environ, 'STARTUP_MODE': mode}
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_ms"] = round((time.perf_counter() - began) * 1000, 1)
+    return result
+
+def import_breakdown(top: int) -> dict:
+    """Milisegundos propios de import por paquete de primer nivel al importar main (-X importtime)."""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'], capture_output=True, text=True, cwd=HERE
+    )
+    packages = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    ranked = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {package: round(us / 1000, 1) for package, us in ranked}
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Corridas por modo (se reporta la mediana)')
+    parser.add_argument('--top', type=int, default=10, help='Paquetes en el desglose de imports')
+    parser.add_argument('--check', action='store_true', help='Fallar si importar main carga paquetes pesados')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    results = {}
+    for mode in MODES:
+        runs = [run_child(mode) for _ in range(args.runs)]
+        results[mode] = {
+            key: median([run[key] for run in runs])
+            for key in ('import_ms', 'serving_ms', 'first_amount_ms', 'ready_ms', 'rss_ready_mb',
+                        'first_location_ms', 'process_ms')
+        }
+        results[mode]["warmup_steps_ms"] = runs[-1]["warmup_steps_ms"]
+        results[mode]["heavy_modules_at_import"] = runs[-1]["heavy_modules_at_import"]
+    results["import_self_ms_by_package"] = import_breakdown(args.top)
+    print(json.dumps({'benchmark': 'startup', 'params': vars(args), 'results': results}, indent=2))
+
+    if args.check and any(results[mode]["heavy_modules_at_import"] for mode in MODES):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Estadísticas por tipo de transacción: AmountAnomalyService.get_transaction_statistics sobre
+todo el historial frente al agregado incremental (StatisticsAggregate) que absorbe una
+transacción por análisis.
+
+--check compara los dos resultados para historiales de varios tamaños: deben coincidir
+exactamente mientras cada tipo tenga hasta exact_limit montos, y después la mediana debe
+quedar dentro del error relativo del sketch. También verifica que absorber el historial en dos
+tramos (extend desde una posición) dé lo mismo que un agregado único. Termina con código 1 si
+algo falla.
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.bench_statistics --check
+    python -m benchmarks.bench_statistics --sizes 100 10000 100000
+"""
+from datetime import datetime, timedelta, timezone
+from models import Transaction
+from services.amount_anomaly_service import AmountAnomalyService
+from services.transaction_history import TransactionHistory
+from services.transaction_statistics import StatisticsAggregate
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+def synthetic_transactions(size: int, rng: np.random.Generator):
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    amounts = np.round(rng.lognormal(3.5, 1.2, size), 2)
+    types = rng.choice(["Expense", "Income"], size, p=[0.8, 0.2])
+    return [
+        Transaction(transaction_id=f"tx-{i}", amount=float(amount), transactionType=str(kind),
+                    transactionName="bench", dateTime=started + timedelta(minutes=i), location=None)
+        for i, (amount, kind) in enumerate(zip(amounts, types))
+    ]
+
+def check(sizes, seed: int) -> dict:
+    service = AmountAnomalyService()
+    report, passed = {}, True
+    for size in sizes:
+        transactions = synthetic_transactions(size, np.random.default_rng(seed))
+        exact = service.get_transaction_statistics(transactions)
+
+        aggregate = StatisticsAggregate()
+        for end in range(1, size + 1, max(1, size // 50)):  # Crecer de a poco, como en producción
+            service.get_transaction_statistics(transactions[:end], aggregate=aggregate)
+        rolling = service.get_transaction_statistics(transactions, aggregate=aggregate)
+
+        history = TransactionHistory(transactions)
+        halves = StatisticsAggregate()
+        halves.extend(history.prefix(size // 2))
+        halves.extend(history, size // 2)
+        chunked = halves.statistics()
+
+        row = {}
+        for key, value in exact.items():
+            if key.endswith('_median'):
+                count = exact[key.replace('_median', '_count')]
+                tolerance = 0.0 if count <= aggregate.exact_limit else aggregate.relative_accuracy
+                error = abs(rolling[key] - value) / abs(value)
+                chunked_error = abs(chunked[key] - value) / abs(value)
+                row[key] = {'count': count, 'relative_error': error, 'chunked_relative_error': chunked_error}
+                passed &= error <= tolerance + 1e-12 and chunked_error <= tolerance + 1e-12
+            else:
+                passed &= rolling[key] == value and chunked[key] == value
+        report[size] = row
+    report['passed'] = bool(passed)
+    return report
+
+def benchmark(sizes, seed: int) -> list:
+    service = AmountAnomalyService()
+    results = []
+    for size in sizes:
+        transactions = synthetic_transactions(size + 1, np.random.default_rng(seed))
+        aggregate = StatisticsAggregate()
+        service.get_transaction_statistics(transactions[:size], aggregate=aggregate)
+
+        runs = max(1, 20000 // size)
+        began = time.perf_counter()
+        for _ in range(runs):
+            service.get_transaction_statistics(transactions[:size])
+        full_us = (time.perf_counter() - began) / runs * 1e6
+
+        # Una transacción nueva por análisis: el agregado solo absorbe esa
+        began = time.perf_counter()
+        service.get_transaction_statistics(transactions, aggregate=aggregate)
+        rolling_us = (time.perf_counter() - began) * 1e6
+
+        results.append({
+            'transactions': size,
+            'full_scan_us': round(full_us, 1),
+            'rolling_us': round(rolling_us, 1),
+            'stored_values': aggregate.stored_values()
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='Verificar el agregado frente al cálculo completo')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        report = check(args.sizes, args.seed)
+        print(json.dumps({'benchmark': 'statistics_accuracy', 'results': report}, indent=2))
+        if not report['passed']:
+            sys.exit(1)
+        return
+
+    results = benchmark(args.sizes, args.seed)
+    print(json.dumps({'benchmark': 'statistics', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Fake en memoria del subconjunto del cliente de Firestore que usan SmartFeature
+(accounts/{account_id}/transactions/{transaction_id}) y DB_Manager_Flask (offers), con
+latencia simulada por llamada para medir los servicios sin credenciales ni emulador.
+"""
+from google.api_core.exceptions import AlreadyExists, NotFound
+from threading import Lock
+from typing import Dict, Tuple
+import asyncio
+import datetime
+import time
+import uuid
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a is not None and a != b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+}
+
+DOCUMENT_ID = '__name__'  # FieldPath.document_id()
+
+class FakeWriteOption:
+    def __init__(self, exists: bool = None):
+        """Precondición de una escritura (Client.write_option); solo se imita exists."""
+        self.exists = exists
+
+def _merge(target: dict, data: dict):
+    """set(..., merge=True): mezcla mapas anidados y aplica los Increment de Firestore."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            nested = target.get(key)
+            target[key] = nested = nested if isinstance(nested, dict) else {}
+            _merge(nested, value)
+        elif type(value).__name__ == 'Increment':
+            target[key] = (target.get(key) or 0) + value.value
+        else:
+            target[key] = value
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: dict = None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        return self._data[field]
+
+class FakeDocumentReference:
+    def __init__(self, db: "FakeFirestore", path: Tuple[str, ...]):
+        self._db = db
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._db, self.path[:-1])
+
+    def collection(self, name: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._db, self.path + (name,))
+
+    def get(self):
+        return self._db._call(self._get)
+
+    def update(self, data: dict):
+        return self._db._call(self._update, data)
+
+    def set(self, data: dict, merge: bool = False):
+        return self._db._call(self._set, data, merge)
+
+    def create(self, data: dict):
+        return self._db._call(self._create, data)
+
+    def delete(self, option: FakeWriteOption = None):
+        return self._db._call(self._delete, option)
+
+    def _get(self) -> FakeSnapshot:
+        self._db.reads += 1
+        return FakeSnapshot(self, self._db.documents.get(self.path))
+
+    def _update(self, data: dict):
+        if self.path not in self._db.documents:
+            raise NotFound(f"No document to update: {'/'.join(self.path)}")
+        self._db.writes += 1
+        self._db.documents[self.path].update(data)
+
+    def _set(self, data: dict, merge: bool = False):
+        self._db.writes += 1
+        if merge:
+            _merge(self._db.documents.setdefault(self.path, {}), data)
+        else:
+            self._db.documents[self.path] = dict(data)
+
+    def _create(self, data: dict):
+        if self.path in self._db.documents:
+            raise AlreadyExists(f"Document already exists: {'/'.join(self.path)}")
+        self._set(data)
+
+    def _delete(self, option: FakeWriteOption = None):
+        if option is not None and option.exists and self.path not in self._db.documents:
+            raise NotFound(f"No document to delete: {'/'.join(self.path)}")
+        self._db.writes += 1
+        self._db.documents.pop(self.path, None)
+
+def _order_value(value):
+    """Valor comparable de un campo: Firestore ordena los GeoPoint por latitud y luego longitud."""
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return (value.latitude, value.longitude)
+    return value
+
+class FakeQuery:
+    def __init__(self, db: "FakeFirestore", path: Tuple[str, ...], filters: tuple = (), orders: tuple = (),
+                 cursor: tuple = None, limit: int = None, projection: tuple = None):
+        self._db = db
+        self.path = path
+        self._filters = filters
+        self._orders = orders          # ((campo, descendente), ...)
+        self._cursor = cursor          # Valores de start_after, uno por orden
+        self._limit = limit
+        self._projection = projection  # Campos de select(), o None para el documento completo
+
+    def _with(self, **changes) -> "FakeQuery":
+        state = dict(filters=self._filters, orders=self._orders, cursor=self._cursor,
+                     limit=self._limit, projection=self._projection)
+        state.update(changes)
+        return FakeQuery(self._db, self.path, **state)
+
+    def where(self, field: str, op: str, value) -> "FakeQuery":
+        return self._with(filters=self._filters + ((field, _OPERATORS[op], value),))
+
+    def order_by(self, field: str, direction: str = 'ASCENDING') -> "FakeQuery":
+        return self._with(orders=self._orders + ((field, direction == 'DESCENDING'),))
+
+    def start_after(self, values) -> "FakeQuery":
+        if isinstance(values, dict):
+            values = [values[field] for field, _ in self._orders if field in values]
+        return self._with(cursor=tuple(getattr(value, 'id', value) for value in values))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._with(limit=count)
+
+    def select(self, field_paths) -> "FakeQuery":
+        return self._with(projection=tuple(field_paths))
+
+    def stream(self):
+        if self._db.asynchronous:
+            return self._stream_async()
+        return iter(self._db._call(self._matching))
+
+    async def _stream_async(self):
+        for snapshot in await self._db._call(self._matching):
+            yield snapshot
+
+    def _matching(self):
+        depth = len(self.path) + 1
+        matches = []
+        for path, data in self._db.documents.items():
+            if len(path) == depth and path[:-1] == self.path:
+                if all(op(data.get(field), value) for field, op, value in self._filters):
+                    matches.append((path, data))
+
+        if self._orders:
+            orders = self._orders if self._orders[-1][0] == DOCUMENT_ID else self._orders + ((DOCUMENT_ID, False),)
+            key = lambda match, field: match[0][-1] if field == DOCUMENT_ID else _order_value(match[1].get(field))
+            # Como en Firestore, los documentos sin un campo del orden no aparecen
+            matches = [match for match in matches if all(key(match, field) is not None for field, _ in orders)]
+            for field, descending in reversed(orders):
+                matches.sort(key=lambda match: key(match, field), reverse=descending)
+            if self._cursor is not None:
+                cursor = self._cursor
+                def after(match) -> bool:
+                    for (field, descending), value in zip(orders, cursor):
+                        current, value = key(match, field), _order_value(value)
+                        if current != value:
+                            return (current < value) == descending
+                    return False
+                matches = [match for match in matches if after(match)]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+
+        snapshots = []
+        for path, data in matches:
+            if self._projection is not None:
+                data = {field: data[field] for field in self._projection if field in data}
+            snapshots.append(FakeSnapshot(FakeDocumentReference(self._db, path), data))
+        self._db.reads += max(len(snapshots), 1)  # Firestore cobra al menos una lectura por consulta
+        return snapshots
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db: "FakeFirestore", path: Tuple[str, ...]):
+        super().__init__(db, path)
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return FakeDocumentReference(self._db, self.path[:-1]) if len(self.path) > 1 else None
+
+    def document(self, document_id: str = None) -> FakeDocumentReference:
+        if document_id is None:
+            document_id = uuid.uuid4().hex[:20]  # Id automático, como Firestore
+        return FakeDocumentReference(self._db, self.path + (document_id,))
+
+    def add(self, data: dict, document_id: str = None):
+        """Crea un documento (con id automático si no se da); devuelve (update_time, referencia)."""
+        return self._db._call(self._add, data, document_id)
+
+    def _add(self, data: dict, document_id: str = None):
+        reference = self.document(document_id)
+        reference._set(data)
+        return datetime.datetime.now(datetime.timezone.utc), reference
+
+class FakeWriteBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self._db = db
+        self._operations = []
+
+    def create(self, reference: FakeDocumentReference, data: dict):
+        self._operations.append(('create', reference, data))
+
+    def update(self, reference: FakeDocumentReference, data: dict):
+        self._operations.append(('update', reference, data))
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False):
+        self._operations.append(('set', reference, (data, merge)))
+
+    def delete(self, reference: FakeDocumentReference, option: FakeWriteOption = None):
+        self._operations.append(('delete', reference, option))
+
+    def commit(self):
+        return self._db._call(self._commit)
+
+    def _commit(self):
+        # Como en Firestore, el lote es atómico: si falla una precondición (update o delete con
+        # exists=True de un documento que no existe, create de uno que ya existe) no se aplica nada
+        exists = {}
+        for kind, reference, data in self._operations:
+            present = exists.get(reference.path, reference.path in self._db.documents)
+            if kind == 'update' and not present:
+                raise NotFound(f"No document to update: {'/'.join(reference.path)}")
+            if kind == 'create' and present:
+                raise AlreadyExists(f"Document already exists: {'/'.join(reference.path)}")
+            if kind == 'delete' and data is not None and data.exists and not present:
+                raise NotFound(f"No document to delete: {'/'.join(reference.path)}")
+            exists[reference.path] = kind != 'delete'
+        for kind, reference, data in self._operations:
+            if kind == 'update':
+                reference._update(data)
+            elif kind == 'set':
+                reference._set(*data)
+            elif kind == 'create':
+                reference._set(data)
+            else:
+                reference._delete()
+        self._db.batches += 1
+
+class FakeFirestore:
+    def __init__(self, latency: float = 0.0, asynchronous: bool = True):
+        """
+        Args:
+            latency (float): Segundos que tarda cada llamada a "Firestore".
+            asynchronous (bool): True imita AsyncClient (await / async for); False imita el
+                cliente síncrono, que bloquea el hilo durante la latencia.
+        """
+        self.latency = latency
+        self.asynchronous = asynchronous
+        self.documents: Dict[Tuple[str, ...], dict] = {}
+        self.reads = 0
+        self.writes = 0
+        self.batches = 0
+        self._lock = Lock()  # El cliente síncrono se usa desde varios hilos (Flask)
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, (name,))
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def write_option(self, exists: bool = None) -> FakeWriteOption:
+        return FakeWriteOption(exists)
+
+    def _call(self, fn, *args):
+        if self.asynchronous:
+            return self._call_async(fn, *args)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            return fn(*args)
+
+    async def _call_async(self, fn, *args):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return fn(*args)
@@ -0,0 +1,166 @@
+"""
+Corre la batería de benchmarks con parámetros reducidos (cada uno en su propio proceso, así no
+comparten cachés ni métricas) y junta sus resultados en un registro JSON con el commit, la
+versión de Python y la fecha. Con --output el registro se agrega como una línea a un archivo
+JSON Lines, para seguir la evolución entre commits.
+
+Con --baseline se compara contra el último registro de ese archivo: latencias y tiempos (claves
+terminadas en _ms, _us o _s), documentos leídos/escritos y lotes no deben crecer más de
+--tolerance, ni el throughput (requests_per_second) caer más de eso; los percentiles de cola
+(p95/p99) se registran pero no se comparan. Como la misma máquina rinde distinto según su
+carga, cada registro incluye el tiempo de una carga fija (calibration_ms) y los tiempos de la
+referencia se escalan por la razón entre ambas calibraciones antes de comparar. Termina con
+código 1 si algo empeoró o si algún benchmark falló (incluidos sus --check).
+
+Uso (desde SmartFeature/):
+    python -m benchmarks.run_suite --output benchmarks/results.jsonl
+    python -m benchmarks.run_suite --baseline benchmarks/results.jsonl --only detectors endpoints
+"""
+from typing import Dict, List
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+# nombre -> argumentos de python -m benchmarks.bench_<nombre>
+SUITE = {
+    'detectors': ['--sizes', '50', '500', '2000', '--users', '10', '--repeat', '5'],
+    'endpoints': ['--users', '50', '--requests', '1000', '--concurrency', '50'],
+    'pipeline': ['--sizes', '500', '5000', '--users', '5', '--check'],
+    'offers_api': ['--requests', '1000'],
+    'fanout': ['--users', '20'],
+    'firestore_io': ['--users', '20', '--requests', '100'],
+    'request_rate': ['--requests', '300'],
+    'flag_writes': ['--requests', '1000'],
+    'ingest_pipeline': ['--new', '500', '--check'],
+    'batch_prefixes': ['--sizes', '500', '2000', '--check'],
+    'location_model': ['--sizes', '50', '500'],
+    'amount_lof': ['--sizes', '100', '1000', '10000', '--cases', '50', '--check'],
+    'statistics': ['--sizes', '100', '10000', '--check'],
+    'geo_distance': ['--check'],
+    'startup': ['--runs', '3', '--check']
+}
+
+LOWER_IS_BETTER = ('documents_read', 'documents_written', 'batches', 'failures')
+HIGHER_IS_BETTER = ('requests_per_second',)
+# Percentiles de cola: con pocas muestras por punto varían demasiado entre corridas para compararlos
+NOISY = ('p95_', 'p99_')
+
+def run_benchmark(name: str, args: List[str]) -> dict:
+    completed = subprocess.run(
+        [sys.executable, '-m', f'benchmarks.bench_{name}', *args],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    try:
+        output = json.loads(completed.stdout)
+    except json.JSONDecodeError:
+        output = None
+    if completed.returncode != 0 or output is None:
+        return {"error": completed.stderr.strip().splitlines()[-5:], "returncode": completed.returncode}
+    return output.get('results', output)
+
+def flatten(value, prefix: str = '') -> Dict[str, float]:
+    """{'a': {'b': 1}} -> {'a.b': 1}, solo los valores numéricos."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, nested in value.items():
+            flat.update(flatten(nested, f'{prefix}.{key}' if prefix else str(key)))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def calibrate(rounds: int = 5) -> float:
+    """Milisegundos de una carga fija de Python y NumPy (el mejor de rounds)."""
+    rng = np.random.default_rng(0)
+    values = rng.random(200000)
+    best = float('inf')
+    for _ in range(rounds):
+        began = time.perf_counter()
+        np.sort(values)
+        sum(i * i for i in range(200000))
+        best = min(best, time.perf_counter() - began)
+    return round(best * 1000, 3)
+
+def regressions(current: dict, baseline: dict, tolerance: float, slowdown: float = 1.0) -> List[dict]:
+    """Métricas que empeoraron más de tolerance; slowdown: calibración actual / de la referencia."""
+    found = []
+    before, after = flatten(baseline), flatten(current)
+    for key, new in after.items():
+        old = before.get(key)
+        metric = key.rsplit('.', 1)[-1]
+        if old is None or metric.startswith(NOISY):
+            continue
+        if metric.endswith(('_ms', '_us', '_s')):
+            worse = new > old * slowdown * (1 + tolerance)
+        elif metric.endswith(LOWER_IS_BETTER):
+            worse = new > old * (1 + tolerance)
+        elif metric.endswith(HIGHER_IS_BETTER):
+            worse = new < old / slowdown * (1 - tolerance)
+        else:
+            continue
+        if worse:
+            found.append({"metric": key, "baseline": old, "current": new})
+    return found
+
+def git_commit() -> str:
+    completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return completed.stdout.strip() or None
+
+def last_record(path: str) -> dict:
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=list(SUITE), help='Correr solo estos benchmarks')
+    parser.add_argument('--output', help='Archivo JSON Lines al que agregar el registro')
+    parser.add_argument('--baseline', help='Archivo JSON Lines cuyo último registro es la referencia')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Empeoramiento relativo permitido')
+    args = parser.parse_args()
+
+    names = args.only or list(SUITE)
+    record = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {name: SUITE[name] for name in names},
+        "results": {}
+    }
+    calibration = calibrate()
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        record["results"][name] = run_benchmark(name, SUITE[name])
+    # Antes y después, por si la carga de la máquina cambió durante la corrida
+    record["calibration_ms"] = round((calibration + calibrate()) / 2, 3)
+
+    failed = [name for name, result in record["results"].items() if "error" in result]
+    record["failed"] = failed
+    if args.baseline:
+        reference = last_record(args.baseline)
+        baseline = reference["results"]
+        slowdown = record["calibration_ms"] / reference["calibration_ms"] if reference.get("calibration_ms") else 1.0
+        record["baseline_commit"] = reference.get("commit")
+        record["slowdown"] = round(slowdown, 3)
+        record["regressions"] = regressions(
+            {name: record["results"][name] for name in names if name not in failed},
+            {name: baseline[name] for name in names if name in baseline},
+            args.tolerance, slowdown
+        )
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    print(json.dumps(record, indent=2))
+    if failed or record.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Usuarios sintéticos reproducibles (misma semilla, mismos datos) para los benchmarks: tamaño del
+historial, cantidad de cuentas, zonas habituales y su dispersión geográfica, viajes lejanos y
+montos por tipo. populate() los escribe en el Firestore falso con la forma de producción
+(accounts/{account_id} y accounts/{account_id}/transactions/{transaction_id}).
+"""
+from benchmarks.fake_firestore import FakeFirestore
+from typing import Dict, List, Tuple
+import datetime
+import numpy as np
+
+KM_PER_DEGREE = 111.32
+
+class SyntheticUser:
+    __slots__ = ("user_id", "account_ids", "transaction_ids", "accounts")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.account_ids: List[str] = []
+        self.transaction_ids: List[str] = []  # En orden de dateTime
+        self.accounts: Dict[str, List[Tuple[str, dict]]] = {}  # account_id -> [(transaction_id, documento)]
+
+    @property
+    def last_transaction_id(self) -> str:
+        return self.transaction_ids[-1]
+
+class SyntheticUsers:
+    def __init__(self, users: int = 50, history: Tuple[int, int] = (50, 500), accounts: Tuple[int, int] = (1, 3),
+                 zones: Tuple[int, int] = (1, 4), region_km: float = 300.0, spread_km: float = 3.0,
+                 travel: float = 0.03, income: float = 0.15, gap_hours: float = 20.0,
+                 center: Tuple[float, float] = (4.6, -74.08), seed: int = 0):
+        """
+        Args:
+            users (int): Cantidad de usuarios.
+            history (Tuple[int, int]): Rango (mínimo, máximo) de transacciones por usuario; el
+                tamaño se sortea log-uniforme, así hay muchos historiales cortos y pocos largos.
+            accounts (Tuple[int, int]): Rango de cuentas por usuario.
+            zones (Tuple[int, int]): Rango de zonas habituales por usuario.
+            region_km (float): Radio alrededor de center donde caen las zonas habituales.
+            spread_km (float): Desviación de las transacciones alrededor de su zona.
+            travel (float): Fracción de transacciones en un punto cualquiera del mundo.
+            income (float): Fracción de transacciones de tipo Income.
+            gap_hours (float): Tiempo medio entre transacciones de un usuario.
+            seed (int): Semilla; los mismos argumentos generan los mismos usuarios.
+        """
+        self.users = users
+        self.history = history
+        self.accounts = accounts
+        self.zones = zones
+        self.region_km = region_km
+        self.spread_km = spread_km
+        self.travel = travel
+        self.income = income
+        self.gap_hours = gap_hours
+        self.center = center
+        self.seed = seed
+
+    def generate(self) -> List[SyntheticUser]:
+        rng = np.random.default_rng(self.seed)
+        return [self._user(u, rng) for u in range(self.users)]
+
+    def populate(self, db: FakeFirestore) -> List[SyntheticUser]:
+        """Genera los usuarios y los escribe en el Firestore falso."""
+        users = self.generate()
+        for user in users:
+            for account_id, transactions in user.accounts.items():
+                db.documents[('accounts', account_id)] = {'user_id': user.user_id, 'name': 'Cuenta', 'amount': 0}
+                for transaction_id, data in transactions:
+                    db.documents[('accounts', account_id, 'transactions', transaction_id)] = data
+        return users
+
+    def _user(self, u: int, rng: np.random.Generator) -> SyntheticUser:
+        user = SyntheticUser(f"user-{u}")
+        low, high = self.history
+        size = int(round(np.exp(rng.uniform(np.log(low), np.log(high))))) if high > low else low
+        user.account_ids = [f"acc-{u}-{a}" for a in range(rng.integers(self.accounts[0], self.accounts[1] + 1))]
+        user.accounts = {account_id: [] for account_id in user.account_ids}
+
+        zones = self._offsets(self.center, self.region_km * np.sqrt(rng.random(rng.integers(self.zones[0], self.zones[1] + 1))), rng)
+        weights = rng.dirichlet(np.ones(len(zones)))
+        # Montos log-normales por tipo: gastos de decenas, ingresos de miles, con colas largas
+        expense_scale, income_scale = rng.uniform(20, 80), rng.uniform(800, 3000)
+
+        moment = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        for t in range(size):
+            moment += datetime.timedelta(hours=float(rng.exponential(self.gap_hours)))
+            if rng.random() < self.travel:
+                latitude, longitude = rng.uniform(-60, 60), rng.uniform(-180, 180)
+            else:
+                zone = zones[rng.choice(len(zones), p=weights)]
+                latitude, longitude = self._offsets(zone, np.abs(rng.normal(0, self.spread_km, 1)), rng)[0]
+            is_income = rng.random() < self.income
+            amount = (income_scale if is_income else expense_scale) * rng.lognormal(0, 0.6)
+
+            account_id = user.account_ids[rng.integers(len(user.account_ids))]
+            transaction_id = f"tx-{u}-{t}"
+            user.accounts[account_id].append((transaction_id, {
+                'amount': round(float(amount), 2),
+                'dateTime': moment,
+                'location': {'latitude': float(latitude), 'longitude': float(longitude)},
+                'transactionName': 'Nómina' if is_income else 'Compra',
+                'transactionType': 'Income' if is_income else 'Expense'
+            }))
+            user.transaction_ids.append(transaction_id)
+        return user
+
+    @staticmethod
+    def _offsets(origin: Tuple[float, float], distances_km, rng: np.random.Generator) -> np.ndarray:
+        """Puntos (latitud, longitud) a las distancias dadas de origin, en direcciones al azar."""
+        distances_km = np.asarray(distances_km, dtype=float)
+        bearing = rng.uniform(0, 2 * np.pi, len(distances_km))
+        latitude = origin[0] + distances_km * np.cos(bearing) / KM_PER_DEGREE
+        longitude = origin[1] + distances_km * np.sin(bearing) / (KM_PER_DEGREE * np.cos(np.radians(origin[0])))
+        return np.column_stack((np.clip(latitude, -89.9, 89.9), (longitude + 180) % 360 - 180))
@@ -1,4 +1,3 @@
-from firebase_admin import credentials, initialize_app
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +8,8 @@ class FirebaseConfig:
 
     def __new__(cls):
         if cls._instance is None:
+            # El SDK se importa aquí y no al importar el módulo: tarda cientos de ms
+            from firebase_admin import credentials, initialize_app
             cls._instance = super(FirebaseConfig, cls).__new__(cls)
             # Inicializar Firebase Admin SDK
             cred = credentials.Certificate(os.getenv('FIREBASE_CREDENTIALS_PATH'))
@@ -0,0 +1,132 @@
+from fastapi import Request
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+from services.batch_analysis_service import BatchAnalysisService
+from services.detector_pipeline import DetectorPipeline
+from services.change_sources import ChangeSource, FirestoreChangeSource
+from services.ingest_pipeline import IngestPipeline
+from services.warmup import Warmup
+from typing import Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class ServiceContainer:
+    INGEST_SOURCE = os.getenv('INGEST_SOURCE', 'none')  # 'firestore': analizar cada transacción al escribirse
+
+    def __init__(self, firestore_service: FirestoreService,
+                 anomaly_service: AnomalyDetectionService,
+                 amount_anomaly_service: AmountAnomalyService,
+                 ingest_source: ChangeSource = None):
+        """
+        Servicios que viven lo mismo que la aplicación y se comparten entre peticiones:
+        un único cliente de Firestore y detectores sin estado entre llamadas.
+
+        Args:
+            ingest_source (ChangeSource): Origen de transacciones nuevas para el pipeline de
+                ingesta; None para analizar solo cuando el cliente llama a los endpoints.
+        """
+        self.firestore_service = firestore_service
+        self.anomaly_service = anomaly_service
+        self.amount_anomaly_service = amount_anomaly_service
+        self.batch_analysis_service = BatchAnalysisService(anomaly_service, amount_anomaly_service)
+        self.detector_pipeline = DetectorPipeline.default(
+            anomaly_service, amount_anomaly_service, model_store=firestore_service
+        )
+        self.ingest_pipeline: Optional[IngestPipeline] = None
+        if ingest_source is not None:
+            self.ingest_pipeline = IngestPipeline(
+                firestore_service, anomaly_service, amount_anomaly_service, ingest_source, self.detector_pipeline
+            )
+        self._transactions_watch = None
+
+    @classmethod
+    def create(cls) -> "ServiceContainer":
+        """
+        Construye los servicios de producción. Firebase y el cliente de Firestore se inicializan
+        en el warm-up o en el primer uso (FirestoreService.connect), no aquí.
+        """
+        firestore_service = FirestoreService()
+        if cls.INGEST_SOURCE == 'firestore':
+            ingest_source = FirestoreChangeSource(firestore_service)
+        elif cls.INGEST_SOURCE == 'none':
+            ingest_source = None
+        else:
+            raise ValueError(f"Unknown ingest source: {cls.INGEST_SOURCE}")
+        return cls(
+            firestore_service=firestore_service,
+            anomaly_service=AnomalyDetectionService(),
+            amount_anomaly_service=AmountAnomalyService(),
+            ingest_source=ingest_source
+        )
+
+    def start(self, change_feed: bool = True):
+        """
+        Arranca los procesos de fondo: el listener que mantiene la caché de historiales al día
+        (salvo que el origen del pipeline ya lo haga) y el pipeline de ingesta si hay uno.
+        Se llama dentro del event loop de la aplicación.
+        """
+        pipeline = self.ingest_pipeline
+        if change_feed and (pipeline is None or not pipeline.source.PATCHES_CACHE):
+            self._transactions_watch = self.firestore_service.start_change_feed()
+        if pipeline is not None:
+            pipeline.start()
+
+    def warmup(self, change_feed: bool = True, preload_models: bool = True) -> Warmup:
+        """
+        Pasos de arranque: importar el SDK de Firebase y scikit-learn (en un hilo), crear el
+        cliente de Firestore y arrancar los procesos de fondo (ver start). Con
+        preload_models=False scikit-learn se importa recién en el primer análisis de ubicación.
+        """
+        async def connect_firestore():
+            self.firestore_service.connect()
+
+        async def start_background():
+            self.start(change_feed)
+
+        steps = {'firebase_sdk': self.firestore_service.preload}
+        if preload_models:
+            steps['location_backend'] = self.anomaly_service.preload
+        steps['firestore_client'] = connect_firestore
+        steps['background_tasks'] = start_background
+        return Warmup(steps)
+
+    async def stop(self):
+        """
+        Detiene los procesos de fondo; el pipeline termina lo encolado y los flags que quedan en
+        el buffer write-behind se escriben.
+        """
+        if self.ingest_pipeline is not None:
+            await self.ingest_pipeline.stop()
+        await self.firestore_service.flag_writer.flush()
+        await self.detector_pipeline.flush()
+        self.detector_pipeline.close()
+        if self._transactions_watch is not None:
+            try:
+                self._transactions_watch.unsubscribe()
+            except Exception as e:
+                logger.error(f"Error stopping transactions change feed: {str(e)}")
+            self._transactions_watch = None
+
+def get_services(request: Request) -> ServiceContainer:
+    return request.app.state.services
+
+def get_firestore_service(request: Request) -> FirestoreService:
+    return request.app.state.services.firestore_service
+
+def get_anomaly_service(request: Request) -> AnomalyDetectionService:
+    return request.app.state.services.anomaly_service
+
+def get_amount_anomaly_service(request: Request) -> AmountAnomalyService:
+    return request.app.state.services.amount_anomaly_service
+
+def get_batch_analysis_service(request: Request) -> BatchAnalysisService:
+    return request.app.state.services.batch_analysis_service
+
+def get_detector_pipeline(request: Request) -> DetectorPipeline:
+    return request.app.state.services.detector_pipeline
+
+def get_ingest_pipeline(request: Request) -> Optional[IngestPipeline]:
+    return request.app.state.services.ingest_pipeline
@@ -1,54 +1,188 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from models import Transaction, AnomalyResponse, AmountAnomalyResponse, TransactionStatistics
 from services.firestore_service import FirestoreService
 from services.location_anomaly_service import AnomalyDetectionService
-from services.amount_anomaly_service import AmountAnomalyService
-from config import FirebaseConfig
+from services.batch_analysis_service import BatchAnalysisService
+from services.detector_pipeline import DetectorPipeline
+from services.ingest_pipeline import IngestPipeline
+from services.metrics import metrics
+from dependencies import (
+    ServiceContainer, get_firestore_service, get_anomaly_service, get_batch_analysis_service, get_detector_pipeline,
+    get_ingest_pipeline
+)
+import asyncio
 import logging
+import os
 from pydantic import BaseModel
+from typing import List, Optional
 
 class CombinedAnomalyResponse(BaseModel):
     location_analysis: AnomalyResponse
     amount_analysis: AmountAnomalyResponse
+    success: bool  # Los flags quedaron escritos en Firestore
+
+class BatchAnalysisRequest(BaseModel):
+    transaction_ids: Optional[List[str]] = None  # None: todas las transacciones del usuario
+    only_unflagged: bool = False                 # Solo las que aún no tienen flags de anomalía
+    limit: Optional[int] = None                  # Transacciones por página (hasta BatchAnalysisService.MAX_TRANSACTIONS)
+    after: Optional[str] = None                  # next_after de la página anterior
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[CombinedAnomalyResponse]
+    not_found: List[str]
+    written: int
     success: bool
+    next_after: Optional[str] = None  # Cursor de la página siguiente; None si no quedan transacciones
 
-app = FastAPI()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicializar Firebase
-firebase_config = FirebaseConfig()
+# 'eager': el warm-up (Firebase, scikit-learn, procesos de fondo) termina antes de atender;
+# 'background': se atiende de inmediato y el warm-up corre en segundo plano (ver /ready);
+# 'lazy': como 'background', pero scikit-learn se importa recién en el primer análisis de ubicación
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'eager')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Crea los servicios una sola vez al arrancar (Firebase, cliente de Firestore, detectores)
+    y los libera al apagar. Si ya hay servicios en app.state (p. ej. benchmarks con un
+    Firestore falso), se usan esos, sin listeners de Firestore.
+    """
+    injected = getattr(app.state, 'services', None) is not None
+    if not injected:
+        app.state.services = ServiceContainer.create()
+    # El warm-up arranca el listener que mantiene la caché de historiales al día (no con servicios inyectados)
+    warmup = app.state.warmup = app.state.services.warmup(
+        change_feed=not injected, preload_models=STARTUP_MODE != 'lazy'
+    )
+    if STARTUP_MODE in ('background', 'lazy'):
+        warmup.start()
+    elif STARTUP_MODE == 'eager':
+        await warmup.run()
+    else:
+        raise ValueError(f"Unknown startup mode: {STARTUP_MODE}")
+    yield
+    await warmup.stop()
+    await app.state.services.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# Agregar a cada respuesta el header Server-Timing con el desglose por etapa y los documentos leídos/escritos
+TIMING_HEADER = os.getenv('TIMING_HEADER', '0') == '1'
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Latencia, estado y documentos de Firestore por ruta (la plantilla, no la URL con ids)."""
+    timings = metrics.start_request()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    metrics.finish_request(timings, request.method, route.path if route is not None else 'unmatched',
+                           response.status_code)
+    if TIMING_HEADER:
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+async def _load_history(firestore_service: FirestoreService, user_id: str, transaction_id: str):
+    """
+    Obtiene el historial del usuario y la transacción a analizar (por índice, sin recorrer la lista).
+    Si el historial en caché todavía no contiene la transacción (recién escrita), se actualiza
+    desde Firestore.
+    """
+    history = await firestore_service.get_user_history_with(user_id, [transaction_id])
+    return history, history.get(transaction_id)
+
+async def _write_flags(firestore_service: FirestoreService, user_id: str, history, transaction: Transaction,
+                       location_anomaly: bool = None, amount_anomaly: bool = None, wait: bool = False) -> bool:
+    """
+    Deja los flags en el buffer write-behind. Con wait=False no espera a que se escriban (la
+    respuesta no depende de la latencia de Firestore; si el flush falla queda en el log y en
+    failures de smartfeature_flag_writes) y devuelve True; con wait=True espera el lote que los
+    escribe y devuelve si quedaron escritos. Si la cuenta de la transacción no se conoce se busca
+    en las cuentas del usuario y siempre se espera la escritura.
+    """
+    account_id = history.account_of(transaction.transaction_id)
+    if account_id is None:
+        return await firestore_service.update_transaction_anomalies(
+            user_id, transaction.transaction_id, location_anomaly, amount_anomaly, transaction=transaction
+        )
+    written = firestore_service.queue_anomaly_flags(
+        user_id, transaction.transaction_id, account_id, location_anomaly, amount_anomaly, transaction
+    )
+    return await written if wait else True
+
+@app.get("/ready")
+async def ready(request: Request):
+    """Readiness: 200 cuando terminó el warm-up (Firebase, scikit-learn, procesos de fondo); 503 mientras tanto."""
+    warmup = request.app.state.warmup
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(firestore_service: FirestoreService = Depends(get_firestore_service),
+                           anomaly_service: AnomalyDetectionService = Depends(get_anomaly_service),
+                           detector_pipeline: DetectorPipeline = Depends(get_detector_pipeline),
+                           ingest_pipeline: Optional[IngestPipeline] = Depends(get_ingest_pipeline)):
+    """Métricas en formato de texto de Prometheus, con los contadores de caché, buffer, detectores e ingesta como gauges."""
+    gauges = {
+        "smartfeature_history_cache": firestore_service.cache.stats(),
+        "smartfeature_history_loads": firestore_service.history_loads.stats(),
+        "smartfeature_flag_writes": firestore_service.flag_writer.stats(),
+        "smartfeature_detector_pipeline": detector_pipeline.stats(),
+        "smartfeature_location_models": anomaly_service.stats()
+    }
+    if ingest_pipeline is not None:
+        gauges["smartfeature_ingest"] = ingest_pipeline.stats()
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/history-cache/stats")
+async def history_cache_stats(firestore_service: FirestoreService = Depends(get_firestore_service)):
+    """
+    Contadores de aciertos, fallos y expulsiones de la caché de historiales, y cuántas lecturas
+    de Firestore se compartieron entre peticiones concurrentes del mismo usuario.
+    """
+    return {**firestore_service.cache.stats(), "loads": firestore_service.history_loads.stats()}
+
+@app.get("/api/flag-writes/stats")
+async def flag_writes_stats(firestore_service: FirestoreService = Depends(get_firestore_service)):
+    """Escrituras de flags encoladas, juntadas, lotes escritos y fallos del buffer write-behind."""
+    return firestore_service.flag_writer.stats()
+
+@app.get("/api/ingest/stats")
+async def ingest_stats(ingest_pipeline: Optional[IngestPipeline] = Depends(get_ingest_pipeline)):
+    """Profundidad de la cola y contadores del pipeline de ingesta (si está activo)."""
+    if ingest_pipeline is None:
+        return {"enabled": False}
+    return {"enabled": True, **ingest_pipeline.stats()}
 
 @app.post("/api/analyze-transaction-location/{user_id}/{transaction_id}", response_model=AnomalyResponse)
-async def analyze_transaction(user_id: str, transaction_id: str):
+async def analyze_transaction(user_id: str, transaction_id: str,
+                              firestore_service: FirestoreService = Depends(get_firestore_service),
+                              detector_pipeline: DetectorPipeline = Depends(get_detector_pipeline)):
     """Analiza una transacción específica para detectar anomalías geográficas."""
     try:
-        firestore_service = FirestoreService()
-        anomaly_service = AnomalyDetectionService()
-
-        historical_transactions = await firestore_service.get_user_transactions(user_id)
-        current_transaction = next(
-            (t for t in historical_transactions if t.transaction_id == transaction_id),
-            None
+        history, current_transaction = await _load_history(
+            firestore_service, user_id, transaction_id
         )
-        
+
         if not current_transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
 
-        previous_transactions = [
-            t for t in historical_transactions 
-            if t.dateTime < current_transaction.dateTime
-        ]
+        previous_transactions = history.before(current_transaction.dateTime)
 
-        is_anomaly, confidence, reason = anomaly_service.detect_anomaly(
-            current_transaction,
-            previous_transactions
+        location_cells = await firestore_service.get_location_cells_for(user_id, history, current_transaction)
+        analysis = await detector_pipeline.analyze(
+            user_id, current_transaction, previous_transactions, stages=('location',), location_cells=location_cells
         )
+        is_anomaly, confidence, reason = analysis.results['location']
 
         # Update the locationAnomaly flag in Firebase
-        await firestore_service.update_transaction_anomalies(
-            user_id, 
-            transaction_id, 
+        await _write_flags(
+            firestore_service,
+            user_id,
+            history,
+            current_transaction,
             location_anomaly=is_anomaly
         )
 
@@ -64,38 +198,33 @@ async def analyze_transaction(user_id: str, transaction_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/analyze-transaction-amount/{user_id}/{transaction_id}", response_model=AmountAnomalyResponse)
-async def analyze_transaction_amount(user_id: str, transaction_id: str):
+async def analyze_transaction_amount(user_id: str, transaction_id: str,
+                                     firestore_service: FirestoreService = Depends(get_firestore_service),
+                                     detector_pipeline: DetectorPipeline = Depends(get_detector_pipeline)):
     """Analiza una transacción específica para detectar anomalías en el monto."""
     try:
-        firestore_service = FirestoreService()
-        amount_anomaly_service = AmountAnomalyService()
-
-        historical_transactions = await firestore_service.get_user_transactions(user_id)
-        current_transaction = next(
-            (t for t in historical_transactions if t.transaction_id == transaction_id),
-            None
+        history, current_transaction = await _load_history(
+            firestore_service, user_id, transaction_id
         )
-        
+
         if not current_transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
 
-        previous_transactions = [
-            t for t in historical_transactions 
-            if t.dateTime < current_transaction.dateTime
-        ]
+        previous_transactions = history.before(current_transaction.dateTime)
 
-        is_anomaly, confidence, reason = amount_anomaly_service.detect_amount_anomaly(
-            current_transaction,
-            previous_transactions
+        analysis = await detector_pipeline.analyze(
+            user_id, current_transaction, previous_transactions, stages=('amount', 'statistics')
         )
-
-        stats = amount_anomaly_service.get_transaction_statistics(previous_transactions)
+        is_anomaly, confidence, reason = analysis.results['amount']
+        stats = analysis.results['statistics']
         statistics = TransactionStatistics(**stats) if stats else None
 
         # Update the amountAnomaly flag in Firebase
-        await firestore_service.update_transaction_anomalies(
-            user_id, 
-            transaction_id, 
+        await _write_flags(
+            firestore_service,
+            user_id,
+            history,
+            current_transaction,
             amount_anomaly=is_anomaly
         )
 
@@ -112,48 +241,39 @@ async def analyze_transaction_amount(user_id: str, transaction_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/analyze-transaction-complete/{user_id}/{transaction_id}", response_model=CombinedAnomalyResponse)
-async def analyze_transaction_complete(user_id: str, transaction_id: str):
+async def analyze_transaction_complete(user_id: str, transaction_id: str,
+                                       firestore_service: FirestoreService = Depends(get_firestore_service),
+                                       detector_pipeline: DetectorPipeline = Depends(get_detector_pipeline)):
     """Analiza una transacción para detectar anomalías tanto en ubicación como en monto."""
     try:
-        firestore_service = FirestoreService()
-        anomaly_service = AnomalyDetectionService()
-        amount_anomaly_service = AmountAnomalyService()
-
-        historical_transactions = await firestore_service.get_user_transactions(user_id)
-        current_transaction = next(
-            (t for t in historical_transactions if t.transaction_id == transaction_id),
-            None
+        history, current_transaction = await _load_history(
+            firestore_service, user_id, transaction_id
         )
-        
+
         if not current_transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
 
-        previous_transactions = [
-            t for t in historical_transactions 
-            if t.dateTime < current_transaction.dateTime
-        ]
+        previous_transactions = history.before(current_transaction.dateTime)
 
-        # Location anomaly analysis
-        is_location_anomaly, location_confidence, location_reason = anomaly_service.detect_anomaly(
-            current_transaction,
-            previous_transactions
+        # Location, amount and statistics stages over features extracted once (heavy stages run concurrently)
+        location_cells = await firestore_service.get_location_cells_for(user_id, history, current_transaction)
+        analysis = await detector_pipeline.analyze(
+            user_id, current_transaction, previous_transactions, location_cells=location_cells
         )
-
-        # amount anomaly analysis
-        is_amount_anomaly, amount_confidence, amount_reason = amount_anomaly_service.detect_amount_anomaly(
-            current_transaction,
-            previous_transactions
-        )
-
-        stats = amount_anomaly_service.get_transaction_statistics(previous_transactions)
+        is_location_anomaly, location_confidence, location_reason = analysis.results['location']
+        is_amount_anomaly, amount_confidence, amount_reason = analysis.results['amount']
+        stats = analysis.results['statistics']
         statistics = TransactionStatistics(**stats) if stats else None
 
         # Update both flags in Firebase
-        update_success = await firestore_service.update_transaction_anomalies(
+        update_success = await _write_flags(
+            firestore_service,
             user_id,
-            transaction_id,
+            history,
+            current_transaction,
             location_anomaly=is_location_anomaly,
-            amount_anomaly=is_amount_anomaly
+            amount_anomaly=is_amount_anomaly,
+            wait=True  # success informa si los flags quedaron escritos
         )
 
         return CombinedAnomalyResponse(
@@ -177,6 +297,76 @@ async def analyze_transaction_complete(user_id: str, transaction_id: str):
         logger.error(f"Error in complete transaction analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/analyze-transactions-batch/{user_id}", response_model=BatchAnalysisResponse)
+async def analyze_transactions_batch(user_id: str, request: BatchAnalysisRequest,
+                                     firestore_service: FirestoreService = Depends(get_firestore_service),
+                                     batch_analysis_service: BatchAnalysisService = Depends(get_batch_analysis_service)):
+    """
+    Analiza varias transacciones de un usuario (o todas las que no tienen flags) cargando el historial
+    una sola vez; cada una se compara con sus transacciones anteriores y los flags se escriben en lotes.
+    Se analizan a lo sumo BatchAnalysisService.MAX_TRANSACTIONS por petición; si quedan más, la
+    respuesta trae next_after para pedir la página siguiente.
+    """
+    max_transactions = batch_analysis_service.MAX_TRANSACTIONS
+    if request.transaction_ids is not None and len(request.transaction_ids) > max_transactions:
+        raise HTTPException(status_code=400, detail=f"At most {max_transactions} transaction_ids per request")
+    if request.limit is not None and not 1 <= request.limit <= max_transactions:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {max_transactions}")
+    try:
+        # Como los endpoints individuales: también encuentra ids anteriores a la marca de agua de la caché
+        history = await firestore_service.get_user_history_with(user_id, request.transaction_ids or [])
+
+        try:
+            transactions, not_found, next_after = batch_analysis_service.select(
+                history, request.transaction_ids, request.only_unflagged, request.after,
+                request.limit or max_transactions
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Los ajustes de KMeans/LOF de cada prefijo corren en un hilo: el event loop sigue atendiendo
+        scores = await asyncio.to_thread(batch_analysis_service.score, history, transactions)
+
+        # Update the flags of every analyzed transaction in WriteBatches
+        written = await firestore_service.update_anomalies_batch(
+            user_id, history, {score.transaction.transaction_id: score.flags() for score in scores}
+        )
+
+        results = []
+        for score in scores:
+            transaction_id = score.transaction.transaction_id
+            is_location_anomaly, location_confidence, location_reason = score.location
+            is_amount_anomaly, amount_confidence, amount_reason = score.amount
+            results.append(CombinedAnomalyResponse(
+                location_analysis=AnomalyResponse(
+                    is_anomaly=is_location_anomaly,
+                    confidence=location_confidence,
+                    reason=location_reason,
+                    transaction_id=transaction_id
+                ),
+                amount_analysis=AmountAnomalyResponse(
+                    is_anomaly=is_amount_anomaly,
+                    confidence=amount_confidence,
+                    reason=amount_reason,
+                    transaction_id=transaction_id,
+                    statistics=None
+                ),
+                success=True
+            ))
+
+        return BatchAnalysisResponse(
+            results=results,
+            not_found=not_found,
+            written=written,
+            success=written == len(scores),
+            next_after=next_after
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch transaction analysis: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -14,6 +14,9 @@ class Transaction(BaseModel):
     location: Optional[Location]
     transactionName: str
     transactionType: str
+    locationAnomaly: Optional[bool] = None  # None mientras la transacción no se ha analizado
+    amountAnomaly: Optional[bool] = None
+    geohash: Optional[str] = None  # Celda de la ubicación (services/geohash.py); None si no se ha escrito
 
 class Account(BaseModel):
     account_id: str
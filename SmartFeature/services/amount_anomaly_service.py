@@ -1,11 +1,322 @@
-from typing import List, Tuple
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 from models import Transaction
+from services.metrics import metrics, timed
+from services.model_locks import ModelBusy, holding
+from services.transaction_history import TransactionHistory
+from services.transaction_statistics import StatisticsAggregate
 import numpy as np
-from sklearn.neighbors import LocalOutlierFactor
 import logging
 
+if TYPE_CHECKING:
+    from services.detector_pipeline import AnalysisContext
+
 logger = logging.getLogger(__name__)
 
+def _negative_outlier_factors(values: np.ndarray, k: int, ranks: np.ndarray = None) -> np.ndarray:
+    """
+    LOF de cada punto de un arreglo 1-D ordenado, con la misma fórmula que
+    LocalOutlierFactor.negative_outlier_factor_ de scikit-learn.
+
+    En una dimensión los k vecinos más cercanos de values[i] son una ventana contigua
+    de k+1 posiciones que contiene a i: se elige la ventana más estrecha en vez de hacer
+    una búsqueda de vecinos general. Los empates de distancia en el borde de la ventana se
+    resuelven por orden de llegada, como una búsqueda de vecinos estable por índice: entre
+    los montos a la distancia k-ésima a cada lado ganan los de menor ranks (posición en el
+    historial; los montos iguales deben venir ordenados por ranks). El resultado en la
+    posición i solo depende de las posiciones i-3k..i+3k y de los primeros k montos de cada
+    grupo de montos iguales.
+    """
+    n = len(values)
+    positions = np.arange(n)
+    if ranks is None:
+        ranks = positions
+
+    # Ventanas candidatas [start, start + k] que contienen a i
+    starts = np.clip(positions[:, None] + np.arange(-k, 1), 0, n - k - 1)
+    widths = np.maximum(values[:, None] - values[starts], values[starts + k] - values[:, None])
+    best = np.argmin(widths, axis=1)
+    k_distances = widths[positions, best]
+    starts = starts[positions, best]
+
+    # La ventana tiene a todos los montos más cercanos que el k-distance y completa con los que
+    # están justo a esa distancia. Los montos iguales tienen el mismo k-distance y lrd, así que
+    # solo importa cuántos se toman de cada lado; se toman los contiguos a la ventana. Solo hay
+    # que revisar las ventanas con un monto a la misma distancia justo afuera (con k-distance 0
+    # la ventana más estrecha ya son k+1 montos iguales).
+    before, after = np.maximum(starts - 1, 0), np.minimum(starts + k + 1, n - 1)
+    ambiguous = np.flatnonzero((k_distances > 0) & (
+        ((starts > 0) & (values - values[before] <= k_distances))
+        | ((starts + k < n - 1) & (values[after] - values <= k_distances))
+    ))
+    if len(ambiguous):
+        starts[ambiguous] = _tie_window_starts(values, k, ranks, ambiguous, k_distances[ambiguous])
+
+    # Vecinos: la ventana elegida sin el propio punto
+    window = starts[:, None] + np.arange(k + 1)
+    neighbors = window[window != positions[:, None]].reshape(n, k)
+
+    distances = np.abs(values[neighbors] - values[:, None])
+    reach_distances = np.maximum(distances, k_distances[neighbors])
+    lrd = 1.0 / (np.mean(reach_distances, axis=1) + 1e-10)
+    return -np.mean(lrd[neighbors] / lrd[:, None], axis=1)
+
+def _tie_window_starts(values: np.ndarray, k: int, ranks: np.ndarray, rows: np.ndarray,
+                       k_distances: np.ndarray) -> np.ndarray:
+    """Inicio de la ventana de vecinos de las filas rows con empates de distancia en el borde."""
+    n = len(values)
+    around = rows[:, None] + np.arange(-k, k + 1)
+    inside = (around >= 0) & (around < n)
+    closer = inside & (np.abs(values[np.clip(around, 0, n - 1)] - values[rows, None]) < k_distances[:, None])
+    first = rows - closer[:, :k].sum(axis=1)      # Primera posición más cercana que el k-distance
+    last = rows + closer[:, k + 1:].sum(axis=1)   # Última posición más cercana que el k-distance
+    missing = k - (last - first)                  # Vecinos que salen de los bordes
+    left_tie = (first > 0) & (values[rows] - values[np.maximum(first - 1, 0)] == k_distances)
+    right_tie = (last < n - 1) & (values[np.minimum(last + 1, n - 1)] - values[rows] == k_distances)
+    starts = np.where(right_tie, first, first - missing)
+
+    both = np.flatnonzero(left_tie & right_tie)
+    if len(both):
+        # Se toman los `missing` de menor rango entre los primeros k montos de cada borde
+        first, last, missing = first[both], last[both], missing[both]
+        left_start = np.searchsorted(values, values[first - 1], side='left')
+        left_size = first - left_start
+        right_size = np.searchsorted(values, values[last + 1], side='right') - last - 1
+        take = np.arange(k)
+        left_ranks = np.where(take < left_size[:, None], ranks[np.minimum(left_start[:, None] + take, n - 1)], np.inf)
+        right_ranks = np.where(take < right_size[:, None], ranks[np.minimum(last[:, None] + 1 + take, n - 1)], np.inf)
+        order = np.argsort(np.concatenate((left_ranks, right_ranks), axis=1), axis=1, kind='stable')
+        from_left = ((order < k) & (np.arange(2 * k) < missing[:, None])).sum(axis=1)
+        starts[both] = first - from_left
+    return starts
+
+def _percentile(quantile: float, size: int, kth_smallest) -> float:
+    """np.percentile(..., method='linear') a partir de una función que da el k-ésimo menor valor."""
+    virtual_index = quantile * (size - 1)
+    previous_index = int(np.floor(virtual_index))
+    gamma = virtual_index - previous_index
+    previous_value = kth_smallest(previous_index)
+    next_value = kth_smallest(min(previous_index + 1, size - 1))
+    # Misma interpolación que numpy (_lerp) para obtener exactamente el mismo umbral
+    diff = next_value - previous_value
+    if gamma >= 0.5:
+        return next_value - diff * (1 - gamma)
+    return previous_value + diff * gamma
+
+class AmountModel:
+    def __init__(self, amounts=(), n_neighbors: int = 5, contamination: float = 0.1):
+        """
+        Modelo incremental de los montos de un tipo de transacción (Income o Expense) de un usuario.
+        Guarda los montos ordenados y el LOF de cada uno, de modo que evaluar un monto nuevo o
+        agregarlo solo recalcula el vecindario afectado (O(k²) + búsqueda binaria) en lugar de
+        reajustar LocalOutlierFactor sobre todo el historial.
+
+        El veredicto coincide con LocalOutlierFactor(n_neighbors, contamination).fit_predict sobre
+        los montos (en el orden en que se agregaron) más el nuevo; los empates de distancia entre
+        vecinos se resuelven por ese orden (ver _negative_outlier_factors).
+
+        Vive solo en memoria: guarda todos los montos del tipo, tantos como el historial del que se
+        construye, así que traerlo de Firestore costaría lo mismo que reconstruirlo (O(n log n)).
+
+        Args:
+            amounts: Montos históricos, en el orden del historial.
+            n_neighbors (int): Vecinos usados por LOF.
+            contamination (float): Fracción esperada de anomalías.
+        """
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+        self.last_transaction_id: Optional[str] = None  # Última transacción absorbida por el modelo
+        self.lock = Lock()  # Quien lee o actualiza el modelo lo toma (ver services.model_locks)
+        self._set_amounts(amounts)
+
+    def __len__(self) -> int:
+        return len(self._amounts)
+
+    @property
+    def amounts(self) -> np.ndarray:
+        return self._amounts
+
+    def score(self, amount: float) -> Tuple[bool, float]:
+        """
+        Evalúa un monto como si se agregara al modelo, sin modificarlo.
+
+        Returns:
+            Tuple[bool, float]: Si es anómalo y su negative outlier factor.
+        """
+        position, start, new_factors, old_stop = self._insert_locally(amount)
+        size = len(self._amounts) + 1
+        removed = np.sort(self._factors[start:old_stop])
+        added = np.sort(new_factors)
+
+        def kth_smallest(kth: int) -> float:
+            return self._kth_smallest(removed, added, kth)
+
+        offset = _percentile(self.contamination, size, kth_smallest)
+        factor = new_factors[position - start]
+        return bool(factor < offset), float(factor)
+
+    def add(self, amount: float, transaction_id: str = None):
+        """Agrega un monto al modelo actualizando solo el vecindario afectado."""
+        position, start, new_factors, old_stop = self._insert_locally(amount)
+        removed = self._factors[start:old_stop]
+
+        self._ranks = np.insert(self._ranks, position, len(self._amounts))
+        self._amounts = np.insert(self._amounts, position, amount)
+        self._factors = np.concatenate((self._factors[:start], new_factors, self._factors[old_stop:]))
+
+        # Quitar los LOF viejos de la región (pueden repetirse) e intercalar los nuevos
+        removed = np.sort(removed)
+        repeats = np.arange(len(removed)) - np.searchsorted(removed, removed)
+        sorted_factors = np.delete(self._sorted_factors, np.searchsorted(self._sorted_factors, removed) + repeats)
+        added = np.sort(new_factors)
+        self._sorted_factors = np.insert(sorted_factors, np.searchsorted(sorted_factors, added), added)
+        if transaction_id is not None:
+            self.last_transaction_id = transaction_id
+
+    def extend(self, amounts, last_transaction_id: str = None):
+        """
+        Agrega varios montos. Si son muchos respecto al modelo, recalcular todo de una vez
+        (vectorizado) es más barato que insertarlos uno a uno.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        if len(amounts) == 0:
+            return
+        if len(self._amounts) <= self.n_neighbors or len(amounts) > len(self._amounts) // 8:
+            self.reset(np.concatenate((self.ordered_amounts(), amounts)), last_transaction_id)
+            return
+        for amount in amounts:
+            self.add(amount)
+        if last_transaction_id is not None:
+            self.last_transaction_id = last_transaction_id
+
+    def reset(self, amounts, last_transaction_id: str = None):
+        """Reemplaza todos los montos del modelo (en el orden del historial) y lo reajusta."""
+        self.last_transaction_id = last_transaction_id
+        self._set_amounts(amounts)
+
+    def ordered_amounts(self) -> np.ndarray:
+        """Montos del modelo en el orden en que se agregaron."""
+        ordered = np.empty_like(self._amounts)
+        ordered[self._ranks] = self._amounts
+        return ordered
+
+    def _set_amounts(self, amounts):
+        amounts = np.asarray(amounts, dtype=float)
+        self._ranks = np.argsort(amounts, kind='stable')  # Orden de llegada de cada monto ordenado
+        self._amounts = amounts[self._ranks]
+        self._refit()
+
+    @timed('lof_fit')
+    def _refit(self):
+        metrics.count_fit('lof')
+        if len(self._amounts) > self.n_neighbors:
+            self._factors = _negative_outlier_factors(self._amounts, self.n_neighbors, self._ranks)
+        else:
+            self._factors = np.zeros(len(self._amounts))  # Sin vecinos suficientes aún
+        self._sorted_factors = np.sort(self._factors)
+
+    def _insert_locally(self, amount: float):
+        """
+        Inserta el monto en una copia local del vecindario y recalcula sus LOF.
+
+        Returns:
+            (posición del monto, inicio de la región recalculada, LOF nuevos de la región,
+            fin (exclusivo) de la región en el arreglo actual)
+        """
+        k = self.n_neighbors
+        n = len(self._amounts)
+        if n < k:
+            raise ValueError(f"AmountModel needs at least {k} amounts to score")
+
+        position = bisect_right(self._amounts, amount)  # Tras los montos iguales, como el último de fit_predict
+        if n + 1 <= 12 * k + 2 or n <= k:
+            # Historial pequeño: recalcular todo es igual de barato
+            start, old_stop, slice_start, slice_stop = 0, n, 0, n
+        else:
+            # Cambian los LOF de las posiciones a menos de 3k del monto nuevo, y para
+            # recalcularlos exactamente se necesitan otras 3k posiciones a cada lado.
+            start, old_stop = max(0, position - 3 * k), min(n, position + 3 * k)
+            slice_start, slice_stop = max(0, start - 3 * k), min(n, old_stop + 3 * k)
+
+        # Si la copia empieza a mitad de un grupo de montos iguales, se le anteponen los primeros
+        # k del grupo: deciden los empates de distancia (ver _negative_outlier_factors)
+        group_start = bisect_left(self._amounts, self._amounts[slice_start]) if slice_start else 0
+        heads = np.arange(group_start, min(group_start + k, slice_start))
+        local = np.insert(self._amounts[slice_start:slice_stop], position - slice_start, amount)
+        local_ranks = np.insert(self._ranks[slice_start:slice_stop], position - slice_start, n)
+        factors = _negative_outlier_factors(
+            np.concatenate((self._amounts[heads], local)), k, np.concatenate((self._ranks[heads], local_ranks))
+        )
+        offset = len(heads) - slice_start
+        new_factors = factors[start + offset:old_stop + 1 + offset]
+        return position, start, new_factors, old_stop
+
+    def _kth_smallest(self, removed: np.ndarray, added: np.ndarray, kth: int) -> float:
+        """k-ésimo menor (desde 0) de los LOF del modelo quitando removed y agregando added."""
+        base = self._sorted_factors
+
+        def count_le(value: float) -> int:
+            return (int(np.searchsorted(base, value, side='right'))
+                    - int(np.searchsorted(removed, value, side='right'))
+                    + int(np.searchsorted(added, value, side='right')))
+
+        best = np.inf
+        low, high = 0, len(base)
+        while low < high:
+            middle = (low + high) // 2
+            if count_le(base[middle]) >= kth + 1:
+                high = middle
+            else:
+                low = middle + 1
+        if low < len(base):
+            best = base[low]
+        for value in added:
+            if value < best and count_le(value) >= kth + 1:
+                best = value
+                break  # added está ordenado: el primero que cumple es el menor
+        return float(best)
+
+class LocalOutlierFactor1D:
+    def __init__(self, n_neighbors: int = 5, contamination: float = 0.1):
+        """
+        Local Outlier Factor exacto para una sola variable (los montos), equivalente a
+        sklearn.neighbors.LocalOutlierFactor con los mismos n_neighbors/contamination pero sin
+        árboles de vecinos: los vecinos salen de ventanas contiguas del arreglo ordenado. Los
+        empates de distancia entre vecinos se resuelven por índice en X.
+        """
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+
+    @timed('lof_fit')
+    def fit_predict(self, X) -> np.ndarray:
+        """
+        Mismas etiquetas que LocalOutlierFactor.fit_predict: -1 anomalía, 1 normal.
+        Deja negative_outlier_factor_ y offset_ como scikit-learn.
+        """
+        metrics.count_fit('lof')
+        values = np.asarray(X, dtype=float).reshape(-1)
+        k = max(1, min(self.n_neighbors, len(values) - 1))
+
+        order = np.argsort(values, kind='stable')
+        self.negative_outlier_factor_ = np.empty(len(values))
+        self.negative_outlier_factor_[order] = _negative_outlier_factors(values[order], k, order)
+        self.offset_ = np.percentile(self.negative_outlier_factor_, 100.0 * self.contamination)
+        return np.where(self.negative_outlier_factor_ < self.offset_, -1, 1)
+
+    def is_outlier(self, amounts, amount: float) -> bool:
+        """
+        Equivale a fit_predict(amounts + [amount])[-1] == -1, pero solo calcula el LOF de los
+        montos históricos y el vecindario del nuevo; el umbral sale de las puntuaciones ya calculadas.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        if len(amounts) <= 12 * self.n_neighbors + 1:
+            # Pocos montos: el vecindario recalculado sería todo el historial de todos modos
+            return bool(self.fit_predict(np.append(amounts, amount))[-1] == -1)
+        is_outlier, _ = AmountModel(amounts, self.n_neighbors, self.contamination).score(amount)
+        return is_outlier
+
 class AmountAnomalyService:
     def __init__(self):
         """
@@ -13,58 +324,98 @@ class AmountAnomalyService:
         The LOF model detects anomalies by comparing the density of each transaction's amount
         with its neighbors, identifying transactions that significantly deviate in value.
         """
-        self.lof = LocalOutlierFactor(
+        self.lof = LocalOutlierFactor1D(
             n_neighbors=5,           # Number of neighbors to use in determining anomaly scores
             contamination=0.1         # Expected fraction of transactions to be anomalous (10%)
         )
         self.MIN_TRANSACTIONS = 5     # Minimum number of transactions needed for analysis
+        self.MAX_MODELS = 4096        # Per-user amount models kept in memory (least recently used are dropped)
+        self._models: "OrderedDict[Tuple[str, str], AmountModel]" = OrderedDict()
+        self._aggregates: "OrderedDict[str, StatisticsAggregate]" = OrderedDict()
+        self._models_lock = Lock()  # Only guards the dictionaries; each model has its own lock
+
+    def new_amount_model(self) -> AmountModel:
+        """Creates an empty incremental amount model with this service's LOF parameters."""
+        return AmountModel(n_neighbors=self.lof.n_neighbors, contamination=self.lof.contamination)
+
+    def amount_model(self, user_id: str, transaction_type: str) -> AmountModel:
+        """Returns the in-memory incremental amount model of a user for a transaction type."""
+        return self._cached(self._models, (user_id, transaction_type), self.new_amount_model)
+
+    def statistics_aggregate(self, user_id: str) -> StatisticsAggregate:
+        """Returns the in-memory rolling statistics aggregate of a user."""
+        return self._cached(self._aggregates, user_id, StatisticsAggregate)
+
+    def _cached(self, store: OrderedDict, key, factory):
+        with self._models_lock:
+            value = store.get(key)
+            if value is None:
+                value = factory()
+                store[key] = value
+                if len(store) > self.MAX_MODELS:
+                    store.popitem(last=False)
+            else:
+                store.move_to_end(key)
+            return value
 
-    def detect_amount_anomaly(self, transaction: Transaction, historical_transactions: List[Transaction]) -> Tuple[bool, float, str]:
+    @timed('amount_detection')
+    def detect_amount_anomaly(self, transaction: Transaction,
+                              historical_transactions: Union[TransactionHistory, List[Transaction]],
+                              model: AmountModel = None, context: "AnalysisContext" = None,
+                              wait: bool = True) -> Tuple[bool, float, str]:
         """
         Detects anomalies in the transaction amount by analyzing it against similar past transactions.
         Uses the Local Outlier Factor (LOF) model to evaluate whether the transaction amount is unusual.
 
         Args:
             transaction (Transaction): The transaction to analyze.
-            historical_transactions (List[Transaction]): Past transactions for comparison.
+            historical_transactions (TransactionHistory): Past transactions for comparison (a sorted
+                list of Transaction is also accepted and converted to columns).
+            model (AmountModel): Optional incremental model of the same-type history. It is brought up
+                to date with the transactions it has not seen yet and used instead of refitting LOF.
+            context (AnalysisContext): Optional features of the same history shared with other detectors
+                (same-type amounts and median), so they are computed once per analysis.
+            wait (bool): Whether to wait for the model's lock when another thread holds it; with
+                False ModelBusy is raised instead.
 
         Returns:
             Tuple[bool, float, str]: Indicates if the transaction is anomalous, the confidence level, and a description.
         """
+        history = TransactionHistory.coerce(historical_transactions)
+
         # If there aren't enough historical transactions, return insufficient data message.
-        if len(historical_transactions) < self.MIN_TRANSACTIONS:
+        if len(history) < self.MIN_TRANSACTIONS:
             return False, 0.0, f"Insufficient historical data (need at least {self.MIN_TRANSACTIONS} transactions)"
 
-        # Filters past transactions to only those of the same type (Income or Expense) as the new transaction.
-        same_type_transactions = [
-            t for t in historical_transactions 
-            if t.transactionType == transaction.transactionType
-        ]
+        # Positions of past transactions of the same type (Income or Expense) as the new transaction.
+        # A view of the history's cached index: no scan of the history per analyzed transaction.
+        same_type = history.type_positions(transaction.transactionType)
 
         # If there aren't enough same-type transactions, return insufficient data message for that type.
-        if len(same_type_transactions) < self.MIN_TRANSACTIONS:
+        if len(same_type) < self.MIN_TRANSACTIONS:
             return False, 0.0, f"Insufficient transactions of type {transaction.transactionType}"
 
-        # Extracts the amounts from same-type historical transactions to prepare for LOF analysis.
-        amounts = np.array([t.amount for t in same_type_transactions])
         current_amount = transaction.amount
 
-        # Adds the amount of the current transaction to the historical amounts for analysis.
-        all_amounts = np.append(amounts, current_amount)
-        amounts_2d = all_amounts.reshape(-1, 1)  # Reshapes to 2D as required by LOF
 
         # Applies the LOF model to detect anomalies, catching exceptions in case of errors.
         try:
-            # Anomaly scores: -1 indicates anomaly, 1 indicates normal
-            lof_scores = self.lof.fit_predict(amounts_2d)
-            
-            # Checks if the current transaction (last in the array) is marked as an anomaly
-            is_anomaly = lof_scores[-1] == -1
+            if model is not None:
+                # Same verdict as fit_predict, updating only the neighborhood of the new amount.
+                # The model's lock is held until it is scored so no other thread changes it midway
+                with holding(model.lock, wait):
+                    is_anomaly, _ = self._synced_model(model, history, same_type).score(current_amount)
+            else:
+                # Same as fit_predict over the historical amounts plus the current one (-1 = anomaly)
+                is_anomaly = self.lof.is_outlier(history.amounts[same_type], current_amount)
 
             # If an anomaly, calculate the statistics and context for detailed reporting
             if is_anomaly:
-                mean_amount = np.mean(amounts)
-                median_amount = np.median(amounts)
+                # Extracts the same-type amounts only when they are reported
+                if context is not None:
+                    median_amount = context.median(transaction.transactionType)
+                else:
+                    median_amount = np.median(history.amounts[same_type])
 
                 # Calculates how many times larger/smaller the current amount is compared to the median
                 ratio_to_median = current_amount / median_amount if median_amount > 0 else float('inf')
@@ -90,38 +441,79 @@ class AmountAnomalyService:
             # If not an anomaly, returns normal status
             return False, 0.0, "Transaction amount appears normal"
 
+        except ModelBusy:
+            raise
         except Exception as e:
             # Logs any error encountered during LOF analysis and returns a failure message
             logger.error(f"Error in LOF analysis: {str(e)}")
             return False, 0.0, "Could not perform anomaly analysis"
 
-    def get_transaction_statistics(self, transactions: List[Transaction]) -> dict:
+    def _synced_model(self, model: AmountModel, history: TransactionHistory, same_type: np.ndarray) -> AmountModel:
+        """
+        Returns a model covering exactly the same-type transactions of the history (positions
+        same_type). The given model is extended with the amounts it has not absorbed yet, so only
+        those are read from the history; if it already covers later transactions (an older
+        transaction is being analyzed) a temporary model is built instead. Called with model.lock held.
+        """
+        covered = len(model)
+        if covered > len(same_type):
+            return AmountModel(history.amounts[same_type], model.n_neighbors, model.contamination)
+
+        last_id = history.ids[same_type[-1]]
+        if covered and history.ids[same_type[covered - 1]] != model.last_transaction_id:
+            # The history changed under the model (edited or deleted transactions): rebuild it
+            model.reset(history.amounts[same_type], last_id)
+        else:
+            model.extend(history.amounts[same_type[covered:]], last_id)
+        return model
+
+    @timed('statistics')
+    def get_transaction_statistics(self, transactions: Union[TransactionHistory, List[Transaction]],
+                                   aggregate: StatisticsAggregate = None, context: "AnalysisContext" = None,
+                                   wait: bool = True) -> dict:
         """
         Calculates basic statistical data for Income and Expense transactions, such as median,
         minimum, maximum, and count for each transaction type.
 
         Args:
-            transactions (List[Transaction]): A list of transactions to analyze.
+            transactions (TransactionHistory): The transactions to analyze (a list of Transaction is also accepted).
+            aggregate (StatisticsAggregate): Optional rolling aggregate of the same history. It absorbs
+                only the transactions it has not seen yet and answers without walking the history.
+            context (AnalysisContext): Optional features of the same history shared with other detectors.
+            wait (bool): Whether to wait for the aggregate's lock when another thread holds it; with
+                False ModelBusy is raised instead.
 
         Returns:
             dict: A dictionary containing statistical information on income and expense transactions.
         """
-        if not transactions:
+        history = TransactionHistory.coerce(transactions)
+        if not len(history):
             return {}  # Returns empty if no transactions provided
 
-        # Splits the transactions into income and expense categories
-        income_transactions = [t for t in transactions if t.transactionType == "Income"]
-        expense_transactions = [t for t in transactions if t.transactionType == "Expense"]
+        if aggregate is not None:
+            with holding(aggregate.lock, wait):
+                covered = len(aggregate)
+                if covered <= len(history):
+                    if covered and history.ids[covered - 1] != aggregate.last_transaction_id:
+                        # The history changed under the aggregate (edited or deleted transactions): rebuild it
+                        aggregate.reset(history)
+                    else:
+                        aggregate.extend(history, start=covered)
+                    return aggregate.statistics()
+            # The aggregate already covers later transactions (an older transaction is being analyzed)
 
         # Helper function to compute statistics for a given type of transaction
-        def get_stats(transactions, type_name):
-            if not transactions:
+        def get_stats(transaction_type, type_name):
+            # Collects the amounts of the type and calculates statistical metrics
+            if context is not None:
+                amounts = context.amounts(transaction_type)
+            else:
+                amounts = history.amounts[history.type_positions(transaction_type)]
+            if not len(amounts):
                 return {}  # Returns empty if there are no transactions of the type
-                
-            # Collects amounts and calculates statistical metrics
-            amounts = [t.amount for t in transactions]
+
             return {
-                f"{type_name}_median": float(np.median(amounts)),
+                f"{type_name}_median": context.median(transaction_type) if context is not None else float(np.median(amounts)),
                 f"{type_name}_min": float(np.min(amounts)),
                 f"{type_name}_max": float(np.max(amounts)),
                 f"{type_name}_count": len(amounts)
@@ -129,7 +521,7 @@ class AmountAnomalyService:
 
         # Initializes an empty dictionary to hold statistics for both income and expense types
         stats = {}
-        stats.update(get_stats(income_transactions, "income"))
-        stats.update(get_stats(expense_transactions, "expense"))
+        stats.update(get_stats("Income", "income"))
+        stats.update(get_stats("Expense", "expense"))
         
         return stats  # Returns a dictionary with statistical data for each transaction type
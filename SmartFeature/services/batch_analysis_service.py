@@ -0,0 +1,92 @@
+from typing import Iterable, List, Optional, Tuple
+from models import Transaction
+from services.transaction_history import TransactionHistory
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+import os
+
+class TransactionScore:
+    __slots__ = ("transaction", "location", "amount")
+
+    def __init__(self, transaction: Transaction, location: Tuple[bool, float, str], amount: Tuple[bool, float, str]):
+        self.transaction = transaction
+        self.location = location  # (is_anomaly, confidence, reason)
+        self.amount = amount
+
+    def flags(self) -> dict:
+        """Campos a escribir en el documento de la transacción."""
+        return {'locationAnomaly': self.location[0], 'amountAnomaly': self.amount[0]}
+
+class BatchAnalysisService:
+    # Transacciones máximas por petición: el resto se pide con el cursor next_after de la respuesta
+    MAX_TRANSACTIONS = int(os.getenv('BATCH_MAX_TRANSACTIONS', '500'))
+
+    def __init__(self, anomaly_service: AnomalyDetectionService, amount_anomaly_service: AmountAnomalyService):
+        """
+        Analiza muchas transacciones de un mismo historial de una sola vez, cada una contra
+        las transacciones anteriores a ella, reutilizando los detectores compartidos.
+        """
+        self.anomaly_service = anomaly_service
+        self.amount_anomaly_service = amount_anomaly_service
+
+    def select(self, history: TransactionHistory, transaction_ids: Iterable[str] = None,
+               only_unflagged: bool = False, after: str = None,
+               limit: int = None) -> Tuple[List[Transaction], List[str], Optional[str]]:
+        """
+        Elige las transacciones a analizar, en orden de dateTime, a lo sumo limit por llamada.
+
+        Args:
+            transaction_ids (Iterable[str]): Ids pedidos; None para todo el historial.
+            only_unflagged (bool): Omitir las que ya tienen algún flag de anomalía escrito.
+            after (str): Cursor de la página anterior: solo las transacciones posteriores a esa.
+            limit (int): Transacciones máximas a devolver (None: todas).
+
+        Returns:
+            Tuple[List[Transaction], List[str], Optional[str]]: Transacciones a analizar, ids que no
+                están en el historial y el cursor de la página siguiente (None si no quedan más).
+        """
+        if transaction_ids is None:
+            positions = range(len(history))
+            not_found = []
+        else:
+            requested = dict.fromkeys(transaction_ids)  # Sin repetidos, conservando el orden
+            not_found = [t_id for t_id in requested if t_id not in history]
+            positions = sorted(history.position(t_id) for t_id in requested if t_id in history)
+
+        if only_unflagged:
+            location_flags, amount_flags = history.field('locationAnomaly'), history.field('amountAnomaly')
+            positions = [p for p in positions if location_flags[p] is None and amount_flags[p] is None]
+        if after is not None:
+            start = history.position(after)
+            if start is None:
+                raise ValueError(f"Unknown cursor transaction: {after}")
+            positions = [p for p in positions if p > start]
+
+        next_after = None
+        if limit is not None and len(positions) > limit:
+            positions = positions[:limit]
+            next_after = history.ids[positions[-1]]
+        # Solo se crean modelos de Pydantic para las transacciones elegidas
+        return [history.transaction_at(p) for p in positions], not_found, next_after
+
+    def score(self, history: TransactionHistory, transactions: List[Transaction]) -> List[TransactionScore]:
+        """
+        Analiza cada transacción contra su prefijo del historial (dateTime estrictamente menor).
+        Como se recorren en orden, los modelos de ubicación y de montos solo crecen con cada prefijo.
+        """
+        location_model = self.anomaly_service.new_location_model()
+        amount_models = {}
+        scores = []
+        for transaction in transactions:
+            previous_transactions = history.before(transaction.dateTime)
+            amount_model = amount_models.get(transaction.transactionType)
+            if amount_model is None:
+                amount_model = amount_models[transaction.transactionType] = self.amount_anomaly_service.new_amount_model()
+            scores.append(TransactionScore(
+                transaction,
+                self.anomaly_service.detect_anomaly(transaction, previous_transactions, model=location_model),
+                self.amount_anomaly_service.detect_amount_anomaly(
+                    transaction, previous_transactions, model=amount_model
+                )
+            ))
+        return scores
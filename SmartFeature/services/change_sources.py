@@ -0,0 +1,68 @@
+from models import Transaction
+import time
+
+class TransactionChange:
+    __slots__ = ("account_id", "transaction", "received_at")
+
+    def __init__(self, account_id: str, transaction: Transaction):
+        """Transacción nueva escrita en accounts/{account_id}/transactions."""
+        self.account_id = account_id
+        self.transaction = transaction
+        self.received_at = time.monotonic()  # Para medir la espera hasta que se escriben sus flags
+
+class ChangeSource:
+    """
+    Origen de las transacciones nuevas que analiza IngestPipeline. start() recibe el pipeline y
+    le entrega cada cambio con pipeline.submit (desde el event loop) o pipeline.submit_threadsafe
+    (desde otro hilo); ambos esperan mientras la cola está llena.
+    """
+    PATCHES_CACHE = False  # True si además mantiene al día la caché de historiales (como el change feed)
+
+    def start(self, pipeline):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+class MemoryChangeSource(ChangeSource):
+    def __init__(self):
+        """Origen en memoria para pruebas y benchmarks: cada publish() entrega un cambio al pipeline."""
+        self._pipeline = None
+
+    def start(self, pipeline):
+        self._pipeline = pipeline
+
+    def stop(self):
+        self._pipeline = None
+
+    async def publish(self, account_id: str, transaction: Transaction):
+        """Entrega una transacción nueva; espera si la cola del pipeline está llena."""
+        if self._pipeline is None:
+            raise RuntimeError("Change source is not started")
+        await self._pipeline.submit(TransactionChange(account_id, transaction))
+
+class FirestoreChangeSource(ChangeSource):
+    PATCHES_CACHE = True
+
+    def __init__(self, firestore_service):
+        """
+        Transacciones agregadas a cualquier cuenta, con el listener de FirestoreService.start_change_feed
+        (el mismo que parcha la caché de historiales, así no hay dos listeners). Con
+        FIRESTORE_EMULATOR_HOST definido el SDK escucha al emulador local en lugar de producción.
+        """
+        self.firestore_service = firestore_service
+        self._watch = None
+
+    def start(self, pipeline):
+        # El listener llama desde su propio hilo; si la cola está llena ese hilo espera, y el
+        # stream de Firestore deja de consumirse hasta que los workers se ponen al día.
+        self._watch = self.firestore_service.start_change_feed(
+            on_added=lambda account_id, transaction: pipeline.submit_threadsafe(
+                TransactionChange(account_id, transaction)
+            )
+        )
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
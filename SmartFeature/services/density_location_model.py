@@ -0,0 +1,116 @@
+from threading import Lock
+from typing import TYPE_CHECKING, Optional, Tuple
+from services.geo_distance import distances_km, km_to_chord, to_unit_xyz
+from services.metrics import metrics, timed
+import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.neighbors import KDTree
+
+class DensityLocationModel:
+    def __init__(self, area_radius_km: float = 5.0, min_samples: int = 3, ellipsoidal: bool = True):
+        """
+        Modelo de "zonas habituales" por densidad, alternativo a los centroides de LocationModel.
+        Una ubicación es zona habitual si tiene al menos min_samples transacciones (ella incluida)
+        a menos de area_radius_km, como los puntos núcleo de DBSCAN; así el número de zonas sale de
+        los datos en vez de ser siempre 3. Si el usuario todavía no tiene zonas densas, todas sus
+        ubicaciones cuentan como habituales.
+
+        Los puntos se proyectan a la esfera unitaria y se indexan con KDTree, de modo que la
+        distancia a la zona habitual más cercana es una consulta O(log n).
+
+        Vive solo en memoria (a diferencia de LocationModel no se guarda en Firestore): indexa todas
+        las ubicaciones del historial, y traerlas costaría lo mismo que reconstruir el índice.
+
+        Args:
+            area_radius_km (float): Radio del vecindario de una zona habitual.
+            min_samples (int): Transacciones mínimas en ese radio para ser zona habitual.
+            ellipsoidal (bool): Distancia final con corrección elipsoidal o solo haversine.
+        """
+        self.area_radius_km = area_radius_km
+        self.min_samples = min_samples
+        self.ellipsoidal = ellipsoidal
+        self.REFIT_FRACTION = 0.25   # Reconstruir los índices cuando los puntos nuevos superan este % de los indexados
+        self.MIN_REFIT_POINTS = 3    # Puntos nuevos mínimos antes de reconstruir
+        self.MAX_PENDING = 256       # Puntos nuevos máximos sin indexar (se recorren linealmente)
+
+        self.version = 0                                  # Aumenta con cada reconstrucción completa
+        self.last_transaction_id: Optional[str] = None    # Última transacción absorbida por el modelo
+        self.lock = Lock()  # Quien lee o actualiza el modelo lo toma (ver services.model_locks)
+        self._points = np.empty((0, 2))    # Ubicaciones indexadas (latitud, longitud)
+        self._tree: Optional["KDTree"] = None
+        self._areas = np.empty((0, 2))     # Ubicaciones que son zona habitual
+        self._area_tree: Optional["KDTree"] = None
+        self._pending = []                 # Ubicaciones absorbidas desde la última reconstrucción
+        self._pending_areas = []           # Las de ellas que ya son zona habitual
+
+    def __len__(self) -> int:
+        return len(self._points) + len(self._pending)
+
+    @property
+    def needs_refit(self) -> bool:
+        """Si hay suficientes puntos sin indexar para reconstruir los índices."""
+        pending = len(self._pending)
+        if pending < self.MIN_REFIT_POINTS:
+            return False
+        return pending >= self.MAX_PENDING or pending >= self.REFIT_FRACTION * len(self._points)
+
+    @property
+    def area_count(self) -> int:
+        return len(self._areas) + len(self._pending_areas)
+
+    @timed('density_fit')
+    def fit(self, locations, last_transaction_id: str = None) -> "DensityLocationModel":
+        """Indexa todas las ubicaciones (latitud, longitud) y recalcula cuáles son zona habitual."""
+        metrics.count_fit('density')
+        from sklearn.neighbors import KDTree  # scikit-learn se importa en el primer ajuste (tarda ~1 s)
+        self._points = np.asarray(locations, dtype=float).reshape(-1, 2)
+        xyz = to_unit_xyz(self._points[:, 0], self._points[:, 1])
+        self._tree = KDTree(xyz)
+
+        # Zona habitual si su min_samples-ésimo vecino (ella incluida) está dentro del radio:
+        # una consulta k-NN no depende de cuántos puntos haya en zonas muy densas, como query_radius
+        k = min(self.min_samples, len(self._points))
+        kth_distances, _ = self._tree.query(xyz, k=k)
+        dense = (kth_distances[:, -1] <= km_to_chord(self.area_radius_km)) & (k == self.min_samples)
+        if not dense.any():
+            dense[:] = True  # Sin zonas densas todavía: cualquier ubicación visitada es habitual
+        self._areas = self._points[dense]
+        self._area_tree = KDTree(xyz[dense])
+
+        self._pending = []
+        self._pending_areas = []
+        self.last_transaction_id = last_transaction_id
+        self.version += 1
+        return self
+
+    def nearest(self, latitude: float, longitude: float) -> Tuple[int, float]:
+        """Índice de la zona habitual más cercana y su distancia en kilómetros."""
+        _, index = self._area_tree.query(to_unit_xyz(latitude, longitude).reshape(1, 3), k=1)
+        candidates = np.vstack([self._areas[index[0]]] + self._pending_areas)
+        distances = distances_km(latitude, longitude, candidates, ellipsoidal=self.ellipsoidal)
+        best = int(np.argmin(distances))
+        area = int(index[0][0]) if best == 0 else len(self._areas) + best - 1
+        return area, float(distances[best])
+
+    def add(self, latitude: float, longitude: float, transaction_id: str = None):
+        """
+        Absorbe una ubicación sin reconstruir los índices. Se vuelve zona habitual si ya tiene
+        min_samples transacciones cerca; las ubicaciones antiguas que se vuelvan densas por ella
+        se reconocen en la siguiente reconstrucción.
+        """
+        point = np.array([latitude, longitude])
+        neighbors = 1
+        k = min(self.min_samples - 1, len(self._points))
+        if k > 0:
+            distances, _ = self._tree.query(to_unit_xyz(latitude, longitude).reshape(1, 3), k=k)
+            neighbors += int(np.count_nonzero(distances <= km_to_chord(self.area_radius_km)))
+        if self._pending:
+            pending_distances = distances_km(latitude, longitude, self._pending, ellipsoidal=False)
+            neighbors += int(np.count_nonzero(pending_distances <= self.area_radius_km))
+
+        self._pending.append(point)
+        if neighbors >= self.min_samples:
+            self._pending_areas.append(point)
+        if transaction_id is not None:
+            self.last_transaction_id = transaction_id
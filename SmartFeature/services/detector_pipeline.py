@@ -0,0 +1,273 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+from models import Transaction
+from services.amount_anomaly_service import AmountAnomalyService
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.model_locks import ModelBusy
+from services.transaction_history import TransactionHistory
+import asyncio
+import contextvars
+import logging
+import numpy as np
+import os
+
+logger = logging.getLogger(__name__)
+
+class AnalysisContext:
+    __slots__ = ("user_id", "transaction", "history", "location_cells", "results", "_amounts", "_medians")
+
+    def __init__(self, user_id: str, transaction: Transaction, history: TransactionHistory,
+                 location_cells: dict = None):
+        """
+        Lo que comparten las etapas al analizar una transacción: la transacción, su historial
+        previo (las posiciones por tipo y con ubicación ya están indexadas en él), los conteos de
+        celdas del usuario si describen ese historial, y las características que usa más de una
+        etapa, calculadas una sola vez y solo si se piden.
+        """
+        self.user_id = user_id
+        self.transaction = transaction
+        self.history = history
+        self.location_cells = location_cells
+        self.results: Dict[str, object] = {}  # Nombre de la etapa -> su resultado
+        self._amounts: Dict[str, np.ndarray] = {}
+        self._medians: Dict[str, float] = {}
+
+    def amounts(self, transaction_type: str) -> np.ndarray:
+        """Montos del historial de ese tipo."""
+        amounts = self._amounts.get(transaction_type)
+        if amounts is None:
+            amounts = self.history.amounts[self.history.type_positions(transaction_type)]
+            self._amounts[transaction_type] = amounts
+        return amounts
+
+    def median(self, transaction_type: str) -> float:
+        """Mediana de los montos de ese tipo (el tipo debe tener al menos un monto)."""
+        median = self._medians.get(transaction_type)
+        if median is None:
+            median = self._medians[transaction_type] = float(np.median(self.amounts(transaction_type)))
+        return median
+
+class Stage:
+    NAME = ''
+    HEAVY_PENDING = 256  # Transacciones por absorber en el modelo desde las que la etapa corre en el pool
+
+    def heavy(self, context: AnalysisContext) -> bool:
+        """
+        Si la etapa hará trabajo de CPU pesado (ajustar un modelo) o tendría que esperar el lock
+        de un modelo que otro hilo está usando, y conviene correrla en un hilo.
+        """
+        return False
+
+    def run(self, context: AnalysisContext, wait: bool = True):
+        """
+        Analiza la transacción del contexto y devuelve el resultado (queda en context.results[NAME]).
+        Con wait=False lanza ModelBusy en lugar de esperar el lock de un modelo.
+        """
+        raise NotImplementedError
+
+class LocationStage(Stage):
+    NAME = 'location'
+
+    def __init__(self, service: AnomalyDetectionService):
+        self.service = service
+
+    def heavy(self, context: AnalysisContext) -> bool:
+        located = len(context.history.located_positions())
+        if located < self.service.MIN_TRANSACTIONS_FOR_CLUSTERING:
+            return False
+        if (context.location_cells is not None and context.transaction.location
+                and self.service.well_visited(context.transaction, context.location_cells)):
+            return False  # Se resuelve con los conteos de celdas, sin el modelo
+        model = self.service.location_model(context.user_id)
+        covered = len(model)
+        return (not covered or covered > located or located - covered >= self.HEAVY_PENDING
+                or model.needs_refit or model.lock.locked())
+
+    def run(self, context: AnalysisContext, wait: bool = True):
+        return self.service.detect_anomaly(
+            context.transaction, context.history, model=self.service.location_model(context.user_id), wait=wait,
+            location_cells=context.location_cells
+        )
+
+class AmountStage(Stage):
+    NAME = 'amount'
+
+    def __init__(self, service: AmountAnomalyService):
+        self.service = service
+
+    def heavy(self, context: AnalysisContext) -> bool:
+        transaction_type = context.transaction.transactionType
+        same_type = len(context.history.type_positions(transaction_type))
+        if same_type < self.service.MIN_TRANSACTIONS:
+            return False
+        model = self.service.amount_model(context.user_id, transaction_type)
+        covered = len(model)
+        return covered > same_type or same_type - covered >= self.HEAVY_PENDING or model.lock.locked()
+
+    def run(self, context: AnalysisContext, wait: bool = True):
+        return self.service.detect_amount_anomaly(
+            context.transaction, context.history,
+            model=self.service.amount_model(context.user_id, context.transaction.transactionType),
+            context=context, wait=wait
+        )
+
+class StatisticsStage(Stage):
+    NAME = 'statistics'
+
+    def __init__(self, service: AmountAnomalyService):
+        self.service = service
+
+    def heavy(self, context: AnalysisContext) -> bool:
+        aggregate = self.service.statistics_aggregate(context.user_id)
+        covered, size = len(aggregate), len(context.history)
+        return (size - covered >= self.HEAVY_PENDING or (covered > size >= self.HEAVY_PENDING)
+                or aggregate.lock.locked())
+
+    def run(self, context: AnalysisContext, wait: bool = True):
+        return self.service.get_transaction_statistics(
+            context.history, aggregate=self.service.statistics_aggregate(context.user_id), context=context, wait=wait
+        )
+
+class DetectorPipeline:
+    # Hilos para etapas pesadas; 0 corre todo en el event loop. Por defecto uno menos que los núcleos
+    # (hasta 4): con un solo núcleo las etapas no pueden solaparse y el pool solo agrega saltos de hilo
+    WORKERS = int(os.getenv('DETECTOR_WORKERS', str(min(4, (os.cpu_count() or 1) - 1))))
+
+    def __init__(self, stages: Iterable[Stage], workers: int = None, model_store: FirestoreService = None):
+        """
+        Corre etapas de detección sobre un mismo AnalysisContext. Las etapas pesadas de una
+        petición (ver Stage.heavy) se lanzan a un pool de hilos y corren a la vez entre ellas y
+        con las livianas, que corren en el event loop (un salto de hilo cuesta más que ellas);
+        así el análisis completo tarda lo que su etapa más lenta y el loop sigue atendiendo.
+
+        Cada modelo por usuario tiene su propio lock, que se toma mientras se pone al día y se
+        consulta; las etapas de un mismo análisis usan modelos distintos y no se bloquean entre sí.
+        El loop nunca espera uno de esos locks: si una etapa liviana encuentra su modelo ocupado
+        por otra petición (p. ej. ajustándolo), se manda al pool y espera allí.
+
+        Con model_store, el modelo de zonas habituales de un usuario se trae de Firestore la primera
+        vez que este proceso lo analiza (un reinicio o una instancia nueva no vuelve a ajustar KMeans)
+        y se guarda, sin esperar la escritura, cada vez que un análisis lo reajusta.
+
+        Args:
+            stages (Iterable[Stage]): Etapas en el orden en que se corren las livianas.
+            workers (int): Hilos del pool (por defecto DETECTOR_WORKERS).
+            model_store (FirestoreService): Dónde se guardan los modelos de ubicación (opcional).
+        """
+        self.stages: Dict[str, Stage] = {stage.NAME: stage for stage in stages}
+        self.workers = self.WORKERS if workers is None else workers
+        self.model_store = model_store
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._looked_up: "OrderedDict[str, None]" = OrderedDict()  # Usuarios cuyo modelo guardado ya se buscó
+        self._saves = set()  # Escrituras de modelos en curso (referencias para que no se recolecten)
+
+        self.analyses = 0
+        self.offloaded = 0  # Etapas corridas en el pool
+        self.inline = 0     # Etapas corridas en el event loop
+        self.restored = 0   # Modelos de ubicación traídos de Firestore
+        self.stored = 0     # Modelos de ubicación guardados después de un reajuste
+
+    @classmethod
+    def default(cls, anomaly_service: AnomalyDetectionService, amount_anomaly_service: AmountAnomalyService,
+                workers: int = None, model_store: FirestoreService = None) -> "DetectorPipeline":
+        """Ubicación, monto y estadísticas, como /api/analyze-transaction-complete."""
+        return cls([
+            LocationStage(anomaly_service),
+            AmountStage(amount_anomaly_service),
+            StatisticsStage(amount_anomaly_service)
+        ], workers, model_store)
+
+    async def analyze(self, user_id: str, transaction: Transaction, history: TransactionHistory,
+                      stages: Iterable[str] = None, location_cells: dict = None) -> AnalysisContext:
+        """
+        Analiza la transacción contra su historial previo con las etapas dadas (por nombre;
+        todas si es None) y devuelve el contexto con el resultado de cada una en results.
+        location_cells son los conteos de celdas del usuario si describen ese historial
+        (ver FirestoreService.get_location_cells_for).
+        """
+        context = AnalysisContext(user_id, transaction, history, location_cells)
+        selected = [self.stages[name] for name in (stages or self.stages)]
+        self.analyses += 1
+        location = next((stage for stage in selected if isinstance(stage, LocationStage)), None)
+        if location is not None and self.model_store is not None:
+            await self._restore(location.service, user_id)
+
+        futures = {}
+        if self.workers > 0:
+            for stage in selected:
+                if stage.heavy(context):
+                    futures[stage.NAME] = self._offload(stage, context)
+        try:
+            for stage in selected:
+                if stage.NAME in futures:
+                    continue
+                try:
+                    # Sin pool ningún otro hilo toma los locks de estos modelos: esperar es inmediato
+                    context.results[stage.NAME] = stage.run(context, wait=self.workers == 0)
+                    self.inline += 1
+                except ModelBusy:
+                    futures[stage.NAME] = self._offload(stage, context)
+        except Exception:
+            await asyncio.gather(*futures.values(), return_exceptions=True)
+            raise
+        for name, future in futures.items():
+            context.results[name] = await future
+        if location is not None and self.model_store is not None:
+            self._store(location.service, user_id)
+        return context
+
+    async def _restore(self, service: AnomalyDetectionService, user_id: str):
+        if service.LOCATION_BACKEND != 'kmeans' or user_id in self._looked_up:
+            return
+        try:
+            data = await self.model_store.get_location_model(user_id)
+        except Exception as e:
+            logger.error(f"Error loading location model of {user_id}: {str(e)}")
+            return  # Se ajusta uno nuevo, como si no hubiera guardado
+        self._looked_up[user_id] = None
+        while len(self._looked_up) > service.MAX_MODELS:
+            self._looked_up.popitem(last=False)
+        if data is not None and service.restore_location_model(user_id, data):
+            self.restored += 1
+
+    def _store(self, service: AnomalyDetectionService, user_id: str):
+        data = service.location_model_to_store(user_id)
+        if data is None:
+            return
+        self.stored += 1
+        task = asyncio.get_running_loop().create_task(self.model_store.save_location_model(user_id, data))
+        self._saves.add(task)
+        task.add_done_callback(self._saves.discard)
+
+    async def flush(self):
+        """Espera las escrituras de modelos en curso (al apagar)."""
+        await asyncio.gather(*self._saves)
+
+    def _offload(self, stage: Stage, context: AnalysisContext) -> asyncio.Future:
+        self.offloaded += 1
+        # Con el contexto de la petición, para que sus etapas sigan sumando a su desglose
+        return asyncio.get_running_loop().run_in_executor(
+            self._pool(), contextvars.copy_context().run, stage.run, context
+        )
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='detector')
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "analyses": self.analyses,
+            "offloaded_stages": self.offloaded,
+            "inline_stages": self.inline,
+            "restored_models": self.restored,
+            "stored_models": self.stored
+        }
@@ -1,80 +1,535 @@
-from firebase_admin import firestore
-from typing import List
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from models import Transaction, Account
+from services.flag_write_buffer import FlagWriteBuffer, PendingWrite
+from services.geohash import cell_counts, encode
+from services.history_cache import TransactionHistoryCache, history_cache
+from services.metrics import metrics, timed
+from services.single_flight import SingleFlight
+from services.transaction_history import TransactionHistory
+import asyncio
 import datetime
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_firestore_module = None
+
+def _firestore():
+    """firebase_admin.firestore, importado en el primer uso: el SDK tarda cientos de ms en importarse."""
+    global _firestore_module
+    if _firestore_module is None:
+        from firebase_admin import firestore
+        _firestore_module = firestore
+    return _firestore_module
 
 class FirestoreService:
-    def __init__(self):
-        self.db = firestore.client()
+    LOCATION_CELLS_COLLECTION = 'location_cells'  # location_cells/{user_id}: visitas por celda y resolución
+    LOCATION_MODELS_COLLECTION = 'location_models'  # location_models/{user_id}: zonas habituales (LocationModel.to_dict)
+    MAX_COUNTED_VISITS = 65536  # Transacciones recordadas cuya visita ya se escribe o se escribió (ver _claim_visit)
+
+    def __init__(self, cache: TransactionHistoryCache = None, db=None):
+        """
+        Acceso a Firestore con el cliente asíncrono, para no bloquear el event loop de uvicorn
+        mientras se espera a Firestore.
+
+        Args:
+            cache (TransactionHistoryCache): Caché de historiales; por defecto la compartida del proceso.
+            db: Cliente asíncrono de Firestore (o uno compatible); por defecto firestore_async.client(),
+                creado en el primer uso (ver connect).
+
+        Los flags de anomalía se escriben a través de un buffer write-behind (flag_writer) que
+        junta las escrituras de muchas peticiones en pocos WriteBatches.
+        """
+        self._db = db
+        self._connect_lock = Lock()
+        self.cache = cache if cache is not None else history_cache
+        # Lecturas de historial en curso por usuario, compartidas por las peticiones concurrentes
+        self.history_loads = SingleFlight()
+        self.flag_writer = FlagWriteBuffer(
+            self._commit_flag_writes, extra_op=self._cell_visits_owner, on_failure=self._flag_write_failed
+        )
+        # (cuenta, transacción) cuyo geohash (y su visita) ya está en un lote pendiente, en curso o escrito
+        self._counted_visits: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        # user_id -> (cuándo se leyó, conteos de celdas); con la misma vigencia y tamaño que la caché de historiales
+        self._location_cells: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.cell_loads = SingleFlight()
+        self.model_loads = SingleFlight()
+
+    @property
+    def db(self):
+        """Cliente asíncrono de Firestore."""
+        if self._db is None:
+            self.connect()
+        return self._db
+
+    def connect(self):
+        """Inicializa Firebase y crea el cliente de producción si no se dio uno (solo la primera vez)."""
+        with self._connect_lock:
+            if self._db is None:
+                from config import FirebaseConfig
+                from firebase_admin import firestore_async
+                FirebaseConfig()
+                self._db = firestore_async.client()
 
-    async def get_user_transactions(self, user_id: str) -> List[Transaction]:
-        """Obtiene todas las transacciones de todas las cuentas del usuario."""
-        transactions = []
-        
+    @staticmethod
+    def preload():
+        """Importa el SDK de Firebase sin crear clientes (para el warm-up; se puede llamar desde otro hilo)."""
+        _firestore()
+        from firebase_admin import firestore_async
+
+    async def get_user_transactions(self, user_id: str, refresh: bool = False) -> List[Transaction]:
+        """Obtiene todas las transacciones de todas las cuentas del usuario, ordenadas por dateTime."""
+        history = await self.get_user_history(user_id, refresh=refresh)
+        return history.transactions
+
+    async def get_user_history(self, user_id: str, refresh: bool = False) -> TransactionHistory:
+        """
+        Obtiene el historial del usuario. Usa la caché mientras esté vigente; si venció (o se pide
+        refresh=True) y aún hay una copia reciente, solo lee de Firestore las transacciones con
+        dateTime posterior a la marca de agua y las intercala en el historial existente.
+
+        Las peticiones concurrentes del mismo usuario (la app pide ubicación, monto y completo a
+        la vez) comparten una sola lectura en curso en lugar de hacer una cada una.
+        """
+        if not refresh:
+            cached = self.cache.get(user_id)
+            if cached is not None:
+                return cached
+
+        # Una lectura pedida con refresh solo se junta con otras con refresh
+        return await self.history_loads.do((user_id, refresh), lambda: self._load_history(user_id))
+
+    async def _load_history(self, user_id: str) -> TransactionHistory:
+        base = self.cache.get_for_sync(user_id)
+        with timed('firestore_read'):
+            if base is None:
+                history = await self._read_history(user_id)
+                self.cache.put(user_id, history)
+            else:
+                history = await self._read_history(user_id, since=base)
+                self.cache.put(user_id, history, incremental=True)
+        return history
+
+    async def get_user_history_with(self, user_id: str, transaction_ids: Iterable[str]) -> TransactionHistory:
+        """
+        Historial del usuario que contiene las transacciones pedidas (p. ej. recién escritas). Si el
+        de la caché no las tiene, primero se pone al día de forma incremental; si alguna tiene un
+        dateTime anterior a la marca de agua, solo una lectura completa la encuentra.
+        """
+        transaction_ids = list(transaction_ids)
+        history = await self.get_user_history(user_id)
+        for full_reload in (False, True):
+            if all(t_id in history for t_id in transaction_ids):
+                break
+            if full_reload:
+                self.cache.invalidate(user_id)
+            history = await self.get_user_history(user_id, refresh=True)
+        return history
+
+    async def _read_history(self, user_id: str, since: TransactionHistory = None) -> TransactionHistory:
+        """
+        Lee de Firestore el historial del usuario; las subcolecciones de todas sus cuentas se leen
+        en paralelo. Con since, solo pide a cada cuenta ya conocida las transacciones desde su
+        marca de agua; las cuentas nuevas se leen completas.
+        """
         # Obtener todas las cuentas del usuario
         accounts_ref = self.db.collection('accounts')
         query = accounts_ref.where('user_id', '==', user_id)
-        account_docs = query.stream()
-
-        for account_doc in account_docs:
-            # Obtener todas las transacciones de cada cuenta
-            transactions_ref = account_doc.reference.collection('transactions')
-            transaction_docs = transactions_ref.stream()
-
-            for trans_doc in transaction_docs:
-                trans_data = trans_doc.to_dict()
-                
-                # Convertir la marca de tiempo de Firestore a datetime
-                date_time = trans_data.get('dateTime')
-                if date_time == firestore.SERVER_TIMESTAMP:
-                    date_time = datetime.datetime.now()
-                
-                # Crear objeto Location si existe
-                location = None
-                if 'location' in trans_data and trans_data['location']:
-                    location = {
-                        'latitude': trans_data['location'].get('latitude'),
-                        'longitude': trans_data['location'].get('longitude')
-                    }
-
-                transaction = Transaction(
-                    transaction_id=trans_doc.id,
-                    amount=trans_data.get('amount', 0),
-                    dateTime=date_time,
-                    location=location,
-                    transactionName=trans_data.get('transactionName', ''),
-                    transactionType=trans_data.get('transactionType', '')
-                )
-                transactions.append(transaction)
-
-        return sorted(transactions, key=lambda x: x.dateTime)
-
-    async def update_transaction_anomalies(self, user_id: str, transaction_id: str, 
-                                        location_anomaly: bool = None, 
-                                        amount_anomaly: bool = None) -> bool:
-        """Updates the anomaly flags for a transaction."""
+        account_docs = [account_doc async for account_doc in query.stream()]
+
+        account_ids = [account_doc.id for account_doc in account_docs]
+        results = await asyncio.gather(*(
+            self._read_account_transactions(account_doc, since) for account_doc in account_docs
+        ))
+
+        records = []
+        transaction_accounts = {}
+        for account_id, account_records in zip(account_ids, results):
+            for record in account_records:
+                records.append(record)
+                transaction_accounts[record['transaction_id']] = account_id
+        metrics.count_reads(len(account_docs) + len(records))
+
+        if since is not None:
+            return since.merge(TransactionHistory.from_records(records), account_ids, transaction_accounts)
+        return TransactionHistory.from_records(records, account_ids, transaction_accounts)
+
+    async def _read_account_transactions(self, account_doc, since: TransactionHistory = None) -> List[dict]:
+        """Lee las transacciones de una cuenta (solo las nuevas si la cuenta ya estaba en since)."""
+        transactions_ref = account_doc.reference.collection('transactions')
+        if since is not None and since.high_water_mark is not None and account_doc.id in since.account_ids:
+            # '>=' para no perder transacciones con el mismo dateTime; merge descarta las repetidas
+            transactions_ref = transactions_ref.where('dateTime', '>=', since.high_water_mark)
+
+        return [self._to_record(trans_doc) async for trans_doc in transactions_ref.stream()]
+
+    async def list_user_ids(self) -> List[str]:
+        """Devuelve los ids de todos los usuarios que tienen al menos una cuenta."""
+        user_ids = set()
+        async for account_doc in self.db.collection('accounts').select(['user_id']).stream():
+            metrics.count_reads(1)
+            user_id = account_doc.to_dict().get('user_id')
+            if user_id:
+                user_ids.add(user_id)
+        return sorted(user_ids)
+
+    async def get_account_owner(self, account_id: str) -> Optional[str]:
+        """user_id dueño de la cuenta: del índice de la caché si está, si no se lee el documento."""
+        user_id = self.cache.owner_of_account(account_id)
+        if user_id is None:
+            account_doc = await self.db.collection('accounts').document(account_id).get()
+            metrics.count_reads(1)
+            user_id = account_doc.to_dict().get('user_id') if account_doc.exists else None
+        return user_id
+
+    def start_change_feed(self, on_added: Callable[[str, Transaction], None] = None):
+        """
+        Escucha las transacciones que se escriben a partir de ahora en cualquier cuenta
+        (collection group 'transactions') y parcha los historiales en caché afectados.
+        Requiere el índice de collection group sobre dateTime. Los listeners solo existen en el
+        cliente síncrono; corren en su propio hilo y no bloquean el event loop.
+
+        Args:
+            on_added (Callable[[str, Transaction], None]): Se llama con (account_id, transacción)
+                por cada documento agregado, esté o no el usuario en caché. Las escrituras de
+                flags llegan como modificaciones y no lo disparan.
+
+        Returns:
+            El watch de Firestore; llamar a .unsubscribe() para detenerlo.
+        """
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.connect()  # El listener usa el cliente síncrono de la misma app de Firebase
+        query = _firestore().client().collection_group('transactions').where('dateTime', '>=', started_at)
+        return query.on_snapshot(
+            lambda doc_snapshots, changes, read_time: self._on_transactions_snapshot(changes, on_added)
+        )
+
+    def _on_transactions_snapshot(self, changes, on_added: Callable[[str, Transaction], None] = None):
+        metrics.count_reads(len(changes))
+        for change in changes:
+            # accounts/{account_id}/transactions/{transaction_id}
+            account_id = change.document.reference.parent.parent.id
+            user_id = self.cache.owner_of_account(account_id)
+            if user_id is not None:
+                try:
+                    if change.type.name == 'REMOVED':
+                        self.cache.invalidate(user_id)
+                    else:
+                        self.cache.apply_transaction(user_id, self._to_transaction(change.document), account_id)
+                except Exception as e:
+                    logger.error(f"Error applying transaction change to cache: {str(e)}")
+                    self.cache.invalidate(user_id)
+
+            if on_added is not None and change.type.name == 'ADDED':
+                try:
+                    on_added(account_id, self._to_transaction(change.document))
+                except Exception as e:
+                    logger.error(f"Error handling added transaction: {str(e)}")
+
+    def _to_transaction(self, trans_doc) -> Transaction:
+        """Convierte un documento de la subcolección 'transactions' en un Transaction."""
+        record = self._to_record(trans_doc)
+        if record['location'] is not None:
+            record['location'] = {'latitude': record['location'][0], 'longitude': record['location'][1]}
+        return Transaction(**record)
+
+    def _to_record(self, trans_doc) -> dict:
+        """
+        Convierte un documento de la subcolección 'transactions' en un registro con los campos
+        de Transaction (location como (latitud, longitud)) para TransactionHistory.from_records.
+        """
+        trans_data = trans_doc.to_dict()
+
+        # Convertir la marca de tiempo de Firestore a datetime
+        date_time = trans_data.get('dateTime')
+        if date_time == _firestore().SERVER_TIMESTAMP:
+            date_time = datetime.datetime.now()
+
+        # Coordenadas si existen
+        location = None
+        if 'location' in trans_data and trans_data['location']:
+            latitude = trans_data['location'].get('latitude')
+            longitude = trans_data['location'].get('longitude')
+            if latitude is not None and longitude is not None:
+                location = (float(latitude), float(longitude))
+
+        return {
+            'transaction_id': trans_doc.id,
+            'amount': float(trans_data.get('amount', 0)),
+            'dateTime': date_time,
+            'location': location,
+            'transactionName': trans_data.get('transactionName', ''),
+            'transactionType': trans_data.get('transactionType', ''),
+            'locationAnomaly': trans_data.get('locationAnomaly'),
+            'amountAnomaly': trans_data.get('amountAnomaly'),
+            'geohash': trans_data.get('geohash')
+        }
+
+    def queue_anomaly_flags(self, user_id: str, transaction_id: str, account_id: str,
+                            location_anomaly: bool = None, amount_anomaly: bool = None,
+                            transaction: Transaction = None) -> asyncio.Future:
+        """
+        Deja los flags de la transacción en el buffer write-behind y vuelve de inmediato; el futuro
+        devuelto se resuelve en True cuando el documento quedó escrito (False si no se pudo). El
+        historial en caché recibe los flags al instante. Si se da la transacción y su celda de
+        ubicación no estaba guardada, el geohash y los conteos de celdas van en el mismo lote.
+        """
+        update_data = self._claim_visit(account_id, transaction_id,
+                                        self._flag_fields(location_anomaly, amount_anomaly, transaction))
+        if not update_data:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(True)
+            return future
+        self.cache.apply_flags(user_id, {transaction_id: update_data})
+        return self.flag_writer.write(user_id, account_id, transaction_id, update_data)
+
+    async def update_transaction_anomalies(self, user_id: str, transaction_id: str,
+                                        location_anomaly: bool = None,
+                                        amount_anomaly: bool = None,
+                                        account_id: str = None,
+                                        transaction: Transaction = None) -> bool:
+        """
+        Actualiza los flags de anomalía de una transacción y espera a que se escriban. Si se conoce
+        su cuenta (del índice del historial) pasa por el buffer write-behind (ver queue_anomaly_flags);
+        si no, se busca en todas las cuentas del usuario.
+        """
+        if account_id is not None:
+            return await self.queue_anomaly_flags(
+                user_id, transaction_id, account_id, location_anomaly, amount_anomaly, transaction
+            )
+
+        update_data = self._flag_fields(location_anomaly, amount_anomaly, transaction)
         try:
             # Find the transaction in all user accounts
             accounts_ref = self.db.collection('accounts')
             query = accounts_ref.where('user_id', '==', user_id)
-            account_docs = query.stream()
 
-            for account_doc in account_docs:
+            async for account_doc in query.stream():
                 transaction_ref = account_doc.reference.collection('transactions').document(transaction_id)
-                transaction_doc = transaction_ref.get()
-                
+                transaction_doc = await transaction_ref.get()
+                metrics.count_reads(2)
+
                 if transaction_doc.exists:
-                    update_data = {}
-                    if location_anomaly is not None:
-                        update_data['locationAnomaly'] = location_anomaly
-                    if amount_anomaly is not None:
-                        update_data['amountAnomaly'] = amount_anomaly
-                    
+                    # La visita ya se contó si el documento guardado tiene geohash
+                    if transaction_doc.to_dict().get('geohash') is not None:
+                        update_data = self._without_geohash(update_data)
+                    else:
+                        update_data = self._claim_visit(account_doc.id, transaction_id, update_data)
                     if update_data:
-                        transaction_ref.update(update_data)
+                        batch = self.db.batch()
+                        batch.update(transaction_ref, update_data)
+                        if 'geohash' in update_data:
+                            self._add_cell_visits(batch, user_id, [update_data['geohash']])
+                        with timed('firestore_write'):
+                            try:
+                                await batch.commit()
+                            except Exception:
+                                self._release_visit(account_doc.id, transaction_id, update_data)
+                                raise
+                        metrics.count_writes(1 + ('geohash' in update_data))
+                        if 'geohash' in update_data:
+                            self._count_cached_visits(user_id, [update_data['geohash']])
                     return True
 
             return False
         except Exception as e:
             print(f"Error updating transaction anomalies: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    async def update_anomalies_batch(self, user_id: str, history: TransactionHistory,
+                                     updates: Dict[str, dict]) -> int:
+        """
+        Escribe los flags de varias transacciones por el buffer write-behind (WriteBatches de hasta
+        FlagWriteBuffer.MAX_BATCH_WRITES operaciones), ubicando cada documento con el índice del
+        historial, y espera a que se escriban. Las que no tienen celda de ubicación guardada
+        reciben además su geohash y suman a los conteos de celdas del usuario.
+
+        Args:
+            history (TransactionHistory): Historial del que se leyeron las transacciones.
+            updates (Dict[str, dict]): transaction_id -> campos a actualizar
+                (p. ej. {'locationAnomaly': True, 'amountAnomaly': False}).
+
+        Returns:
+            int: Documentos escritos.
+        """
+        queued = {}
+        futures = []
+        for transaction_id, update_data in updates.items():
+            account_id = history.account_of(transaction_id)
+            if account_id is None or not update_data:
+                logger.error(f"Skipping anomaly flags of {transaction_id}: account unknown")
+                continue
+            position = history.position(transaction_id)
+            stored_geohash = history.field('geohash')[position] if position is not None else None
+            update_data = self._claim_visit(account_id, transaction_id, {
+                **update_data, **self._location_cell_fields(history.location_of(transaction_id), stored_geohash)
+            })
+            queued[transaction_id] = update_data
+            futures.append(self.flag_writer.write(user_id, account_id, transaction_id, update_data))
+
+        # Mantener los flags del historial en caché al día (para "solo sin analizar")
+        self.cache.apply_flags(user_id, queued)
+        # Quien llama espera la escritura: no tiene sentido esperar además al temporizador del buffer
+        await self.flag_writer.flush()
+        return sum(await asyncio.gather(*futures))
+
+    async def _commit_flag_writes(self, writes: List[PendingWrite]):
+        """Escribe un lote del buffer de flags en un WriteBatch, con los conteos de celdas de sus geohashes nuevos."""
+        batch = self.db.batch()
+        new_cells: Dict[str, List[str]] = {}
+        for write in writes:
+            # update() falla con NotFound si el documento ya no existe
+            batch.update(self._transaction_ref(write.account_id, write.transaction_id), write.data)
+            if 'geohash' in write.data:
+                new_cells.setdefault(write.user_id, []).append(write.data['geohash'])
+        for user_id, geohashes in new_cells.items():
+            self._add_cell_visits(batch, user_id, geohashes)
+        with timed('firestore_write'):
+            await batch.commit()
+        metrics.count_writes(len(writes) + len(new_cells))
+        for user_id, geohashes in new_cells.items():
+            self._count_cached_visits(user_id, geohashes)
+
+    def _claim_visit(self, account_id: str, transaction_id: str, update_data: dict) -> dict:
+        """
+        Quita el geohash (y con él el incremento de los conteos de celdas) de la actualización si la
+        visita de la transacción ya está en un lote pendiente, en curso o escrito por este proceso:
+        quien leyó el historial antes de que se guardara el geohash no debe contarla otra vez.
+        """
+        if 'geohash' not in update_data:
+            return update_data
+        key = (account_id, transaction_id)
+        if key in self._counted_visits:
+            self._counted_visits.move_to_end(key)
+            return self._without_geohash(update_data)
+        self._counted_visits[key] = None
+        if len(self._counted_visits) > self.MAX_COUNTED_VISITS:
+            self._counted_visits.popitem(last=False)
+        return update_data
+
+    def _release_visit(self, account_id: str, transaction_id: str, update_data: dict):
+        """La escritura con el geohash falló: otra puede volver a contar la visita."""
+        if 'geohash' in update_data:
+            self._counted_visits.pop((account_id, transaction_id), None)
+
+    def _flag_write_failed(self, write: PendingWrite):
+        # El historial en caché tiene flags que no están en Firestore
+        self.cache.invalidate(write.user_id)
+        self._release_visit(write.account_id, write.transaction_id, write.data)
+
+    @staticmethod
+    def _without_geohash(update_data: dict) -> dict:
+        return {field: value for field, value in update_data.items() if field != 'geohash'}
+
+    @staticmethod
+    def _cell_visits_owner(write: PendingWrite) -> Optional[str]:
+        # Cada usuario con celdas nuevas en un lote agrega una escritura (su documento de conteos)
+        return write.user_id if 'geohash' in write.data else None
+
+    def _flag_fields(self, location_anomaly: bool = None, amount_anomaly: bool = None,
+                     transaction: Transaction = None) -> dict:
+        update_data = {}
+        if location_anomaly is not None:
+            update_data['locationAnomaly'] = location_anomaly
+        if amount_anomaly is not None:
+            update_data['amountAnomaly'] = amount_anomaly
+        location = (transaction.location.latitude, transaction.location.longitude) \
+            if transaction is not None and transaction.location else None
+        update_data.update(self._location_cell_fields(location, transaction.geohash if transaction is not None else None))
+        return update_data
+
+    async def get_location_cells(self, user_id: str) -> dict:
+        """
+        Conteos de visitas por celda del usuario en cada resolución ({'p4': {celda: visitas}, 'p5': ...,
+        'p6': ...}), para services.geohash.visits_near. Vacío si nunca se escribieron. Se guardan en
+        memoria como los historiales; las visitas que escribe este proceso se suman al escribirlas.
+        """
+        cached = self._location_cells.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] <= self.cache.ttl_seconds:
+            self._location_cells.move_to_end(user_id)
+            return cached[1]
+        return await self.cell_loads.do(user_id, lambda: self._load_location_cells(user_id))
+
+    async def get_location_cells_for(self, user_id: str, history: TransactionHistory,
+                                     transaction: Transaction) -> Optional[dict]:
+        """
+        Conteos de celdas con los que analizar la transacción, o None si no sirven: cuentan todas las
+        visitas escritas, así que solo describen el historial previo de la transacción más reciente.
+        """
+        if not transaction.location or len(history.before(transaction.dateTime)) + 1 < len(history):
+            return None
+        return await self.get_location_cells(user_id)
+
+    async def _load_location_cells(self, user_id: str) -> dict:
+        doc = await self.db.collection(self.LOCATION_CELLS_COLLECTION).document(user_id).get()
+        metrics.count_reads(1)
+        cells = doc.to_dict() if doc.exists else {}
+        self._location_cells[user_id] = (time.monotonic(), cells)
+        self._location_cells.move_to_end(user_id)
+        while len(self._location_cells) > self.cache.max_users:
+            self._location_cells.popitem(last=False)
+        return cells
+
+    async def get_location_model(self, user_id: str) -> Optional[dict]:
+        """Modelo de zonas habituales guardado del usuario (LocationModel.to_dict), o None si no hay."""
+        return await self.model_loads.do(user_id, lambda: self._read_location_model(user_id))
+
+    async def _read_location_model(self, user_id: str) -> Optional[dict]:
+        doc = await self.db.collection(self.LOCATION_MODELS_COLLECTION).document(user_id).get()
+        metrics.count_reads(1)
+        return doc.to_dict() if doc.exists else None
+
+    async def save_location_model(self, user_id: str, data: dict) -> bool:
+        """Guarda el modelo de zonas habituales del usuario; False (y queda en el log) si no se pudo."""
+        try:
+            with timed('firestore_write'):
+                await self.db.collection(self.LOCATION_MODELS_COLLECTION).document(user_id).set(data)
+            metrics.count_writes(1)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving location model of {user_id}: {str(e)}")
+            return False
+
+    @staticmethod
+    def _location_cell_fields(location: Tuple[float, float] = None, stored_geohash: str = None) -> dict:
+        """{'geohash': ...} si la transacción tiene ubicación (latitud, longitud) y su celda aún no se guardó."""
+        if location is None or stored_geohash is not None:
+            return {}
+        return {'geohash': encode(*location)}
+
+    @staticmethod
+    def _visit_increments(geohashes: List[str]) -> Dict[str, Dict[str, int]]:
+        """Visitas a sumar por resolución y celda ({'p5': {celda: visitas}, ...})."""
+        increments = {}
+        for geohash in geohashes:
+            for resolution, cells in cell_counts(geohash).items():
+                for cell, count in cells.items():
+                    increments.setdefault(resolution, {})
+                    increments[resolution][cell] = increments[resolution].get(cell, 0) + count
+        return increments
+
+    def _add_cell_visits(self, batch, user_id: str, geohashes: List[str]):
+        """Agrega al lote los incrementos de los conteos de celdas del usuario."""
+        data = {'user_id': user_id}
+        for resolution, cells in self._visit_increments(geohashes).items():
+            data[resolution] = {cell: _firestore().Increment(count) for cell, count in cells.items()}
+        batch.set(self.db.collection(self.LOCATION_CELLS_COLLECTION).document(user_id), data, merge=True)
+
+    def _count_cached_visits(self, user_id: str, geohashes: List[str]):
+        """Suma a los conteos en memoria del usuario (si están) las visitas que se acaban de escribir."""
+        cached = self._location_cells.get(user_id)
+        if cached is None:
+            return
+        # Copias: un análisis en otro hilo puede estar leyendo los conteos anteriores
+        cells = dict(cached[1])
+        for resolution, increments in self._visit_increments(geohashes).items():
+            counts = cells[resolution] = dict(cells.get(resolution, {}))
+            for cell, count in increments.items():
+                counts[cell] = counts.get(cell, 0) + count
+        self._location_cells[user_id] = (cached[0], cells)
+
+    def _transaction_ref(self, account_id: str, transaction_id: str):
+        return self.db.collection('accounts').document(account_id).collection('transactions').document(transaction_id)
@@ -0,0 +1,148 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class PendingWrite:
+    __slots__ = ("user_id", "account_id", "transaction_id", "data", "futures")
+
+    def __init__(self, user_id: str, account_id: str, transaction_id: str, data: dict):
+        """Campos a actualizar en accounts/{account_id}/transactions/{transaction_id}."""
+        self.user_id = user_id
+        self.account_id = account_id
+        self.transaction_id = transaction_id
+        self.data = data
+        self.futures: List[asyncio.Future] = []  # Uno por cada llamada a write() que se juntó en esta escritura
+
+class FlagWriteBuffer:
+    MAX_BATCH_WRITES = 500  # Límite de operaciones por WriteBatch de Firestore
+    FLUSH_SECONDS = float(os.getenv('FLAG_WRITE_FLUSH_SECONDS', 0.0))  # Espera antes de escribir lo pendiente
+
+    def __init__(self, commit: Callable[[List[PendingWrite]], Awaitable[None]],
+                 extra_op: Callable[[PendingWrite], Optional[str]] = None,
+                 on_failure: Callable[[PendingWrite], None] = None):
+        """
+        Buffer write-behind de actualizaciones de flags. Las escrituras al mismo documento que
+        llegan antes de escribirse se juntan en una; se escriben en lotes atómicos cuando hay
+        MAX_BATCH_WRITES documentos pendientes o pasados FLUSH_SECONDS desde la primera. Los
+        flush no se solapan: lo que llega mientras se escribe un lote sale junto en el siguiente,
+        así que con FLUSH_SECONDS=0 (group commit) la espera es la de un commit y, con carga,
+        los lotes crecen solos.
+        write() devuelve de inmediato un futuro que se resuelve en True cuando el documento quedó
+        escrito (o False si no se pudo), así quien no necesita esperar la escritura no lo hace.
+
+        Args:
+            commit: Escribe un lote de escrituras pendientes en un WriteBatch; lanza si falla.
+            extra_op: Clave de una operación adicional que commit agrega por cada clave distinta
+                del lote (p. ej. el documento de conteos de celdas del usuario), o None.
+            on_failure: Se llama con cada escritura que no se pudo hacer.
+        """
+        self._commit = commit
+        self._extra_op = extra_op or (lambda write: None)
+        self._on_failure = on_failure
+        self._pending: Dict[Tuple[str, str], PendingWrite] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()  # Tareas de flush en curso (referencias para que no se recolecten)
+
+        self.queued = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.documents_written = 0
+        self.failures = 0
+
+    def write(self, user_id: str, account_id: str, transaction_id: str, data: dict) -> asyncio.Future:
+        """Agrega una actualización del documento de la transacción; devuelve su futuro de durabilidad."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (account_id, transaction_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = PendingWrite(user_id, account_id, transaction_id, dict(data))
+        else:
+            pending.data.update(data)  # El último valor de cada campo gana
+            self.coalesced += 1
+        pending.futures.append(future)
+        self.queued += 1
+
+        if len(self._pending) >= self.MAX_BATCH_WRITES:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.FLUSH_SECONDS, self._start_flush)
+        return future
+
+    async def flush(self):
+        """Escribe todo lo pendiente y espera a que termine (al apagar, o para leer lo escrito)."""
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None or self._lock_loop is not loop:
+            self._flush_lock, self._lock_loop = asyncio.Lock(), loop
+        async with self._flush_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            writes, self._pending = list(self._pending.values()), {}
+            # Un documento aparece en un solo lote por flush, así que los lotes pueden ir en paralelo
+            await asyncio.gather(*(self._commit_chunk(chunk) for chunk in self._chunks(writes)))
+
+    def stats(self) -> dict:
+        """Contadores del buffer."""
+        return {
+            "pending": len(self._pending),
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "documents_written": self.documents_written,
+            "failures": self.failures
+        }
+
+    def _start_flush(self):
+        # Si ya hay un flush en curso este espera el lock y escribe lo que llegó mientras tanto
+        self._timer = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _chunks(self, writes: List[PendingWrite]) -> List[List[PendingWrite]]:
+        chunks, chunk, extra = [], [], set()
+        for write in writes:
+            key = self._extra_op(write)
+            cost = 1 + (key is not None and key not in extra)
+            if len(chunk) + len(extra) + cost > self.MAX_BATCH_WRITES:
+                chunks.append(chunk)
+                chunk, extra = [], set()
+            chunk.append(write)
+            if key is not None:
+                extra.add(key)
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    async def _commit_chunk(self, chunk: List[PendingWrite]):
+        try:
+            await self._commit(chunk)
+        except Exception as e:
+            if len(chunk) > 1:
+                # El lote es atómico: un documento borrado hace fallar a todos. Se reintenta cada uno
+                # por separado para escribir los demás.
+                await asyncio.gather(*(self._commit_chunk([write]) for write in chunk))
+                return
+            self.failures += 1
+            logger.error(f"Error writing flags of {chunk[0].transaction_id}: {str(e)}")
+            if self._on_failure is not None:
+                self._on_failure(chunk[0])
+            self._resolve(chunk, False)
+            return
+
+        self.batches += 1
+        self.documents_written += len(chunk)
+        self._resolve(chunk, True)
+
+    @staticmethod
+    def _resolve(chunk: List[PendingWrite], written: bool):
+        for write in chunk:
+            for future in write.futures:
+                if not future.done():
+                    future.set_result(written)
@@ -0,0 +1,77 @@
+from typing import Dict, List
+
+GEOHASH_PRECISION = 7          # Celda guardada en cada transacción (~153 m x 153 m)
+CELL_PRECISIONS = (4, 5, 6)    # Resoluciones de los conteos por usuario (~39 km, ~4.9 km, ~1.2 km)
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: value for value, char in enumerate(_BASE32)}
+
+def encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """
+    Geohash de una ubicación. Cada prefijo del resultado es la celda que la contiene en una
+    resolución más gruesa, así que una sola clave sirve para todas las resoluciones.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    cell, bits, value, even = [], 0, 0, True
+    while len(cell) < precision:
+        # Los bits pares dividen la longitud y los impares la latitud
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(cell)
+
+def decode_bounds(cell: str):
+    """Límites (lat_min, lat_max, lon_min, lon_max) de una celda."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if (value >> shift) & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+def neighborhood(cell: str) -> List[str]:
+    """La celda y sus 8 vecinas de la misma resolución (sin repetir cerca de los polos)."""
+    lat_min, lat_max, lon_min, lon_max = decode_bounds(cell)
+    lat_step, lon_step = lat_max - lat_min, lon_max - lon_min
+    lat_center, lon_center = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+
+    cells = []
+    for d_lat in (-1, 0, 1):
+        latitude = lat_center + d_lat * lat_step
+        if not -90.0 <= latitude <= 90.0:
+            continue
+        for d_lon in (-1, 0, 1):
+            longitude = (lon_center + d_lon * lon_step + 180.0) % 360.0 - 180.0
+            neighbor = encode(latitude, longitude, len(cell))
+            if neighbor not in cells:
+                cells.append(neighbor)
+    return cells
+
+def cell_counts(geohash: str) -> Dict[str, Dict[str, int]]:
+    """Incremento de los conteos por resolución ({'p5': {celda: 1}, ...}) para una visita."""
+    return {f'p{precision}': {geohash[:precision]: 1} for precision in CELL_PRECISIONS}
+
+def visits_near(location_cells: dict, latitude: float, longitude: float, precision: int = 5) -> int:
+    """
+    Transacciones del usuario en la celda de la ubicación y sus vecinas, según los conteos
+    de location_cells/{user_id}. Con precision=5 cubre al menos ~4.9 km alrededor del punto.
+    """
+    counts = location_cells.get(f'p{precision}', {})
+    return sum(counts.get(cell, 0) for cell in neighborhood(encode(latitude, longitude, precision)))
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Dict, List, Optional
+from models import Transaction
+from services.transaction_history import TransactionHistory
+import os
+import time
+
+class _CacheEntry:
+    __slots__ = ("history", "loaded_at", "synced_at")
+
+    def __init__(self, history: TransactionHistory, loaded_at: float, synced_at: float):
+        self.history = history
+        self.loaded_at = loaded_at  # Última carga completa desde Firestore
+        self.synced_at = synced_at  # Última sincronización (completa o incremental)
+
+class TransactionHistoryCache:
+    def __init__(self, max_users: int = 1024, ttl_seconds: float = 300.0, max_age_seconds: float = 3600.0):
+        """
+        Caché LRU/TTL acotada de historiales de transacciones por usuario, ordenados por dateTime.
+        Se comparte entre peticiones para que análisis repetidos del mismo usuario no lean Firestore.
+
+        Args:
+            max_users (int): Número máximo de historiales en memoria antes de expulsar el menos usado.
+            ttl_seconds (float): Segundos que un historial se considera válido desde su última sincronización.
+                Pasado ese tiempo se pone al día de forma incremental.
+            max_age_seconds (float): Segundos desde la última carga completa tras los cuales el historial
+                se descarta y se vuelve a leer entero (recoge ediciones y borrados de transacciones antiguas).
+        """
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._account_owners: Dict[str, str] = {}  # account_id -> user_id de los historiales en caché
+        self._lock = RLock()  # Los listeners de Firestore llaman desde otro hilo
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.patches = 0
+        self.incremental_syncs = 0
+
+    def get(self, user_id: str) -> Optional[TransactionHistory]:
+        """Devuelve el historial del usuario, o None si no está en caché o necesita sincronizarse."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry.synced_at > self.ttl_seconds:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry.history
+
+    def get_for_sync(self, user_id: str) -> Optional[TransactionHistory]:
+        """
+        Devuelve el historial en caché aunque haya pasado su TTL, para ponerlo al día de forma
+        incremental. Devuelve None si no existe o si ya requiere una carga completa.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > self.max_age_seconds:
+                self._drop(user_id)
+                return None
+            return entry.history
+
+    def put(self, user_id: str, history: TransactionHistory, incremental: bool = False):
+        """
+        Guarda el historial y registra a qué usuario pertenece cada cuenta.
+
+        Args:
+            incremental (bool): True si el historial es el resultado de poner al día uno en caché;
+                conserva el instante de la última carga completa.
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(user_id)
+            if incremental and entry is not None:
+                entry.history = history
+                entry.synced_at = now
+                self._entries.move_to_end(user_id)
+                self.incremental_syncs += 1
+            else:
+                self._drop(user_id)
+                self._entries[user_id] = _CacheEntry(history, now, now)
+
+            for account_id in history.account_ids:
+                self._account_owners[account_id] = user_id
+
+            while len(self._entries) > self.max_users:
+                oldest_user_id = next(iter(self._entries))
+                self._drop(oldest_user_id)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str):
+        """Descarta el historial del usuario para forzar una recarga completa."""
+        with self._lock:
+            if user_id in self._entries:
+                self._drop(user_id)
+                self.invalidations += 1
+
+    def apply_transaction(self, user_id: str, transaction: Transaction, account_id: str = None):
+        """
+        Inserta o reemplaza una transacción en el historial en caché manteniendo el orden por dateTime.
+        Si el usuario no está en caché no hace nada: la próxima lectura cargará el historial completo.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+
+            # Se crea un historial nuevo para no modificar el que otra petición esté recorriendo
+            entry.history = entry.history.upsert(transaction, account_id)
+            self.patches += 1
+
+    def apply_flags(self, user_id: str, updates: Dict[str, dict]):
+        """Actualiza los flags de anomalía de varias transacciones del historial en caché."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+
+            entry.history = entry.history.with_flags(updates)
+            self.patches += 1
+
+    def owner_of_account(self, account_id: str) -> Optional[str]:
+        """Devuelve el usuario dueño de la cuenta si su historial está en caché."""
+        with self._lock:
+            return self._account_owners.get(account_id)
+
+    def stats(self) -> dict:
+        """Contadores de uso de la caché."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_users": self.max_users,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "patches": self.patches,
+                "incremental_syncs": self.incremental_syncs
+            }
+
+    def _drop(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            for account_id in entry.history.account_ids:
+                self._account_owners.pop(account_id, None)
+
+# Caché compartida por todas las instancias de FirestoreService del proceso
+history_cache = TransactionHistoryCache(
+    max_users=int(os.getenv('HISTORY_CACHE_MAX_USERS', 1024)),
+    ttl_seconds=float(os.getenv('HISTORY_CACHE_TTL_SECONDS', 300)),
+    max_age_seconds=float(os.getenv('HISTORY_CACHE_MAX_AGE_SECONDS', 3600))
+)
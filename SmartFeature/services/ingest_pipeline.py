@@ -0,0 +1,205 @@
+from typing import Dict, List, Optional, Tuple
+from services.change_sources import ChangeSource, TransactionChange
+from services.detector_pipeline import DetectorPipeline
+from services.firestore_service import FirestoreService
+from services.location_anomaly_service import AnomalyDetectionService
+from services.amount_anomaly_service import AmountAnomalyService
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class IngestPipeline:
+    WORKERS = int(os.getenv('INGEST_WORKERS', 4))
+    MAX_QUEUE = int(os.getenv('INGEST_MAX_QUEUE', 1000))
+    FLUSH_SIZE = int(os.getenv('INGEST_FLUSH_SIZE', 200))          # Flags pendientes que fuerzan una escritura
+    FLUSH_SECONDS = float(os.getenv('INGEST_FLUSH_SECONDS', 0.5))  # Espera máxima de un flag antes de escribirse
+    STOP_TIMEOUT = 10.0  # Segundos para vaciar la cola al detenerse
+
+    def __init__(self, firestore_service: FirestoreService, anomaly_service: AnomalyDetectionService,
+                 amount_anomaly_service: AmountAnomalyService, source: ChangeSource,
+                 detector_pipeline: DetectorPipeline = None):
+        """
+        Analiza las transacciones en cuanto se escriben, sin esperar a que el cliente llame a
+        un endpoint de análisis. El origen de cambios entrega cada transacción nueva a una cola
+        acotada; los workers corren los dos detectores contra el historial del usuario y juntan
+        los flags, que se escriben por usuario en WriteBatches al llegar a FLUSH_SIZE pendientes
+        o cada FLUSH_SECONDS.
+
+        Con la cola llena el origen espera (backpressure): el listener de Firestore deja de
+        consumir su stream en lugar de acumular transacciones en memoria.
+
+        Los detectores corren en detector_pipeline, el de los endpoints, para compartir sus locks
+        por modelo y no esperarlos en el event loop; sin él se usa uno propio sin pool.
+        """
+        self.firestore_service = firestore_service
+        self.anomaly_service = anomaly_service
+        self.amount_anomaly_service = amount_anomaly_service
+        self.source = source
+        self.detector_pipeline = detector_pipeline or DetectorPipeline.default(
+            anomaly_service, amount_anomaly_service, workers=0
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        # user_id -> transaction_id -> (flags, llegada); una transacción analizada dos veces antes
+        # de escribirse se escribe una sola vez
+        self._pending: Dict[str, Dict[str, Tuple[dict, float]]] = {}
+        self._pending_count = 0
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+        self.received = 0
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.blocked = 0           # Entregas que esperaron porque la cola estaba llena
+        self.max_depth = 0         # Mayor profundidad de cola observada
+        self.flushes = 0
+        self.flags_written = 0
+        self.write_failures = 0
+        self._latency_total = 0.0  # Segundos desde que llega cada cambio hasta que se escriben sus flags
+        self._latency_max = 0.0
+        self._latency_count = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Crea la cola y los workers en el event loop actual y conecta el origen de cambios."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.MAX_QUEUE)
+        self._flush_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.WORKERS)]
+        self._tasks.append(asyncio.create_task(self._flush_periodically()))
+        self.source.start(self)
+
+    async def stop(self):
+        """Desconecta el origen, termina lo que quedó en la cola y escribe los flags pendientes."""
+        if not self.running:
+            return
+        self.source.stop()
+        try:
+            await asyncio.wait_for(self._queue.join(), self.STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Ingest pipeline stopped with {self._queue.qsize()} transactions queued")
+        # Con el lock no hay una escritura a medias: cancelarla perdería los flags que ya tomó
+        async with self._flush_lock:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    async def submit(self, change: TransactionChange):
+        """Encola una transacción nueva; espera mientras la cola esté llena."""
+        if self._queue.full():
+            self.blocked += 1
+        await self._queue.put(change)
+        self.received += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def submit_threadsafe(self, change: TransactionChange):
+        """submit desde otro hilo (listeners de Firestore): bloquea ese hilo mientras la cola esté llena."""
+        asyncio.run_coroutine_threadsafe(self.submit(change), self._loop).result()
+
+    async def flush(self) -> int:
+        """Escribe los flags pendientes (un lote por usuario) y devuelve cuántos documentos escribió."""
+        async with self._flush_lock:
+            pending, self._pending, self._pending_count = self._pending, {}, 0
+            written = 0
+            for user_id, updates in pending.items():
+                try:
+                    # Normalmente de la caché, donde los workers ya insertaron las transacciones analizadas
+                    history = await self.firestore_service.get_user_history_with(user_id, updates)
+                    written += await self.firestore_service.update_anomalies_batch(
+                        user_id, history, {t_id: flags for t_id, (flags, _) in updates.items()}
+                    )
+                except Exception as e:
+                    self.write_failures += len(updates)
+                    logger.error(f"Error writing anomaly flags of {user_id}: {str(e)}")
+                    continue
+
+                now = time.monotonic()
+                self._latency_count += len(updates)
+                for _, received_at in updates.values():
+                    self._latency_total += now - received_at
+                    self._latency_max = max(self._latency_max, now - received_at)
+            if pending:
+                self.flushes += 1
+                self.flags_written += written
+            return written
+
+    def stats(self) -> dict:
+        """Profundidad de la cola y contadores del pipeline."""
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.MAX_QUEUE,
+            "max_depth": self.max_depth,
+            "workers": self.WORKERS,
+            "received": self.received,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "pending_flags": self._pending_count,
+            "flushes": self.flushes,
+            "flags_written": self.flags_written,
+            "write_failures": self.write_failures,
+            "latency_avg_ms": round(1000 * self._latency_total / self._latency_count, 2) if self._latency_count else None,
+            "latency_max_ms": round(1000 * self._latency_max, 2)
+        }
+
+    async def _work(self):
+        while True:
+            change = await self._queue.get()
+            try:
+                await self._process(change)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error analyzing ingested transaction {change.transaction.transaction_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.FLUSH_SECONDS)
+            await self.flush()
+
+    async def _process(self, change: TransactionChange):
+        transaction = change.transaction
+        if transaction.locationAnomaly is not None and transaction.amountAnomaly is not None:
+            self.skipped += 1  # Ya analizada (p. ej. importada con sus flags)
+            return
+
+        user_id = await self.firestore_service.get_account_owner(change.account_id)
+        if user_id is None:
+            self.skipped += 1  # La cuenta ya no existe
+            return
+
+        history = await self.firestore_service.get_user_history(user_id)
+        if transaction.transaction_id not in history:
+            # El historial en caché aún no tiene la transacción (el cambio llegó antes que la lectura)
+            self.firestore_service.cache.apply_transaction(user_id, transaction, change.account_id)
+            history = history.upsert(transaction, change.account_id)
+
+        location_cells = await self.firestore_service.get_location_cells_for(user_id, history, transaction)
+        analysis = await self.detector_pipeline.analyze(
+            user_id, transaction, history.before(transaction.dateTime), stages=('location', 'amount'),
+            location_cells=location_cells
+        )
+        is_location_anomaly, _, _ = analysis.results['location']
+        is_amount_anomaly, _, _ = analysis.results['amount']
+        self.processed += 1
+
+        updates = self._pending.setdefault(user_id, {})
+        if transaction.transaction_id not in updates:
+            self._pending_count += 1
+        updates[transaction.transaction_id] = (
+            {'locationAnomaly': is_location_anomaly, 'amountAnomaly': is_amount_anomaly}, change.received_at
+        )
+        if self._pending_count >= self.FLUSH_SIZE:
+            await self.flush()
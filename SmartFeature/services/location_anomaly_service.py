@@ -1,8 +1,130 @@
-from typing import List, Tuple
-from models import Transaction, Location
-from geopy.distance import geodesic
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional, Tuple, Union
+from models import Transaction
+from services.geo_distance import distances_km, ellipsoidal_km, haversine_km
+from services.density_location_model import DensityLocationModel
+from services.geohash import visits_near
+from services.metrics import metrics, timed
+from services.model_locks import ModelBusy, holding
+from services.transaction_history import TransactionHistory
 import numpy as np
-from sklearn.cluster import KMeans
+import os
+
+class LocationModel:
+    def __init__(self, n_clusters: int = 3, ellipsoidal: bool = True):
+        """
+        Modelo incremental de las "zonas habituales" de un usuario: centroides y cantidad de
+        transacciones de cada cluster. Las ubicaciones nuevas se absorben con k-means en línea
+        (cada punto mueve solo su centroide más cercano), y KMeans completo se vuelve a ajustar
+        únicamente cuando llegan muchos puntos nuevos o cuando los nuevos se alejan de los clusters.
+
+        Args:
+            n_clusters (int): Máximo de clusters (zonas habituales).
+            ellipsoidal (bool): Distancias con corrección elipsoidal o solo haversine.
+        """
+        self.n_clusters = n_clusters
+        self.ellipsoidal = ellipsoidal
+        self.REFIT_FRACTION = 0.25   # Reajustar cuando los puntos nuevos superan este % de los del último ajuste
+        self.MIN_REFIT_POINTS = 3    # Puntos nuevos mínimos antes de considerar un reajuste
+        self.DRIFT_FACTOR = 2.0      # Reajustar si los nuevos quedan en promedio al doble de la dispersión del ajuste
+        self.MIN_SPREAD_KM = 1.0     # Dispersión mínima para no reajustar por usuarios que siempre están en el mismo punto
+
+        self.version = 0                                  # Aumenta con cada reajuste completo
+        self.stored_version = 0                           # Última versión guardada (ver AnomalyDetectionService)
+        self.last_transaction_id: Optional[str] = None    # Última transacción absorbida por el modelo
+        self.lock = Lock()  # Quien lee o actualiza el modelo lo toma (ver services.model_locks)
+        self.centroids = np.empty((0, 2))
+        self.counts = np.empty(0, dtype=int)
+        self.fitted_size = 0        # Puntos usados en el último ajuste completo
+        self.fitted_spread_km = 0.0  # Distancia media de esos puntos a su centroide
+        self._new_points = 0
+        self._new_distance_km = 0.0  # Suma de distancias de los puntos nuevos al centroide más cercano
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    @property
+    def needs_refit(self) -> bool:
+        """Si los puntos absorbidos desde el último ajuste justifican volver a correr KMeans."""
+        if self._new_points < self.MIN_REFIT_POINTS:
+            return False
+        if self._new_points >= self.REFIT_FRACTION * self.fitted_size:
+            return True
+        drift = self._new_distance_km / self._new_points
+        return drift > self.DRIFT_FACTOR * max(self.fitted_spread_km, self.MIN_SPREAD_KM)
+
+    @timed('kmeans_fit')
+    def fit(self, locations, last_transaction_id: str = None) -> "LocationModel":
+        """Ajusta KMeans sobre todas las ubicaciones (latitud, longitud) y reinicia los contadores."""
+        metrics.count_fit('kmeans')
+        from sklearn.cluster import KMeans  # scikit-learn se importa en el primer ajuste (tarda ~1 s)
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        kmeans = KMeans(n_clusters=min(self.n_clusters, len(locations)), random_state=42)
+        labels = kmeans.fit_predict(locations)
+
+        self.centroids = kmeans.cluster_centers_
+        self.counts = np.bincount(labels, minlength=len(self.centroids))
+        self.fitted_size = len(locations)
+        distance = ellipsoidal_km if self.ellipsoidal else haversine_km
+        own_centroids = self.centroids[labels]
+        self.fitted_spread_km = float(np.mean(distance(
+            locations[:, 0], locations[:, 1], own_centroids[:, 0], own_centroids[:, 1]
+        )))
+        self._new_points = 0
+        self._new_distance_km = 0.0
+        self.last_transaction_id = last_transaction_id
+        self.version += 1
+        return self
+
+    def nearest(self, latitude: float, longitude: float) -> Tuple[int, float]:
+        """Índice del centroide más cercano y su distancia en kilómetros."""
+        distances = distances_km(latitude, longitude, self.centroids, ellipsoidal=self.ellipsoidal)
+        cluster = int(np.argmin(distances))
+        return cluster, float(distances[cluster])
+
+    def add(self, latitude: float, longitude: float, transaction_id: str = None):
+        """Absorbe una ubicación moviendo su centroide más cercano hacia ella (k-means en línea)."""
+        cluster, distance = self.nearest(latitude, longitude)
+        self.counts[cluster] += 1
+        self.centroids[cluster] += (np.array([latitude, longitude]) - self.centroids[cluster]) / self.counts[cluster]
+        self._new_points += 1
+        self._new_distance_km += distance
+        if transaction_id is not None:
+            self.last_transaction_id = transaction_id
+
+    def to_dict(self) -> dict:
+        """
+        Representación serializable (JSON/Firestore) del modelo. Los centroides van aplanados
+        ([lat0, lon0, lat1, lon1, ...]): Firestore no admite arreglos dentro de arreglos.
+        """
+        return {
+            'n_clusters': self.n_clusters,
+            'ellipsoidal': self.ellipsoidal,
+            'version': self.version,
+            'last_transaction_id': self.last_transaction_id,
+            'centroids': self.centroids.ravel().tolist(),
+            'counts': self.counts.tolist(),
+            'fitted_size': self.fitted_size,
+            'fitted_spread_km': self.fitted_spread_km,
+            'new_points': self._new_points,
+            'new_distance_km': self._new_distance_km
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LocationModel":
+        model = cls(data['n_clusters'], data.get('ellipsoidal', True))
+        model.version = model.stored_version = data['version']
+        model.last_transaction_id = data.get('last_transaction_id')
+        model.centroids = np.asarray(data['centroids'], dtype=float).reshape(-1, 2)
+        model.counts = np.asarray(data['counts'], dtype=int)
+        model.fitted_size = data['fitted_size']
+        model.fitted_spread_km = data['fitted_spread_km']
+        model._new_points = data.get('new_points', 0)
+        model._new_distance_km = data.get('new_distance_km', 0.0)
+        return model
+
+AnyLocationModel = Union[LocationModel, DensityLocationModel]
 
 class AnomalyDetectionService:
     def __init__(self):
@@ -13,15 +135,105 @@ class AnomalyDetectionService:
         self.MAX_NORMAL_DISTANCE = 50.0  # Distancia máxima considerada normal en kilómetros
         self.MAX_NORMAL_TIME = 24        # Tiempo máximo considerado normal entre transacciones en horas
         self.MIN_TRANSACTIONS_FOR_CLUSTERING = 5  # Mínimo de transacciones necesarias para hacer clustering
+        self.ELLIPSOIDAL_DISTANCES = True  # Corrección elipsoidal (a metros de geodesic); False: solo haversine
+        self.MAX_MODELS = 4096             # Modelos de ubicación por usuario en memoria (se descartan los menos usados)
+        # 'kmeans': hasta 3 centroides (LocationModel); 'density': zonas densas indexadas (DensityLocationModel)
+        self.LOCATION_BACKEND = os.getenv('LOCATION_MODEL_BACKEND', 'kmeans')
+        self.AREA_RADIUS_KM = 5.0          # Radio de una zona habitual (backend 'density')
+        self.AREA_MIN_SAMPLES = 3          # Transacciones en ese radio para que sea zona habitual (backend 'density')
+        self.MAX_PREFIX_MODELS = 1024      # Ajustes de prefijos del historial en memoria (transacciones antiguas)
+        self.CELL_PRECISION = 5            # Celdas geohash de la comprobación de zona visitada (~4.9 km)
+        self.MIN_CELL_VISITS = 3           # Visitas previas en la celda o sus vecinas para no consultar el modelo
+        self._models: "OrderedDict[str, AnyLocationModel]" = OrderedDict()
+        # (primera y última transacción con ubicación, cuántas son) -> modelo ajustado sobre ese prefijo
+        self._prefix_models: "OrderedDict[Tuple[str, str, int], AnyLocationModel]" = OrderedDict()
+        self._models_lock = Lock()  # Solo para los diccionarios; cada modelo tiene su propio lock
+        self.prefix_hits = 0
+        self.prefix_fits = 0
+        self.cell_skips = 0  # Análisis resueltos con los conteos de celdas, sin el modelo
 
-    def detect_anomaly(self, transaction: Transaction, historical_transactions: List[Transaction]) -> Tuple[bool, float, str]:
+    def new_location_model(self) -> AnyLocationModel:
+        """Crea un modelo de zonas habituales vacío del backend configurado."""
+        if self.LOCATION_BACKEND == 'density':
+            return DensityLocationModel(self.AREA_RADIUS_KM, self.AREA_MIN_SAMPLES, ellipsoidal=self.ELLIPSOIDAL_DISTANCES)
+        if self.LOCATION_BACKEND != 'kmeans':
+            raise ValueError(f"Unknown location model backend: {self.LOCATION_BACKEND}")
+        return LocationModel(ellipsoidal=self.ELLIPSOIDAL_DISTANCES)
+
+    def preload(self):
+        """
+        Importa scikit-learn y ajusta un modelo de prueba del backend configurado, para que el
+        primer análisis no pague ese costo (warm-up; se puede llamar desde otro hilo).
+        """
+        self.new_location_model().fit([[0.0, 0.0], [0.0, 0.1], [0.1, 0.0], [0.1, 0.1]])
+
+    def restore_location_model(self, user_id: str, data: dict) -> bool:
+        """
+        Instala como modelo del usuario uno guardado (LocationModel.to_dict) si el de memoria todavía
+        no se ajustó y el guardado es del backend y las distancias configurados. Al usarlo se pone al
+        día desde su última transacción (last_transaction_id), o se reajusta si el historial cambió.
+        """
+        if self.LOCATION_BACKEND != 'kmeans' or data.get('ellipsoidal', True) != self.ELLIPSOIDAL_DISTANCES:
+            return False
+        restored = LocationModel.from_dict(data)
+        with self._models_lock:
+            current = self._models.get(user_id)
+            if current is not None and (current.version or len(current) or current.lock.locked()):
+                return False
+            self._models[user_id] = restored
+            self._models.move_to_end(user_id)
+            if len(self._models) > self.MAX_MODELS:
+                self._models.popitem(last=False)
+            return True
+
+    def location_model_to_store(self, user_id: str) -> Optional[dict]:
+        """
+        El modelo del usuario para guardarlo (to_dict) si se reajustó desde la última vez que se
+        guardó, o None; si otro hilo lo tiene no espera (se guarda en un análisis siguiente). Los
+        modelos del backend 'density' no se guardan: indexan todas las ubicaciones del historial.
+        """
+        with self._models_lock:
+            model = self._models.get(user_id)
+        if not isinstance(model, LocationModel) or model.version <= model.stored_version:
+            return None
+        try:
+            with holding(model.lock, wait=False):
+                model.stored_version = model.version
+                return model.to_dict()
+        except ModelBusy:
+            return None
+
+    def location_model(self, user_id: str) -> AnyLocationModel:
+        """Devuelve el modelo de zonas habituales en memoria de un usuario."""
+        with self._models_lock:
+            model = self._models.get(user_id)
+            if model is None:
+                model = self.new_location_model()
+                self._models[user_id] = model
+                if len(self._models) > self.MAX_MODELS:
+                    self._models.popitem(last=False)
+            else:
+                self._models.move_to_end(user_id)
+            return model
+
+    @timed('location_detection')
+    def detect_anomaly(self, transaction: Transaction,
+                       historical_transactions: Union[TransactionHistory, List[Transaction]],
+                       model: AnyLocationModel = None, wait: bool = True,
+                       location_cells: dict = None) -> Tuple[bool, float, str]:
         """
         Detecta si una transacción es anómala basada en ubicación y tiempo en relación
         con transacciones previas en el historial.
 
         Args:
             transaction (Transaction): La transacción actual a analizar.
-            historical_transactions (List[Transaction]): Historial de transacciones previas para comparación.
+            historical_transactions (TransactionHistory): Historial de transacciones previas para comparación
+                (una lista de Transaction ordenada también sirve; se convierte a columnas).
+            model (AnyLocationModel): Modelo incremental de zonas habituales del usuario (opcional). Se pone
+                al día con las transacciones que no ha visto y se usa en lugar de ajustar KMeans de nuevo.
+            wait (bool): Si esperar el lock del modelo cuando otro hilo lo tiene; con False lanza ModelBusy.
+            location_cells (dict): Conteos de visitas por celda del usuario (location_cells/{user_id}) que
+                describen el historial previo (opcional). Si la ubicación es una zona visitada no se usa el modelo.
 
         Returns:
             Tuple[bool, float, str]: Indica si es anómala, el nivel de confianza, y una descripción.
@@ -30,15 +242,22 @@ class AnomalyDetectionService:
         if not transaction.location:
             return False, 0.0, "No location data available"
 
+        history = TransactionHistory.coerce(historical_transactions)
+        latitude, longitude = transaction.location.latitude, transaction.location.longitude
+
         # 1. Análisis de distancia y tiempo con la última transacción
-        if historical_transactions:
-            last_transaction = historical_transactions[-1]  # Obtiene la última transacción en el historial
-            if last_transaction.location:
+        if len(history):
+            last = len(history) - 1  # Posición de la última transacción en el historial
+            if not np.isnan(history.latitudes[last]):
                 # Calcula la distancia entre la ubicación de la última y la transacción actual
-                distance = self._calculate_distance(transaction.location, last_transaction.location)
-                
+                distance = float(distances_km(
+                    latitude, longitude,
+                    [(history.latitudes[last], history.longitudes[last])],
+                    ellipsoidal=self.ELLIPSOIDAL_DISTANCES
+                )[0])
+
                 # Calcula la diferencia de tiempo en horas entre ambas transacciones
-                time_diff = (transaction.dateTime - last_transaction.dateTime).total_seconds() / 3600
+                time_diff = history.hours_since(last, transaction.dateTime)
 
                 # Si la distancia supera el límite y el tiempo es muy corto, se marca como anómalo
                 if distance > self.MAX_NORMAL_DISTANCE:
@@ -46,32 +265,25 @@ class AnomalyDetectionService:
                         return True, 0.9, f"Unusual distance ({distance:.1f}km) in short time period ({time_diff:.1f}h)"
 
         # 2. Análisis de clusters de ubicaciones
-        # Crea una lista de coordenadas de ubicación para todas las transacciones con ubicación en el historial.
-        locations = [
-            (t.location.latitude, t.location.longitude) 
-            for t in historical_transactions 
-            if t.location
-        ]
-
-        # Si hay suficientes transacciones para hacer clustering, se aplica KMeans para identificar áreas comunes.
-        if len(locations) >= self.MIN_TRANSACTIONS_FOR_CLUSTERING:
-            kmeans = KMeans(n_clusters=min(3, len(locations)), random_state=42)  # Define hasta 3 clusters
-            kmeans.fit(locations)  # Agrupa las ubicaciones en clusters
-            
-            # Convierte la ubicación de la transacción actual en un array compatible con KMeans
-            new_location = np.array([[transaction.location.latitude, transaction.location.longitude]])
-            
-            # Calcula la distancia de la transacción actual a cada centroide de los clusters
-            distances_to_clusters = [
-                geodesic(
-                    (transaction.location.latitude, transaction.location.longitude),
-                    (center[0], center[1])
-                ).kilometers
-                for center in kmeans.cluster_centers_
-            ]
-            
+        # Posiciones de las transacciones del historial que tienen ubicación, en orden de dateTime.
+        located = history.located_positions()
+
+        # Si hay suficientes transacciones para hacer clustering, se usan las zonas habituales del modelo.
+        if len(located) >= self.MIN_TRANSACTIONS_FOR_CLUSTERING:
+            # Si el usuario ya hizo varias transacciones en la celda o sus vecinas, la zona es habitual
+            if location_cells is not None and self.well_visited(transaction, location_cells):
+                with self._models_lock:
+                    self.cell_skips += 1
+                return False, 0.0, "Transaction appears normal"
+
             # Selecciona la menor distancia entre la ubicación actual y los clusters existentes
-            min_distance = min(distances_to_clusters)
+            if model is not None:
+                # Con el lock del modelo hasta consultarlo, para que otro hilo no lo cambie a medias
+                with holding(model.lock, wait):
+                    _, min_distance = self._synced_model(model, history, located).nearest(latitude, longitude)
+            else:
+                clusters = self.new_location_model().fit(self._locations(history, located))
+                _, min_distance = clusters.nearest(latitude, longitude)
             # Si la ubicación de la transacción está demasiado lejos de los clusters conocidos, es anómala
             if min_distance > self.MAX_NORMAL_DISTANCE:
                 return True, 0.8, f"Location outside of usual areas (Distance to nearest cluster: {min_distance:.1f}km)"
@@ -79,18 +291,72 @@ class AnomalyDetectionService:
         # Si no se detectan anomalías, devuelve un resultado indicando normalidad
         return False, 0.0, "Transaction appears normal"
 
-    def _calculate_distance(self, loc1: Location, loc2: Location) -> float:
+    def well_visited(self, transaction: Transaction, location_cells: dict) -> bool:
+        """
+        Si la ubicación de la transacción tiene al menos MIN_CELL_VISITS visitas en su celda o las
+        vecinas (sin contar la suya, si ya se escribió: tiene geohash).
         """
-        Calcula la distancia en kilómetros entre dos ubicaciones.
+        location = transaction.location
+        visits = visits_near(location_cells, location.latitude, location.longitude, self.CELL_PRECISION)
+        return visits - (transaction.geohash is not None) >= self.MIN_CELL_VISITS
 
-        Args:
-            loc1 (Location): Ubicación 1.
-            loc2 (Location): Ubicación 2.
+    def _synced_model(self, model: AnyLocationModel, history: TransactionHistory,
+                      located: np.ndarray) -> AnyLocationModel:
+        """
+        Devuelve un modelo que cubre exactamente las transacciones con ubicación (posiciones located
+        del historial). El modelo dado absorbe las que aún no ha visto y se reajusta si hace falta;
+        si ya cubre transacciones posteriores (se analiza una transacción antigua) se ajusta uno temporal.
+        Se llama con model.lock tomado.
+        """
+        covered = len(model)
+        if covered > len(located):
+            return self._prefix_model(history, located)
 
-        Returns:
-            float: La distancia en kilómetros entre ambas ubicaciones.
+        last_id = history.ids[located[-1]]
+        if not covered or history.ids[located[covered - 1]] != model.last_transaction_id:
+            # Modelo nuevo, o el historial cambió debajo de él (transacciones editadas o borradas)
+            return model.fit(self._locations(history, located), last_id)
+
+        for position in located[covered:]:
+            model.add(history.latitudes[position], history.longitudes[position], history.ids[position])
+        if model.needs_refit:
+            model.fit(self._locations(history, located), last_id)
+        return model
+
+    def _prefix_model(self, history: TransactionHistory, located: np.ndarray) -> AnyLocationModel:
+        """
+        Modelo ajustado sobre las transacciones con ubicación de un prefijo del historial, para
+        analizar una transacción antigua. Se guarda por prefijo: volver a analizarla (o analizar
+        otra con el mismo historial previo) no vuelve a ajustar el modelo. No se modifica después
+        de ajustarlo, así que se puede consultar sin lock.
         """
-        return geodesic(
-            (loc1.latitude, loc1.longitude),
-            (loc2.latitude, loc2.longitude)
-        ).kilometers
+        key = (history.ids[located[0]], history.ids[located[-1]], len(located))
+        with self._models_lock:
+            model = self._prefix_models.get(key)
+            if model is not None:
+                self._prefix_models.move_to_end(key)
+                self.prefix_hits += 1
+                return model
+
+        model = self.new_location_model().fit(self._locations(history, located))
+        with self._models_lock:
+            self.prefix_fits += 1
+            self._prefix_models[key] = model
+            if len(self._prefix_models) > self.MAX_PREFIX_MODELS:
+                self._prefix_models.popitem(last=False)
+        return model
+
+    def stats(self) -> dict:
+        with self._models_lock:
+            return {
+                "models": len(self._models),
+                "prefix_models": len(self._prefix_models),
+                "prefix_hits": self.prefix_hits,
+                "prefix_fits": self.prefix_fits,
+                "cell_skips": self.cell_skips
+            }
+
+    @staticmethod
+    def _locations(history: TransactionHistory, positions: np.ndarray) -> np.ndarray:
+        """Arreglo (n, 2) de (latitud, longitud) de las posiciones dadas."""
+        return np.column_stack((history.latitudes[positions], history.longitudes[positions]))
@@ -0,0 +1,191 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+import time
+
+# Límites (segundos) de los histogramas de tiempo; el último bucket es +Inf
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Límites de los histogramas de documentos por petición
+DOCUMENT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                yield f'{self.name}{_labels(self.labels, label_values)} {value:g}'
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label_values -> [conteo por bucket (sin acumular, + el de +Inf), suma]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """label_values -> (observaciones, suma)."""
+        with self._lock:
+            return {label_values: (sum(counts), total) for label_values, (counts, total) in self._series.items()}
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                    yield f'{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}'
+                yield f'{self.name}_sum{_labels(self.labels, label_values)} {total:g}'
+                yield f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}'
+
+class RequestTimings:
+    __slots__ = ("started", "stages", "documents_read", "documents_written")
+
+    def __init__(self):
+        """Desglose de una petición: segundos por etapa y documentos de Firestore leídos/escritos."""
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.documents_read = 0
+        self.documents_written = 0
+
+    def server_timing(self) -> str:
+        """Valor del header Server-Timing (lo muestran las herramientas de desarrollo del navegador)."""
+        entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.stages.items()]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.2f}')
+        entries.append(f'reads;desc="{self.documents_read}"')
+        entries.append(f'writes;desc="{self.documents_written}"')
+        return ', '.join(entries)
+
+_current_request: ContextVar[Optional[RequestTimings]] = ContextVar('current_request', default=None)
+
+class Metrics:
+    def __init__(self):
+        """
+        Métricas del proceso en formato de exposición de Prometheus (texto), sin dependencias:
+        tiempos por etapa del camino caliente, peticiones, documentos leídos/escritos y ajustes
+        de modelos. Las etapas también se suman al desglose de la petición en curso, si hay una.
+        """
+        self.stage_seconds = Histogram(
+            'smartfeature_stage_seconds', 'Time spent per processing stage.', ('stage',)
+        )
+        self.request_seconds = Histogram(
+            'smartfeature_request_seconds', 'HTTP request latency.', ('method', 'path')
+        )
+        self.requests = Counter(
+            'smartfeature_requests_total', 'HTTP requests by status code.', ('method', 'path', 'status')
+        )
+        self.request_documents_read = Histogram(
+            'smartfeature_request_documents_read', 'Firestore documents read per request.', ('path',),
+            DOCUMENT_BUCKETS
+        )
+        self.request_documents_written = Histogram(
+            'smartfeature_request_documents_written', 'Firestore documents written per request.', ('path',),
+            DOCUMENT_BUCKETS
+        )
+        self.documents_read = Counter(
+            'smartfeature_firestore_documents_read_total', 'Firestore documents read.'
+        )
+        self.documents_written = Counter(
+            'smartfeature_firestore_documents_written_total', 'Firestore documents written.'
+        )
+        self.model_fits = Counter(
+            'smartfeature_model_fits_total', 'Full model fits by model.', ('model',)
+        )
+
+    def start_request(self) -> RequestTimings:
+        """Empieza el desglose de una petición en el contexto actual (lo heredan sus tareas)."""
+        timings = RequestTimings()
+        _current_request.set(timings)
+        return timings
+
+    def finish_request(self, timings: RequestTimings, method: str, path: str, status: int):
+        self.request_seconds.observe(time.perf_counter() - timings.started, method, path)
+        self.requests.inc(1, method, path, str(status))
+        self.request_documents_read.observe(timings.documents_read, path)
+        self.request_documents_written.observe(timings.documents_written, path)
+
+    def count_reads(self, documents: int):
+        self.documents_read.inc(documents)
+        timings = _current_request.get()
+        if timings is not None:
+            timings.documents_read += documents
+
+    def count_writes(self, documents: int):
+        self.documents_written.inc(documents)
+        timings = _current_request.get()
+        if timings is not None:
+            timings.documents_written += documents
+
+    def count_fit(self, model: str):
+        self.model_fits.inc(1, model)
+
+    def render(self, gauges: Dict[str, dict] = None) -> str:
+        """
+        Texto para /metrics. gauges: prefijo -> diccionario de estadísticas (p. ej. cache.stats());
+        cada valor numérico se publica como el gauge prefijo_clave.
+        """
+        lines = []
+        for metric in (self.requests, self.request_seconds, self.stage_seconds, self.request_documents_read,
+                       self.request_documents_written, self.documents_read, self.documents_written,
+                       self.model_fits):
+            lines.extend(metric.render())
+        for prefix, stats in (gauges or {}).items():
+            for key, value in stats.items():
+                if isinstance(value, (bool, int, float)):
+                    lines.append(f'# TYPE {prefix}_{key} gauge')
+                    lines.append(f'{prefix}_{key} {float(value):g}')
+        return '\n'.join(lines) + '\n'
+
+# Métricas compartidas por todo el proceso
+metrics = Metrics()
+
+@contextmanager
+def timed(stage: str):
+    """
+    Mide un bloque (o una función, usado como decorador) como la etapa stage: se observa en
+    smartfeature_stage_seconds y se suma al desglose de la petición en curso.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.stage_seconds.observe(elapsed, stage)
+        timings = _current_request.get()
+        if timings is not None:
+            timings.stages[stage] = timings.stages.get(stage, 0.0) + elapsed
@@ -0,0 +1,19 @@
+from contextlib import contextmanager
+from threading import Lock
+
+class ModelBusy(Exception):
+    """El lock del modelo lo tiene otro hilo y se pidió no esperarlo."""
+
+@contextmanager
+def holding(lock: Lock, wait: bool = True):
+    """
+    Toma el lock de un modelo por usuario mientras dura el bloque. Con wait=False (desde el event
+    loop) no espera: si otro hilo lo tiene (p. ej. ajustando el modelo) lanza ModelBusy, y quien
+    llama decide correr el análisis en un hilo en lugar de bloquear el loop.
+    """
+    if not lock.acquire(blocking=wait):
+        raise ModelBusy()
+    try:
+        yield
+    finally:
+        lock.release()
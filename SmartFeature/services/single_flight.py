@@ -0,0 +1,36 @@
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+import asyncio
+
+T = TypeVar('T')
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Junta llamadas concurrentes con la misma clave: la primera ejecuta la operación y las que
+        llegan mientras está en curso esperan ese mismo resultado (o excepción) en vez de repetirla.
+        La operación corre en su propia tarea, así que si quien la inició se cancela (p. ej. el
+        cliente cortó la conexión) las demás la siguen esperando.
+        """
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0  # Llamadas que esperaron una operación ya en curso
+
+    async def do(self, key: Hashable, operation: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.get_running_loop().create_task(operation())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), "calls": self.calls, "shared": self.shared}
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Marca la excepción como recuperada aunque nadie la haya esperado
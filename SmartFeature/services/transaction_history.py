@@ -0,0 +1,330 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from models import Transaction, Location
+import datetime
+import numpy as np
+
+# Columnas de objetos (texto u opcionales) que se guardan tal cual
+_OBJECT_FIELDS = ('transactionName', 'locationAnomaly', 'amountAnomaly', 'geohash')
+
+def _to_datetime64(value: datetime.datetime) -> np.datetime64:
+    """datetime (con o sin zona) a datetime64[us] en UTC."""
+    return np.datetime64(_naive_utc(value), 'us')
+
+def _naive_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+class TransactionHistory:
+    def __init__(self, transactions: Iterable[Transaction] = (), account_ids: Iterable[str] = (),
+                 transaction_accounts: Dict[str, str] = None):
+        """
+        Historial de transacciones de un usuario ordenado por dateTime, guardado por columnas
+        (arreglos de NumPy) en lugar de un objeto Transaction por documento: los detectores leen
+        montos, tipos y coordenadas directamente de los arreglos, y los modelos de Pydantic solo
+        se crean al responder (get, transaction_at, transactions).
+
+        Los prefijos (before, prefix) son vistas de las columnas halladas por búsqueda binaria y
+        comparten los índices de posiciones por tipo y con ubicación, así que analizar una
+        transacción contra su prefijo no copia ni recorre el historial.
+
+        Guarda también la marca de agua (dateTime más reciente) que permite pedir a Firestore solo
+        lo escrito después, y un índice transaction_id -> posición para encontrar la transacción
+        a analizar sin recorrer el historial.
+
+        Args:
+            transactions (Iterable[Transaction]): Transacciones ya ordenadas por dateTime.
+            account_ids (Iterable[str]): Cuentas del usuario de las que se leyó el historial.
+            transaction_accounts (Dict[str, str]): Cuenta a la que pertenece cada transacción,
+                para escribir en su documento sin buscarlo.
+        """
+        records = [{
+            'transaction_id': t.transaction_id,
+            'amount': t.amount,
+            'dateTime': t.dateTime,
+            'location': (t.location.latitude, t.location.longitude) if t.location else None,
+            'transactionName': t.transactionName,
+            'transactionType': t.transactionType,
+            'locationAnomaly': t.locationAnomaly,
+            'amountAnomaly': t.amountAnomaly,
+            'geohash': t.geohash
+        } for t in transactions]
+        self._set_columns(records)
+        self._positions: Dict[str, int] = {t_id: position for position, t_id in enumerate(self.ids)}
+        self._size = len(self.ids)
+        self.account_ids = set(account_ids)
+        self._transaction_accounts: Dict[str, str] = transaction_accounts or {}
+
+    @classmethod
+    def from_records(cls, records: List[dict], account_ids: Iterable[str] = (),
+                     transaction_accounts: Dict[str, str] = None) -> "TransactionHistory":
+        """
+        Crea el historial a partir de registros con los campos de Transaction (location como
+        (latitud, longitud) o None), en cualquier orden, sin crear modelos de Pydantic.
+        """
+        history = cls((), account_ids, transaction_accounts)
+        history._set_columns(records, ordered=False)
+        history._positions = {t_id: position for position, t_id in enumerate(history.ids)}
+        history._size = len(history.ids)
+        return history
+
+    @classmethod
+    def coerce(cls, transactions: Union["TransactionHistory", Sequence[Transaction]]) -> "TransactionHistory":
+        """Devuelve el historial tal cual, o uno nuevo si se recibe una lista de Transaction ordenada."""
+        return transactions if isinstance(transactions, TransactionHistory) else cls(transactions)
+
+    def _set_columns(self, records: List[dict], ordered: bool = True):
+        size = len(records)
+        self.ids = np.array([record['transaction_id'] for record in records], dtype=object)
+        self.timestamps = np.array([_naive_utc(record['dateTime']) for record in records],
+                                   dtype='datetime64[us]').reshape(size)
+        self.amounts = np.array([record['amount'] for record in records], dtype=float).reshape(size)
+
+        # Tipo como código categórico: type_names[type_codes[i]]
+        codes = {}
+        self.type_codes = np.array([codes.setdefault(record['transactionType'], len(codes)) for record in records],
+                                   dtype=np.int16).reshape(size)
+        self.type_names: List[str] = list(codes)
+
+        # Coordenadas con NaN donde no hay ubicación
+        coordinates = np.array([record['location'] or (np.nan, np.nan) for record in records],
+                               dtype=float).reshape(size, 2)
+        self.latitudes = coordinates[:, 0].copy()
+        self.longitudes = coordinates[:, 1].copy()
+
+        self._objects = {field: np.array([record.get(field) for record in records], dtype=object).reshape(size)
+                         for field in _OBJECT_FIELDS}
+        # Zona horaria con la que se devuelven los dateTime (las de Firestore vienen en UTC)
+        aware = bool(records) and records[0]['dateTime'].tzinfo is not None
+        self._tz = datetime.timezone.utc if aware else None
+
+        if not ordered:
+            order = np.argsort(self.timestamps, kind='stable')
+            for name in ('ids', 'timestamps', 'amounts', 'type_codes', 'latitudes', 'longitudes'):
+                setattr(self, name, getattr(self, name)[order])
+            self._objects = {field: column[order] for field, column in self._objects.items()}
+        self._indexes = {}
+        self._full = None  # Historial del que este es un prefijo (None si no es un prefijo)
+
+    @property
+    def has_location(self) -> np.ndarray:
+        """Máscara de las transacciones con ubicación."""
+        return ~np.isnan(self.latitudes)
+
+    @property
+    def high_water_mark(self) -> Optional[datetime.datetime]:
+        """dateTime de la transacción más reciente, o None si el historial está vacío."""
+        return self._to_datetime(self.timestamps[-1]) if self._size else None
+
+    def located_positions(self) -> np.ndarray:
+        """Posiciones (crecientes) de las transacciones con ubicación."""
+        return self._index('located', lambda full: np.flatnonzero(~np.isnan(full.latitudes)))
+
+    def type_positions(self, transaction_type: str) -> np.ndarray:
+        """Posiciones (crecientes) de las transacciones de ese tipo."""
+        code = self.type_code(transaction_type)
+        if code < 0:
+            return np.empty(0, dtype=np.intp)
+        return self._index(code, lambda full: np.flatnonzero(full.type_codes == code))
+
+    def _index(self, key, build) -> np.ndarray:
+        # Los índices se calculan una vez sobre el historial completo y los prefijos los comparten:
+        # el de un prefijo es una vista hasta la primera posición >= su tamaño (búsqueda binaria),
+        # así analizar cada prefijo no vuelve a recorrer las columnas.
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes.setdefault(key, build(self._full or self))
+        if len(index) and index[-1] >= self._size:
+            return index[:int(np.searchsorted(index, self._size))]
+        return index
+
+    def type_code(self, transaction_type: str) -> int:
+        """Código del tipo en type_codes, o -1 si ninguna transacción del historial es de ese tipo."""
+        try:
+            return self.type_names.index(transaction_type)
+        except ValueError:
+            return -1
+
+    def hours_since(self, position: int, date_time: datetime.datetime) -> float:
+        """Horas entre la transacción en position y date_time."""
+        return float((_to_datetime64(date_time) - self.timestamps[position]) / np.timedelta64(1, 'h'))
+
+    def before(self, date_time: datetime.datetime) -> "TransactionHistory":
+        """Prefijo con las transacciones de dateTime estrictamente menor (búsqueda binaria)."""
+        return self.prefix(int(np.searchsorted(self.timestamps, _to_datetime64(date_time), side='left')))
+
+    def prefix(self, stop: int) -> "TransactionHistory":
+        """Las primeras stop transacciones. Los arreglos son vistas de los de este historial."""
+        if stop >= self._size:
+            return self
+        view = TransactionHistory.__new__(TransactionHistory)
+        view.ids = self.ids[:stop]
+        view.timestamps = self.timestamps[:stop]
+        view.amounts = self.amounts[:stop]
+        view.type_names = self.type_names
+        view.type_codes = self.type_codes[:stop]
+        view.latitudes = self.latitudes[:stop]
+        view.longitudes = self.longitudes[:stop]
+        view._objects = {field: column[:stop] for field, column in self._objects.items()}
+        view._tz = self._tz
+        view._positions = self._positions  # Compartido: las posiciones >= stop no son del prefijo
+        view._indexes = self._indexes      # Compartido, igual que _positions
+        view._full = self._full or self
+        view._size = stop
+        view.account_ids = self.account_ids
+        view._transaction_accounts = self._transaction_accounts
+        return view
+
+    def transaction_at(self, position: int) -> Transaction:
+        """Crea el Transaction de la posición dada."""
+        return self._materialize(slice(position, position + 1))[0]
+
+    @property
+    def transactions(self) -> List[Transaction]:
+        """Todas las transacciones como modelos de Pydantic (para responder; evitar en el camino caliente)."""
+        return self._materialize(slice(0, self._size))
+
+    def _materialize(self, rows: slice) -> List[Transaction]:
+        # Las columnas se pasan a listas de Python en bloque: indexar arreglos fila por fila es lento
+        date_times = self.timestamps[rows].astype(datetime.datetime).tolist()
+        if self._tz is not None:
+            date_times = [date_time.replace(tzinfo=self._tz) for date_time in date_times]
+        type_names = [self.type_names[code] for code in self.type_codes[rows].tolist()]
+        objects = {field: column[rows].tolist() for field, column in self._objects.items()}
+
+        transactions = []
+        for i, (transaction_id, amount, latitude, longitude) in enumerate(zip(
+                self.ids[rows].tolist(), self.amounts[rows].tolist(),
+                self.latitudes[rows].tolist(), self.longitudes[rows].tolist())):
+            transactions.append(Transaction(
+                transaction_id=transaction_id,
+                amount=amount,
+                dateTime=date_times[i],
+                location=Location(latitude=latitude, longitude=longitude) if latitude == latitude else None,  # NaN != NaN
+                transactionName=objects['transactionName'][i],
+                transactionType=type_names[i],
+                locationAnomaly=objects['locationAnomaly'][i],
+                amountAnomaly=objects['amountAnomaly'][i],
+                geohash=objects['geohash'][i]
+            ))
+        return transactions
+
+    def field(self, name: str) -> np.ndarray:
+        """Columna de objetos: transactionName, locationAnomaly, amountAnomaly o geohash."""
+        return self._objects[name]
+
+    def get(self, transaction_id: str) -> Optional[Transaction]:
+        """Devuelve la transacción con ese id, o None si no está en el historial."""
+        position = self.position(transaction_id)
+        return self.transaction_at(position) if position is not None else None
+
+    def position(self, transaction_id: str) -> Optional[int]:
+        """Posición de la transacción en el historial ordenado, o None si no está."""
+        position = self._positions.get(transaction_id)
+        return position if position is not None and position < self._size else None
+
+    def location_of(self, transaction_id: str) -> Optional[Tuple[float, float]]:
+        """(latitud, longitud) de la transacción, o None si no tiene ubicación o no está."""
+        position = self.position(transaction_id)
+        if position is None or np.isnan(self.latitudes[position]):
+            return None
+        return float(self.latitudes[position]), float(self.longitudes[position])
+
+    def account_of(self, transaction_id: str) -> Optional[str]:
+        """Cuenta a la que pertenece la transacción, o None si no se conoce."""
+        return self._transaction_accounts.get(transaction_id)
+
+    def merge(self, new_transactions: Union["TransactionHistory", List[Transaction]], account_ids: Iterable[str] = (),
+              transaction_accounts: Dict[str, str] = None) -> "TransactionHistory":
+        """
+        Devuelve un nuevo historial con las transacciones nuevas intercaladas en orden: sus
+        posiciones salen de una búsqueda binaria y cada columna se inserta de una vez.
+        Las transacciones que ya estaban en el historial se ignoran.
+        """
+        new = TransactionHistory.coerce(new_transactions)
+        fresh = np.flatnonzero([t_id not in self for t_id in new.ids])
+        # Las nuevas pueden venir desordenadas (varias cuentas o una lista): se ordenan solo ellas
+        fresh = fresh[np.argsort(new.timestamps[fresh], kind='stable')]
+
+        accounts = dict(self._transaction_accounts)
+        accounts.update(transaction_accounts or {})
+        merged = self._copy(self.account_ids | set(account_ids), accounts)
+        if not len(fresh):
+            return merged
+
+        # Tras las de igual dateTime, como un merge estable con el historial existente primero
+        at = np.searchsorted(self.timestamps, new.timestamps[fresh], side='right')
+        type_names = list(self.type_names)
+        for name in new.type_names:
+            if name not in type_names:
+                type_names.append(name)
+        remap = np.array([type_names.index(name) for name in new.type_names], dtype=np.int16)
+
+        merged.ids = np.insert(self.ids, at, new.ids[fresh])
+        merged.timestamps = np.insert(self.timestamps, at, new.timestamps[fresh])
+        merged.amounts = np.insert(self.amounts, at, new.amounts[fresh])
+        merged.type_names = type_names
+        merged.type_codes = np.insert(self.type_codes, at, remap[new.type_codes[fresh]])
+        merged.latitudes = np.insert(self.latitudes, at, new.latitudes[fresh])
+        merged.longitudes = np.insert(self.longitudes, at, new.longitudes[fresh])
+        merged._objects = {field: np.insert(column, at, new._objects[field][fresh])
+                           for field, column in self._objects.items()}
+        if not self._size:
+            merged._tz = new._tz
+        merged._positions = {t_id: position for position, t_id in enumerate(merged.ids)}
+        merged._indexes = {}
+        merged._full = None
+        merged._size = len(merged.ids)
+        return merged
+
+    def upsert(self, transaction: Transaction, account_id: str = None) -> "TransactionHistory":
+        """Devuelve un nuevo historial con la transacción insertada o reemplazada en su posición."""
+        remaining = self
+        position = self.position(transaction.transaction_id)
+        if position is not None:
+            keep = np.arange(self._size) != position
+            remaining = self._copy(self.account_ids, self._transaction_accounts, keep)
+        accounts = {transaction.transaction_id: account_id} if account_id else None
+        return remaining.merge([transaction], transaction_accounts=accounts)
+
+    def with_flags(self, updates: Dict[str, dict]) -> "TransactionHistory":
+        """
+        Devuelve un nuevo historial con los campos de anomalía (y geohash) actualizados
+        (transaction_id -> {'locationAnomaly': ..., 'amountAnomaly': ...}).
+        """
+        updated = self._copy(self.account_ids, self._transaction_accounts)
+        updated._objects = {field: column.copy() for field, column in self._objects.items()}
+        for transaction_id, update_data in updates.items():
+            position = self.position(transaction_id)
+            if position is None:
+                continue
+            for field, value in update_data.items():
+                if field in updated._objects:
+                    updated._objects[field][position] = value
+        return updated
+
+    def _copy(self, account_ids, transaction_accounts, keep: np.ndarray = None) -> "TransactionHistory":
+        """Historial con las mismas columnas (o solo las filas keep) y otras cuentas."""
+        copy = TransactionHistory.__new__(TransactionHistory)
+        copy.__dict__.update(self.__dict__)
+        if keep is not None:
+            for name in ('ids', 'timestamps', 'amounts', 'type_codes', 'latitudes', 'longitudes'):
+                setattr(copy, name, getattr(self, name)[keep])
+            copy._objects = {field: column[keep] for field, column in self._objects.items()}
+            copy._positions = {t_id: position for position, t_id in enumerate(copy.ids)}
+            copy._indexes = {}
+            copy._full = None
+            copy._size = len(copy.ids)
+        copy.account_ids = set(account_ids)
+        copy._transaction_accounts = transaction_accounts
+        return copy
+
+    def _to_datetime(self, value: np.datetime64) -> datetime.datetime:
+        date_time = value.astype('datetime64[us]').astype(datetime.datetime)
+        return date_time.replace(tzinfo=self._tz) if self._tz is not None else date_time
+
+    def __contains__(self, transaction_id: str) -> bool:
+        return self.position(transaction_id) is not None
+
+    def __len__(self) -> int:
+        return self._size
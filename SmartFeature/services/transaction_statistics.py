@@ -0,0 +1,205 @@
+from bisect import insort
+from threading import Lock
+from typing import Dict, List, Optional
+from services.transaction_history import TransactionHistory
+import math
+import numpy as np
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        """
+        Sketch de cuantiles con error relativo acotado (DDSketch): cada valor cae en un
+        bucket logarítmico y solo se guardan los conteos por bucket. La memoria queda acotada a
+        max_bins buckets.
+
+        Args:
+            relative_accuracy (float): Error relativo máximo de un cuantil (0.01 = 1%).
+            max_bins (int): Buckets máximos; al superarlo se juntan los de valores más pequeños.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}  # Buckets de |valor| para valores negativos
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zeros += count
+        self.count += count
+        self._collapse()
+
+    def extend(self, values: np.ndarray):
+        """Agrega muchos valores de una vez (los buckets se calculan vectorizados)."""
+        values = np.asarray(values, dtype=float)
+        for store, magnitudes in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if len(magnitudes):
+                keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma), return_counts=True)
+                for key, count in zip(keys.astype(int).tolist(), counts.tolist()):
+                    store[key] = store.get(key, 0) + count
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+        self._collapse()
+
+    def value_at_rank(self, rank: int) -> float:
+        """Valor aproximado del elemento en la posición rank (desde 0) de los valores ordenados."""
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        raise IndexError("rank out of range")
+
+    def median(self) -> float:
+        """Mediana como np.median: promedio de los dos centrales si la cantidad es par."""
+        middle = (self.count - 1) / 2
+        return (self.value_at_rank(math.floor(middle)) + self.value_at_rank(math.ceil(middle))) / 2
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # Punto del bucket (gamma^(k-1), gamma^k] con error relativo <= relative_accuracy
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def _collapse(self):
+        # Se juntan los buckets de menor magnitud: los cuantiles altos y la mediana no se afectan
+        while len(self.positive) + len(self.negative) > self.max_bins:
+            store = self.positive if len(self.positive) >= len(self.negative) else self.negative
+            smallest, second = sorted(store)[:2]
+            store[second] += store.pop(smallest)
+
+class TypeStatistics:
+    def __init__(self, exact_limit: int = 1024, relative_accuracy: float = 0.01):
+        """
+        Conteo, mínimo, máximo y mediana de los montos de un tipo de transacción. Hasta
+        exact_limit montos se guardan ordenados y la mediana es exacta; después se pasan a un
+        QuantileSketch y la mediana tiene error relativo <= relative_accuracy.
+        """
+        self.exact_limit = exact_limit
+        self.relative_accuracy = relative_accuracy
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self._values: Optional[List[float]] = []   # None cuando ya se usa el sketch
+        self._sketch: Optional[QuantileSketch] = None
+
+    def add(self, amount: float):
+        self.count += 1
+        self.min = amount if self.min is None else min(self.min, amount)
+        self.max = amount if self.max is None else max(self.max, amount)
+        if self._values is not None:
+            insort(self._values, amount)
+            if len(self._values) > self.exact_limit:
+                self._to_sketch()
+        else:
+            self._sketch.add(amount)
+
+    def extend(self, amounts: np.ndarray):
+        """Agrega muchos montos de una vez; mismo estado final que add con cada uno."""
+        if not len(amounts):
+            return
+        self.count += len(amounts)
+        low, high = float(np.min(amounts)), float(np.max(amounts))
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        if self._values is not None and len(self._values) + len(amounts) <= self.exact_limit:
+            self._values = np.sort(np.concatenate((self._values, amounts))).tolist()
+            return
+        if self._values is not None:
+            self._to_sketch()
+        self._sketch.extend(amounts)
+
+    def median(self) -> float:
+        if self._values is None:
+            return self._sketch.median()
+        middle = (len(self._values) - 1) / 2
+        return (self._values[math.floor(middle)] + self._values[math.ceil(middle)]) / 2
+
+    def _to_sketch(self):
+        self._sketch = QuantileSketch(self.relative_accuracy)
+        self._sketch.extend(self._values)
+        self._values = None
+
+class StatisticsAggregate:
+    def __init__(self, exact_limit: int = 1024, relative_accuracy: float = 0.01):
+        """
+        Agregado incremental de estadísticas de montos de un usuario por transactionType.
+        Se actualiza con cada transacción nueva, ocupa memoria acotada y produce el mismo
+        diccionario que AmountAnomalyService.get_transaction_statistics sin recorrer el historial.
+        Vive solo en memoria: se reconstruye del historial en caché con una pasada vectorizada.
+        """
+        self.exact_limit = exact_limit
+        self.relative_accuracy = relative_accuracy
+        self.by_type: Dict[str, TypeStatistics] = {}
+        self.size = 0                                     # Transacciones absorbidas (de todos los tipos)
+        self.last_transaction_id: Optional[str] = None    # Última transacción absorbida
+        self.lock = Lock()  # Quien lee o actualiza el modelo lo toma (ver services.model_locks)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, transaction_type: str, amount: float, transaction_id: str = None):
+        statistics = self.by_type.get(transaction_type)
+        if statistics is None:
+            statistics = self.by_type[transaction_type] = TypeStatistics(self.exact_limit, self.relative_accuracy)
+        statistics.add(amount)
+        self.size += 1
+        self.last_transaction_id = transaction_id
+
+    def extend(self, history: TransactionHistory, start: int = 0):
+        """Absorbe las transacciones del historial desde la posición start (por tipo, vectorizado)."""
+        if start >= len(history):
+            return
+        type_codes, amounts = history.type_codes[start:len(history)], history.amounts[start:len(history)]
+        for code in np.unique(type_codes).tolist():
+            transaction_type = history.type_names[code]
+            statistics = self.by_type.get(transaction_type)
+            if statistics is None:
+                statistics = self.by_type[transaction_type] = TypeStatistics(self.exact_limit, self.relative_accuracy)
+            statistics.extend(amounts[type_codes == code])
+        self.size += len(history) - start
+        self.last_transaction_id = history.ids[len(history) - 1]
+
+    def reset(self, history: TransactionHistory):
+        """Reemplaza el contenido por las transacciones del historial."""
+        self.by_type = {}
+        self.size = 0
+        self.last_transaction_id = None
+        self.extend(history)
+
+    def stored_values(self) -> int:
+        """Montos guardados en orden más buckets de sketch, sumando todos los tipos."""
+        return sum(len(statistics._values) if statistics._values is not None else
+                   len(statistics._sketch.positive) + len(statistics._sketch.negative)
+                   for statistics in self.by_type.values())
+
+    def statistics(self) -> dict:
+        """Mismas claves que get_transaction_statistics (income_* y expense_*)."""
+        stats = {}
+        for transaction_type, type_name in (("Income", "income"), ("Expense", "expense")):
+            statistics = self.by_type.get(transaction_type)
+            if statistics is None or statistics.count == 0:
+                continue
+            stats.update({
+                f"{type_name}_median": float(statistics.median()),
+                f"{type_name}_min": float(statistics.min),
+                f"{type_name}_max": float(statistics.max),
+                f"{type_name}_count": statistics.count
+            })
+        return stats
@@ -0,0 +1,65 @@
+from typing import Callable, Dict, Optional
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Warmup:
+    def __init__(self, steps: Dict[str, Callable]):
+        """
+        Pasos de arranque en orden (nombre -> función). Los síncronos (imports pesados, ajustes de
+        prueba) corren en un hilo para no bloquear el event loop; las corrutinas, en el loop.
+        Registra cuánto tardó cada paso y si el servicio quedó listo (para /ready).
+        """
+        self.steps = steps
+        self.durations: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    async def run(self):
+        """Corre todos los pasos; si uno falla, el servicio no queda listo y el error se reporta."""
+        self.started_at = time.perf_counter()
+        for name, step in self.steps.items():
+            began = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(step):
+                    await step()
+                else:
+                    await asyncio.to_thread(step)
+            except Exception as e:
+                self.error = f"{name}: {str(e)}"
+                logger.error(f"Warm-up step {name} failed: {str(e)}")
+                raise
+            self.durations[name] = time.perf_counter() - began
+        self.ready_at = time.perf_counter()
+
+    def start(self) -> asyncio.Task:
+        """Corre los pasos en segundo plano (arranque perezoso): la app atiende mientras tanto."""
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "pending": [name for name in self.steps if name not in self.durations],
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.durations.items()},
+            "warmup_ms": round((self.ready_at - self.started_at) * 1000, 1) if self.ready else None
+        }